@@ -0,0 +1,147 @@
+"""Prova con più processi: presa in carico con lease senza invii doppi.
+
+Avvia più worker, ognuno in un proprio processo, sullo stesso file SQLite.
+Ogni worker fa quello che fa lo scheduler: prende in carico un lotto,
+rinnova il lease, "invia" (registra l'invio nel proprio file) e completa
+l'occorrenza. Con --crash il primo worker termina di colpo a metà del primo
+lotto, tenendo i lease delle occorrenze non inviate, che gli altri devono
+riprendere alla scadenza. Alla fine ogni occorrenza deve risultare inviata
+esattamente una volta.
+
+Uso (dalla cartella smsbot3):
+    python -m benchmarks.claim_workers [--workers 4] [--messages 2000] [--crash]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytz
+
+from database.database import DatabaseManager
+from database.models import MessageType
+
+
+def build_messages(count: int, now: datetime) -> list:
+    """Messaggi singoli già scaduti, distribuiti su 50 chat."""
+    return [
+        {
+            'chat_id': -1000 - index % 50,
+            'message_type': MessageType.TEXT,
+            'text': f"Messaggio {index + 1}",
+            'send_time': now - timedelta(seconds=index % 60),
+            'pin': False,
+            'active': True,
+            'recurrence_type': 'once',
+            'schedule_hour': now.hour,
+            'schedule_minute': now.minute,
+        }
+        for index in range(count)
+    ]
+
+
+def pending_count() -> int:
+    with DatabaseManager._connect() as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM message_occurrences WHERE status = 'pending'"
+        ).fetchone()[0]
+
+
+def run_worker(db_path: str, worker_id: str, sends_path: str, lease_seconds: float,
+               batch_size: int, send_seconds: float, crash: bool) -> None:
+    logging.basicConfig(level=logging.WARNING, format=f'{worker_id} %(levelname)s - %(message)s')
+    DatabaseManager.DB_PATH = Path(db_path)
+    lease = timedelta(seconds=lease_seconds)
+
+    with open(sends_path, 'w', encoding='utf-8') as sends:
+        while pending_count():
+            now = datetime.now(pytz.UTC)
+            claimed = DatabaseManager.claim_due_occurrences(worker_id, now, lease, limit=batch_size)
+            if not claimed:
+                # Occorrenze in mano ad altri worker (o a uno caduto, fino alla scadenza del lease)
+                time.sleep(0.05)
+                continue
+
+            for index, (message, scheduled_time) in enumerate(claimed):
+                if crash and index == len(claimed) // 2:
+                    # Arresto brusco: niente rilascio dei lease, niente pulizia
+                    os._exit(1)
+                expires = datetime.now(pytz.UTC) + lease
+                if not DatabaseManager.renew_lease(worker_id, message.id, scheduled_time, expires):
+                    continue
+                time.sleep(send_seconds)
+                sends.write(f"{message.id},{scheduled_time},{worker_id}\n")
+                sends.flush()
+                DatabaseManager.complete_occurrence(message.id, scheduled_time, worker_id)
+                DatabaseManager.mark_as_sent(message.id)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.claim_workers',
+        description="Verifica con più processi che nessuna occorrenza venga inviata due volte."
+    )
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--lease', type=float, default=3.0,
+                        help="durata del lease in secondi")
+    parser.add_argument('--send-ms', type=float, default=1.0,
+                        help="durata simulata di ogni invio in millisecondi")
+    parser.add_argument('--crash', action='store_true',
+                        help="il primo worker termina di colpo a metà del primo lotto")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        DatabaseManager.DB_PATH = Path(tmp_dir) / 'claims.db'
+        DatabaseManager.init_db()
+        now = datetime.now(pytz.UTC)
+        DatabaseManager.import_scheduled_messages(build_messages(args.messages, now))
+        expected = DatabaseManager.expand_occurrences(now, timedelta(hours=1))
+
+        # spawn: processi indipendenti come worker veri, senza stato ereditato
+        context = multiprocessing.get_context('spawn')
+        workers = []
+        started = time.perf_counter()
+        for index in range(args.workers):
+            worker_id = f"worker-{index + 1}"
+            process = context.Process(target=run_worker, args=(
+                str(DatabaseManager.DB_PATH), worker_id, str(Path(tmp_dir) / f"{worker_id}.csv"),
+                args.lease, args.batch_size, args.send_ms / 1000, args.crash and index == 0
+            ))
+            process.start()
+            workers.append((worker_id, process))
+        for _, process in workers:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        sends = Counter()
+        per_worker = Counter()
+        for worker_id, _ in workers:
+            with open(Path(tmp_dir) / f"{worker_id}.csv", encoding='utf-8') as file:
+                for line in file:
+                    message_id, scheduled_time, _ = line.rstrip('\n').split(',')
+                    sends[(message_id, scheduled_time)] += 1
+                    per_worker[worker_id] += 1
+        remaining = pending_count()
+
+    duplicates = sum(1 for count in sends.values() if count > 1)
+    print(f"Worker: {args.workers}{' (il primo termina di colpo)' if args.crash else ''}")
+    print(f"Occorrenze: {expected}, inviate: {len(sends)}, invii: {sum(sends.values())}")
+    print(f"Invii per worker: {', '.join(f'{w} {per_worker[w]}' for w, _ in workers)}")
+    print(f"Uscite: {', '.join(f'{w} {p.exitcode}' for w, p in workers)}")
+    print(f"Tempo: {elapsed:.2f}s")
+    print(f"Invii doppi: {duplicates}, occorrenze non inviate: {expected - len(sends)} "
+          f"(ancora in attesa: {remaining})")
+    return 0 if not duplicates and len(sends) == expected else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Benchmark: calcolo del prossimo invio per 100k programmazioni cron.
+
+Uso (dalla cartella smsbot3):
+    python -m benchmarks.cron_next [numero_programmazioni]
+"""
+import random
+import sys
+import time
+from datetime import datetime
+
+import pytz
+
+from database.cron import compile_cron
+
+# Modelli realistici: la maggior parte delle programmazioni condivide poche espressioni
+PATTERNS = [
+    "{m} {h} * * *",
+    "{m} {h} * * 1-5",
+    "{m} 8,17 * * mon-fri",
+    "{m} {h} * * mon#1",
+    "{m} {h} * * friL",
+    "{m} {h} L * *",
+    "{m} {h} 1,15 * *",
+    "*/15 {h}-{h2} * * *",
+    "{m} {h} * jan,apr,jul,oct sun#2",
+    "{m} {h} 29 2 *",
+]
+
+
+def build_expressions(count: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    expressions = []
+    for _ in range(count):
+        hour = rnd.randrange(0, 22)
+        expressions.append(rnd.choice(PATTERNS).format(
+            m=rnd.randrange(0, 60), h=hour, h2=hour + 2
+        ))
+    return expressions
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    expressions = build_expressions(count)
+    now = datetime.now(pytz.UTC)
+
+    start = time.perf_counter()
+    compiled = [compile_cron(expression) for expression in expressions]
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    next_times = [cron.next_after(now) for cron in compiled]
+    next_time = time.perf_counter() - start
+
+    print(f"Programmazioni: {count} ({len(set(expressions))} espressioni distinte)")
+    print(f"Compilazione: {compile_time:.3f}s")
+    print(f"Prossimo invio: {next_time:.3f}s ({next_time / count * 1e6:.1f} µs per programmazione)")
+    print(f"Senza occorrenze future: {next_times.count(None)}")
+    cache = compile_cron.cache_info()
+    print(f"Cache delle espressioni: {cache.currsize}/{cache.maxsize}, "
+          f"{cache.hits} riusi, {cache.misses} compilazioni")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+import inspect
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Type, Union
+
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery
+
+logger = logging.getLogger(__name__)
+
+# I pulsanti senza parametri (es. "main_menu") usano come callback_data il
+# proprio nome; quelli con parametri usano le factory qui sotto, che producono
+# "prefisso:valore:..." e vengono instradate sul prefisso.
+
+
+class GroupCallback(CallbackData, prefix="grp"):
+    target: str  # "1", "2" o "both"
+
+
+class PinCallback(CallbackData, prefix="pin"):
+    pin: bool
+
+
+class ScheduleGroupCallback(CallbackData, prefix="sgrp"):
+    target: str  # "1", "2" o "both"
+
+
+class ScheduleTypeCallback(CallbackData, prefix="stype"):
+    kind: str
+
+
+class DayCallback(CallbackData, prefix="day"):
+    day: str  # codice del giorno o "confirm"
+
+
+class SchedulePinCallback(CallbackData, prefix="spin"):
+    pin: bool
+
+
+class PriorityCallback(CallbackData, prefix="prio"):
+    priority: int
+
+
+class FilterCallback(CallbackData, prefix="flt"):
+    group: str  # "group1", "group2" o "all"
+
+
+class DetailsCallback(CallbackData, prefix="det"):
+    message_id: int
+
+
+class PreviewCallback(CallbackData, prefix="prv"):
+    message_id: int
+
+
+class ToggleCallback(CallbackData, prefix="tgl"):
+    message_id: int
+
+
+class DeleteCallback(CallbackData, prefix="del"):
+    message_id: int
+
+
+class ConfirmDeleteCallback(CallbackData, prefix="cdel"):
+    message_id: int
+    confirm: bool
+
+
+class SearchPageCallback(CallbackData, prefix="srch"):
+    page: int
+
+
+class DeadLetterCallback(CallbackData, prefix="dlq"):
+    action: str  # "requeue" o "purge"
+    dead_letter_id: int = 0
+
+
+class StatsCallback(CallbackData, prefix="stats"):
+    days: int
+
+
+class BulkActionCallback(CallbackData, prefix="bulk"):
+    action: str
+
+
+class BulkConfirmCallback(CallbackData, prefix="bulkok"):
+    action: str
+
+
+class ExportCallback(CallbackData, prefix="exp"):
+    fmt: str  # "csv" o "jsonl"
+
+
+Handler = Callable[..., Awaitable]
+
+
+class CallbackRouter:
+    """Instrada i callback con una sola ricerca nella tabella dei prefissi.
+
+    Sostituisce un filtro per handler valutato in sequenza a ogni pressione:
+    il costo non cresce con il numero di menu registrati. Gli handler
+    ricevono `callback_data` (già decodificato) e `state` solo se li dichiarano.
+    """
+
+    # Separatore predefinito delle factory CallbackData
+    SEPARATOR = ":"
+
+    def __init__(self):
+        self._routes: Dict[str, Tuple[Optional[Type[CallbackData]], Handler, bool, bool]] = {}
+
+    def register(self, key: Union[str, Type[CallbackData]], handler: Handler) -> None:
+        """Associa un handler a una factory CallbackData o al callback_data di un pulsante fisso."""
+        if isinstance(key, str):
+            if self.SEPARATOR in key:
+                raise ValueError(f"Il callback_data di un pulsante fisso non può contenere '{self.SEPARATOR}': {key}")
+            prefix, factory = key, None
+        else:
+            if key.__separator__ != self.SEPARATOR:
+                raise ValueError(f"{key.__name__} deve usare il separatore '{self.SEPARATOR}'")
+            prefix, factory = key.__prefix__, key
+
+        if prefix in self._routes:
+            raise ValueError(f"Prefisso di callback già registrato: {prefix}")
+
+        parameters = inspect.signature(handler).parameters
+        self._routes[prefix] = (factory, handler, 'state' in parameters, 'callback_data' in parameters)
+
+    async def dispatch(self, callback: CallbackQuery, state: FSMContext):
+        """Handler unico registrato nel dispatcher per tutti i callback."""
+        data = callback.data or ''
+        route = self._routes.get(data.split(self.SEPARATOR, 1)[0])
+        if route is None:
+            logger.warning(f"Callback senza handler: {data}")
+            await callback.answer("⚠️ Pulsante non più valido.", show_alert=True)
+            return
+
+        factory, handler, wants_state, wants_data = route
+        kwargs = {}
+        if wants_state:
+            kwargs['state'] = state
+        if wants_data:
+            try:
+                kwargs['callback_data'] = factory.unpack(data) if factory else None
+            except (TypeError, ValueError):
+                logger.warning(f"Callback non valido: {data}")
+                await callback.answer("⚠️ Pulsante non più valido.", show_alert=True)
+                return
+        return await handler(callback, **kwargs)
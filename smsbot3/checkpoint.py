@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import socket
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerCheckpoint:
+    """Stato del worker salvato su file per il riavvio a caldo.
+
+    All'avvio il worker si registra come 'running' e allo spegnimento
+    ordinato come 'drained': se il processo successivo trova ancora
+    'running' il precedente è caduto e i suoi lease vanno liberati subito.
+    Il file conserva anche l'ultima esecuzione dei job periodici, così un
+    riavvio non ripete scansioni complete appena fatte.
+    """
+
+    RUNNING = 'running'
+    DRAINED = 'drained'
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.data = {}
+
+    def load(self) -> dict:
+        """Legge il checkpoint; un file mancante o illeggibile equivale a un avvio a freddo."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.data = data if isinstance(data, dict) else {}
+        except FileNotFoundError:
+            self.data = {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Checkpoint {self.path} illeggibile, avvio a freddo: {e}")
+            self.data = {}
+        return self.data
+
+    def save(self, **changes) -> None:
+        """Aggiorna il checkpoint sostituendo il file in modo atomico."""
+        self.data.update(changes)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Scrittura del checkpoint {self.path} non riuscita: {e}")
+
+    def mark_running(self, worker_id: str, now: datetime) -> None:
+        self.save(state=self.RUNNING, worker_id=worker_id, host=socket.gethostname(),
+                  pid=os.getpid(), started_at=now.isoformat())
+
+    def mark_drained(self, now: datetime, released: int) -> None:
+        self.save(state=self.DRAINED, drained_at=now.isoformat(), released=released)
+
+    def crashed_worker(self) -> str:
+        """ID del worker precedente se non si è arrestato in modo ordinato, altrimenti ''."""
+        if self.data.get('state') != self.RUNNING:
+            return ''
+        # Stesso host e processo ancora vivo: non è caduto, condivide solo il file
+        pid = self.data.get('pid')
+        if self.data.get('host') == socket.gethostname() and pid and pid != os.getpid():
+            try:
+                os.kill(pid, 0)
+                return ''
+            except ProcessLookupError:
+                pass
+            except OSError:
+                return ''
+        return self.data.get('worker_id') or ''
+
+    def mark_job(self, job: str, now: datetime) -> None:
+        jobs = dict(self.data.get('jobs') or {})
+        jobs[job] = now.isoformat()
+        self.save(jobs=jobs)
+
+    def job_delay(self, job: str, interval: float, now: datetime) -> float:
+        """Secondi da attendere prima di rieseguire un job che girava già prima del riavvio."""
+        last_run = (self.data.get('jobs') or {}).get(job)
+        if not last_run:
+            return 0.0
+        try:
+            elapsed = (now - datetime.fromisoformat(last_run)).total_seconds()
+        except (TypeError, ValueError):
+            return 0.0
+        return min(max(0.0, interval - elapsed), interval)
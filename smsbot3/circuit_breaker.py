@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from database.database import DatabaseManager
+
+
+class ChatCircuitBreaker:
+    """Circuit breaker per chat, condiviso tra i worker tramite il database.
+
+    Dopo `failure_threshold` errori permanenti consecutivi il circuito della
+    chat si apre: i suoi invii vengono rimandati e un solo invio alla volta fa
+    da probe, con attesa che raddoppia da `probe_base` fino a `probe_max`
+    secondi. Il primo probe riuscito chiude il circuito.
+
+    Lo stato è letto dal database una volta per giro dello scheduler: le chat
+    senza errori non costano nessuna query in più.
+    """
+
+    def __init__(self, failure_threshold: int = 3, probe_base: int = 300,
+                 probe_max: int = 21600, probe_hold: timedelta = timedelta(minutes=2)):
+        self.failure_threshold = failure_threshold
+        self.probe_base = probe_base
+        self.probe_max = probe_max
+        self.probe_hold = probe_hold
+        self._circuits: Dict[int, Tuple[str, Optional[datetime]]] = {}
+
+    def refresh(self) -> None:
+        """Ricarica lo stato dei circuiti (a inizio giro dello scheduler)."""
+        self._circuits = DatabaseManager.get_chat_circuits()
+
+    def allow(self, chat_id: int, now: datetime) -> Tuple[bool, Optional[datetime]]:
+        """Indica se si può inviare alla chat; se no, restituisce anche il prossimo probe."""
+        state = self._circuits.get(chat_id)
+        if not state or state[0] != 'open':
+            return True, None
+        return DatabaseManager.acquire_chat_probe(chat_id, now, self.probe_hold)
+
+    def record_failure(self, chat_id: int, error: str, now: datetime) -> bool:
+        """Registra un errore permanente; True se il circuito si è appena aperto."""
+        state, next_probe_at, opened_now = DatabaseManager.record_chat_failure(
+            chat_id, error, now, self.failure_threshold, self.probe_base, self.probe_max
+        )
+        self._circuits[chat_id] = (state, next_probe_at)
+        return opened_now
+
+    def record_success(self, chat_id: int) -> bool:
+        """Azzera gli errori della chat; True se il circuito era aperto ed è stato chiuso."""
+        if chat_id not in self._circuits:
+            return False
+        del self._circuits[chat_id]
+        return DatabaseManager.record_chat_success(chat_id)
@@ -0,0 +1,78 @@
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytz
+
+
+class SystemClock:
+    """Orologio reale usato dallo scheduler in produzione."""
+
+    # Con un orologio virtuale lo scheduler è l'unico a usare il database
+    virtual = False
+
+    def now(self) -> datetime:
+        return datetime.now(pytz.UTC)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        """Attende `event` per al più `timeout` secondi; True se è stato impostato."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class VirtualClock(SystemClock):
+    """Orologio simulato: le attese fanno avanzare il tempo senza aspettare davvero.
+
+    Pensato per un solo consumatore (lo scheduler della simulazione): ogni
+    attesa sposta l'ora virtuale in avanti e cede il controllo al loop una
+    volta. Con `until` il tempo non supera mai quell'istante e, quando lo
+    raggiunge, viene impostato l'evento `expired`.
+
+    Il tempo è tenuto in microsecondi interi e ogni attesa positiva avanza di
+    almeno un microsecondo: chi attende frazioni via via più piccole (come il
+    token bucket) non resta mai fermo sullo stesso istante.
+    """
+
+    virtual = True
+
+    def __init__(self, start: datetime, until: Optional[datetime] = None):
+        self.start = start
+        self.until = until
+        self.expired = asyncio.Event()
+        self._elapsed_us = 0
+
+    def now(self) -> datetime:
+        return self.start + timedelta(microseconds=self._elapsed_us)
+
+    def monotonic(self) -> float:
+        return self._elapsed_us / 1_000_000
+
+    def advance(self, seconds: float) -> None:
+        if seconds > 0:
+            self._elapsed_us += math.ceil(seconds * 1_000_000)
+        if self.until is not None:
+            limit = (self.until - self.start) // timedelta(microseconds=1)
+            if self._elapsed_us >= limit:
+                self._elapsed_us = limit
+                self.expired.set()
+
+    async def sleep(self, seconds: float) -> None:
+        self.advance(seconds)
+        await asyncio.sleep(0)
+
+    async def wait(self, event: asyncio.Event, timeout: float) -> bool:
+        if not event.is_set():
+            self.advance(timeout)
+            await asyncio.sleep(0)
+        return event.is_set()
@@ -1,9 +1,14 @@
 import sqlite3
 import logging
-from datetime import datetime
+import hashlib
+import json
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Callable, ContextManager, Iterator, List, Optional, Tuple, Union
 from .models import ScheduledMessage, MessageType
+from .migrations import MigrationRunner
 
 logger = logging.getLogger(__name__)
 
@@ -12,13 +17,66 @@ class DatabaseManager:
     
     DB_PATH = Path(__file__).parent / "messages.db"
     
+    # Colonne lette da ScheduledMessage.from_db_row: il contenuto arriva da
+    # message_contents, con fallback sulle colonne legacy di scheduled_messages
+    MESSAGE_COLUMNS = """
+        m.id, m.chat_id, COALESCE(c.message_type, m.message_type), m.send_time,
+        COALESCE(c.text, m.text), COALESCE(c.media, m.media),
+        COALESCE(c.caption, m.caption), m.pin, m.active, m.recurrence_type,
+        m.recurrence_days, m.schedule_hour, m.schedule_minute, m.content_id,
+        m.cron_expression, m.interval_seconds, m.anchor_time, m.priority,
+        m.source_chat_id, m.source_message_id
+    """
+    SELECT_MESSAGES = f"""
+        SELECT {MESSAGE_COLUMNS}
+        FROM scheduled_messages m
+        LEFT JOIN message_contents c ON c.id = m.content_id
+    """
+    
+    # PRAGMA synchronous per ogni connessione (None = predefinito di SQLite).
+    # La simulazione usa OFF: niente fsync a ogni commit su un database usa e getta
+    SYNCHRONOUS: Optional[str] = None
+    # Con True tutte le chiamate usano la stessa connessione invece di aprirne una
+    # ogni volta. Solo per un processo a thread singolo, come la simulazione
+    SHARED_CONNECTION = False
+    _shared_conn: Optional[sqlite3.Connection] = None
+
+    @classmethod
+    def _connect(cls) -> sqlite3.Connection:
+        if cls.SHARED_CONNECTION and cls._shared_conn is not None:
+            return cls._shared_conn
+        conn = sqlite3.connect(cls.DB_PATH)
+        if cls.SYNCHRONOUS is not None:
+            conn.execute(f"PRAGMA synchronous = {cls.SYNCHRONOUS}")
+        if cls.SHARED_CONNECTION:
+            cls._shared_conn = conn
+        return conn
+
     @classmethod
-    def init_db(cls) -> None:
-        """Inizializza il database e crea le tabelle necessarie."""
+    def close_shared_connection(cls) -> None:
+        """Chiude la connessione condivisa, se aperta (vedi SHARED_CONNECTION)."""
+        if cls._shared_conn is not None:
+            cls._shared_conn.close()
+            cls._shared_conn = None
+
+    @classmethod
+    def init_db(cls, runner: Optional[MigrationRunner] = None) -> None:
+        """Inizializza il database e crea le tabelle necessarie.
+
+        Dopo lo schema di base applica le migrazioni versionate mancanti
+        (vedi database/migrations.py).
+        """
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
+                # Vale solo per un file ancora vuoto: i database esistenti si
+                # convertono offline (python -m database.migrations --enable-incremental-vacuum)
+                cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                
+                # WAL permette a più processi scheduler di lavorare sullo stesso file
+                cursor.execute("PRAGMA journal_mode=WAL")
+                
                 # Creazione tabella messaggi programmati
                 cursor.execute("""
                     CREATE TABLE IF NOT EXISTS scheduled_messages (
@@ -34,43 +92,333 @@ class DatabaseManager:
                         recurrence_type TEXT NOT NULL DEFAULT 'once',
                         recurrence_days TEXT DEFAULT '',
                         schedule_hour INTEGER DEFAULT 0,
-                        schedule_minute INTEGER DEFAULT 0
+                        schedule_minute INTEGER DEFAULT 0,
+                        content_id INTEGER REFERENCES message_contents(id),
+                        cron_expression TEXT,
+                        interval_seconds INTEGER,
+                        anchor_time TIMESTAMP,
+                        priority INTEGER NOT NULL DEFAULT 1
+                    )
+                """)
+                cls._ensure_column(cursor, 'scheduled_messages', 'content_id',
+                                   'INTEGER REFERENCES message_contents(id)')
+                cls._ensure_column(cursor, 'scheduled_messages', 'cron_expression', 'TEXT')
+                cls._ensure_column(cursor, 'scheduled_messages', 'interval_seconds', 'INTEGER')
+                cls._ensure_column(cursor, 'scheduled_messages', 'anchor_time', 'TIMESTAMP')
+                cls._ensure_column(cursor, 'scheduled_messages', 'priority', 'INTEGER NOT NULL DEFAULT 1')
+                
+                # Contenuti deduplicati condivisi tra più programmazioni
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS message_contents (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        content_hash TEXT NOT NULL UNIQUE,
+                        message_type TEXT NOT NULL,
+                        text TEXT,
+                        media TEXT,
+                        caption TEXT
                     )
                 """)
+                cursor.executescript("""
+                    CREATE INDEX IF NOT EXISTS idx_scheduled_messages_content
+                    ON scheduled_messages(content_id);
+
+                    CREATE TRIGGER IF NOT EXISTS message_contents_gc
+                    AFTER DELETE ON scheduled_messages
+                    WHEN old.content_id IS NOT NULL BEGIN
+                        DELETE FROM message_contents
+                        WHERE id = old.content_id
+                        AND NOT EXISTS (
+                            SELECT 1 FROM scheduled_messages WHERE content_id = old.content_id
+                        );
+                    END;
+                """)
+                
+                cls._init_search_index(cursor)
+                cls._migrate_contents(cursor)
+                cls._init_occurrences(cursor)
                 
                 conn.commit()
-                logger.info("Database inizializzato con successo")
+
+            (runner or MigrationRunner(cls.DB_PATH)).run()
+            logger.info("Database inizializzato con successo")
                 
         except Exception as e:
             logger.error(f"Errore nell'inizializzazione del database: {e}")
             raise
 
+    @staticmethod
+    def _ensure_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str) -> None:
+        """Aggiunge una colonna a una tabella esistente se non è già presente."""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    @staticmethod
+    def _init_search_index(cursor: sqlite3.Cursor) -> None:
+        """Crea l'indice FTS5 su testo e didascalia e i trigger di sincronizzazione."""
+        # L'indice era costruito direttamente su scheduled_messages
+        cursor.executescript("""
+            DROP TRIGGER IF EXISTS scheduled_messages_fts_ai;
+            DROP TRIGGER IF EXISTS scheduled_messages_fts_ad;
+            DROP TRIGGER IF EXISTS scheduled_messages_fts_au;
+            DROP TABLE IF EXISTS scheduled_messages_fts;
+        """)
+
+        cursor.execute("""
+            SELECT 1 FROM sqlite_master
+            WHERE type = 'table' AND name = 'message_contents_fts'
+        """)
+        exists = cursor.fetchone() is not None
+
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS message_contents_fts USING fts5(
+                text, caption,
+                content='message_contents', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        cursor.executescript("""
+            CREATE TRIGGER IF NOT EXISTS message_contents_fts_ai
+            AFTER INSERT ON message_contents BEGIN
+                INSERT INTO message_contents_fts(rowid, text, caption)
+                VALUES (new.id, new.text, new.caption);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS message_contents_fts_ad
+            AFTER DELETE ON message_contents BEGIN
+                INSERT INTO message_contents_fts(message_contents_fts, rowid, text, caption)
+                VALUES ('delete', old.id, old.text, old.caption);
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS message_contents_fts_au
+            AFTER UPDATE OF text, caption ON message_contents BEGIN
+                INSERT INTO message_contents_fts(message_contents_fts, rowid, text, caption)
+                VALUES ('delete', old.id, old.text, old.caption);
+                INSERT INTO message_contents_fts(rowid, text, caption)
+                VALUES (new.id, new.text, new.caption);
+            END;
+        """)
+
+        # Indicizza i contenuti già presenti la prima volta che l'indice viene creato
+        if not exists:
+            cursor.execute(
+                "INSERT INTO message_contents_fts(message_contents_fts) VALUES ('rebuild')"
+            )
+
+    @classmethod
+    def _init_occurrences(cls, cursor: sqlite3.Cursor) -> None:
+        """Crea la tabella delle occorrenze materializzate e i trigger di invalidazione."""
+        cursor.executescript("""
+            CREATE TABLE IF NOT EXISTS message_occurrences (
+                message_id INTEGER NOT NULL,
+                scheduled_time TEXT NOT NULL,
+                fire_time TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                lease_owner TEXT,
+                lease_expires TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                PRIMARY KEY (message_id, scheduled_time)
+            ) WITHOUT ROWID;
+
+            CREATE INDEX IF NOT EXISTS idx_message_occurrences_due
+            ON message_occurrences(status, fire_time);
+
+            -- Fin dove sono state espanse le occorrenze di ogni messaggio
+            CREATE TABLE IF NOT EXISTS occurrence_horizon (
+                message_id INTEGER PRIMARY KEY,
+                expanded_until TEXT NOT NULL
+            );
+
+            CREATE INDEX IF NOT EXISTS idx_scheduled_messages_active_time
+            ON scheduled_messages(active, send_time);
+
+            -- Ogni messaggio attivo ha una riga di orizzonte: '' = da espandere
+            CREATE TRIGGER IF NOT EXISTS message_occurrences_ai
+            AFTER INSERT ON scheduled_messages WHEN new.active = 1 BEGIN
+                INSERT OR REPLACE INTO occurrence_horizon (message_id, expanded_until)
+                VALUES (new.id, '');
+            END;
+
+            CREATE TRIGGER IF NOT EXISTS message_occurrences_ad
+            AFTER DELETE ON scheduled_messages BEGIN
+                DELETE FROM message_occurrences WHERE message_id = old.id;
+                DELETE FROM occurrence_horizon WHERE message_id = old.id;
+            END;
+
+            -- Una modifica alla programmazione invalida le occorrenze future;
+            -- l'avanzamento di send_time dei ricorrenti fatto dallo scheduler no
+            DROP TRIGGER IF EXISTS message_occurrences_au;
+            CREATE TRIGGER message_occurrences_au
+            AFTER UPDATE ON scheduled_messages
+            WHEN new.active IS NOT old.active
+                OR new.recurrence_type IS NOT old.recurrence_type
+                OR new.recurrence_days IS NOT old.recurrence_days
+                OR new.schedule_hour IS NOT old.schedule_hour
+                OR new.schedule_minute IS NOT old.schedule_minute
+                OR new.cron_expression IS NOT old.cron_expression
+                OR new.interval_seconds IS NOT old.interval_seconds
+                OR new.anchor_time IS NOT old.anchor_time
+                OR (new.recurrence_type = 'once' AND new.send_time IS NOT old.send_time)
+            BEGIN
+                -- +status: con l'indice su status si leggerebbero tutte le occorrenze in attesa
+                DELETE FROM message_occurrences
+                WHERE message_id = new.id AND +status = 'pending';
+                DELETE FROM occurrence_horizon WHERE message_id = new.id;
+                INSERT INTO occurrence_horizon (message_id, expanded_until)
+                SELECT new.id, '' WHERE new.active = 1;
+            END;
+        """)
+        cls._ensure_column(cursor, 'message_occurrences', 'lease_owner', 'TEXT')
+        cls._ensure_column(cursor, 'message_occurrences', 'lease_expires', 'TEXT')
+        cls._ensure_column(cursor, 'message_occurrences', 'attempts', 'INTEGER NOT NULL DEFAULT 0')
+        cls._ensure_column(cursor, 'message_occurrences', 'last_error', 'TEXT')
+
+        # Anche nella migrazione 6, ma get_next_fire_time lo indica con INDEXED BY
+        # (il planner sceglierebbe idx_message_occurrences_due e leggerebbe tutte le
+        # occorrenze in attesa): deve esistere prima di qualsiasi migrazione
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_message_occurrences_leased
+            ON message_occurrences(lease_expires)
+            WHERE status = 'pending' AND lease_expires IS NOT NULL
+        """)
+
+        # Stato del circuit breaker per chat (una riga solo per le chat con errori)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_circuits (
+                chat_id INTEGER PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT 'closed',
+                failures INTEGER NOT NULL DEFAULT 0,
+                probe_backoff INTEGER NOT NULL DEFAULT 0,
+                next_probe_at TEXT,
+                opened_at TEXT,
+                last_error TEXT
+            )
+        """)
+
+        # Invii esauriti o falliti definitivamente, consultabili e riaccodabili dall'admin
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER NOT NULL,
+                scheduled_time TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                error_kind TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+
+        # Registro append-only degli esiti di invio e aggregati giornalieri
+        # mantenuti a ogni scrittura: le statistiche leggono solo gli aggregati
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS delivery_log (
+                id INTEGER PRIMARY KEY,
+                message_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_type TEXT NOT NULL,
+                scheduled_time TEXT,
+                status TEXT NOT NULL,
+                error_kind TEXT,
+                logged_at TEXT NOT NULL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS delivery_stats_daily (
+                day TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                message_type TEXT NOT NULL,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                dead INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, chat_id, message_type)
+            ) WITHOUT ROWID
+        """)
+
+    @staticmethod
+    def _content_hash(message_type: str, text: Optional[str], media: Optional[str],
+                      caption: Optional[str]) -> str:
+        """Calcola l'hash che identifica un contenuto (tipo+testo+media+didascalia)."""
+        payload = json.dumps([message_type, text, media, caption], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _get_or_create_content(cls, cursor: sqlite3.Cursor, message_type: str,
+                               text: Optional[str], media: Optional[str],
+                               caption: Optional[str]) -> int:
+        """Restituisce l'ID del contenuto, inserendolo solo se non esiste già."""
+        content_hash = cls._content_hash(message_type, text, media, caption)
+        cursor.execute("""
+            INSERT OR IGNORE INTO message_contents (
+                content_hash, message_type, text, media, caption
+            ) VALUES (?, ?, ?, ?, ?)
+        """, (content_hash, message_type, text, media, caption))
+        cursor.execute(
+            "SELECT id FROM message_contents WHERE content_hash = ?",
+            (content_hash,)
+        )
+        return cursor.fetchone()[0]
+
+    @classmethod
+    def _migrate_contents(cls, cursor: sqlite3.Cursor) -> None:
+        """Sposta il contenuto dei messaggi esistenti nella tabella deduplicata."""
+        cursor.execute("""
+            SELECT id, message_type, text, media, caption
+            FROM scheduled_messages
+            WHERE content_id IS NULL
+        """)
+        rows = cursor.fetchall()
+        for message_id, message_type, text, media, caption in rows:
+            content_id = cls._get_or_create_content(cursor, message_type, text, media, caption)
+            cursor.execute("""
+                UPDATE scheduled_messages
+                SET content_id = ?, text = NULL, media = NULL, caption = NULL
+                WHERE id = ?
+            """, (content_id, message_id))
+        if rows:
+            logger.info(f"Migrati {len(rows)} messaggi nella tabella dei contenuti")
+
     @classmethod
     def add_scheduled_message(cls, message_data: dict) -> int:
         """Aggiunge un nuovo messaggio programmato al database."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
+                content_id = cls._get_or_create_content(
+                    cursor,
+                    message_data['message_type'].value,
+                    message_data.get('text'),
+                    message_data.get('media'),
+                    message_data.get('caption')
+                )
+                
                 cursor.execute("""
                     INSERT INTO scheduled_messages (
-                        chat_id, message_type, send_time, text, media, 
-                        caption, pin, active, recurrence_type, recurrence_days,
-                        schedule_hour, schedule_minute
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        chat_id, message_type, send_time, content_id,
+                        pin, active, recurrence_type, recurrence_days,
+                        schedule_hour, schedule_minute, cron_expression,
+                        interval_seconds, anchor_time, priority,
+                        source_chat_id, source_message_id
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     message_data['chat_id'],
                     message_data['message_type'].value,
                     message_data['send_time'].isoformat(),
-                    message_data.get('text'),
-                    message_data.get('media'),
-                    message_data.get('caption'),
+                    content_id,
                     message_data['pin'],
                     message_data['active'],
                     message_data['recurrence_type'],
                     message_data.get('recurrence_days', ''),
                     message_data['schedule_hour'],
-                    message_data['schedule_minute']
+                    message_data['schedule_minute'],
+                    message_data.get('cron_expression'),
+                    message_data.get('interval_seconds'),
+                    message_data['anchor_time'].isoformat() if message_data.get('anchor_time') else None,
+                    message_data.get('priority', 1),
+                    message_data.get('source_chat_id'),
+                    message_data.get('source_message_id')
                 ))
                 
                 message_id = cursor.lastrowid
@@ -86,13 +434,13 @@ class DatabaseManager:
     def get_pending_messages(cls) -> List[ScheduledMessage]:
         """Recupera tutti i messaggi programmati attivi."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT * FROM scheduled_messages 
-                    WHERE active = 1 
-                    ORDER BY send_time ASC
+                cursor.execute(f"""
+                    {cls.SELECT_MESSAGES}
+                    WHERE m.active = 1 
+                    ORDER BY m.send_time ASC
                 """)
                 
                 return [ScheduledMessage.from_db_row(row) for row in cursor.fetchall()]
@@ -105,19 +453,19 @@ class DatabaseManager:
     def get_filtered_messages(cls, chat_id: Optional[int] = None) -> List[ScheduledMessage]:
         """Recupera i messaggi filtrati per gruppo."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
                 if chat_id:
-                    cursor.execute("""
-                        SELECT * FROM scheduled_messages 
-                        WHERE chat_id = ? 
-                        ORDER BY send_time DESC
+                    cursor.execute(f"""
+                        {cls.SELECT_MESSAGES}
+                        WHERE m.chat_id = ? 
+                        ORDER BY m.send_time DESC
                     """, (chat_id,))
                 else:
-                    cursor.execute("""
-                        SELECT * FROM scheduled_messages 
-                        ORDER BY send_time DESC
+                    cursor.execute(f"""
+                        {cls.SELECT_MESSAGES}
+                        ORDER BY m.send_time DESC
                     """)
                 
                 return [ScheduledMessage.from_db_row(row) for row in cursor.fetchall()]
@@ -126,16 +474,61 @@ class DatabaseManager:
             logger.error(f"Errore nel recupero dei messaggi filtrati: {e}")
             return []
 
+    @staticmethod
+    def _fts_query(query: str) -> str:
+        """Converte il testo dell'utente in una query FTS5 sicura (prefisso su ogni parola)."""
+        terms = [term.replace('"', '') for term in query.split()]
+        return " ".join(f'"{term}"*' for term in terms if term)
+
+    @classmethod
+    def search_messages(
+        cls,
+        query: str,
+        limit: int = 10,
+        offset: int = 0
+    ) -> List[Tuple[ScheduledMessage, str]]:
+        """Cerca nel testo e nelle didascalie dei messaggi, ordinando per rilevanza.
+
+        Restituisce coppie (messaggio, estratto con i termini evidenziati).
+        """
+        fts_query = cls._fts_query(query)
+        if not fts_query:
+            return []
+
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(f"""
+                    SELECT {cls.MESSAGE_COLUMNS},
+                           snippet(message_contents_fts, -1, '«', '»', '…', 12)
+                    FROM message_contents_fts
+                    JOIN message_contents c ON c.id = message_contents_fts.rowid
+                    JOIN scheduled_messages m ON m.content_id = c.id
+                    WHERE message_contents_fts MATCH ?
+                    ORDER BY rank, m.id
+                    LIMIT ? OFFSET ?
+                """, (fts_query, limit, offset))
+
+                return [
+                    (ScheduledMessage.from_db_row(row[:-1]), row[-1])
+                    for row in cursor.fetchall()
+                ]
+
+        except Exception as e:
+            logger.error(f"Errore nella ricerca dei messaggi: {e}")
+            return []
+
     @classmethod
     def get_message_by_id(cls, message_id: int) -> Optional[ScheduledMessage]:
         """Recupera un messaggio specifico per ID."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
-                cursor.execute("""
-                    SELECT * FROM scheduled_messages 
-                    WHERE id = ?
+                cursor.execute(f"""
+                    {cls.SELECT_MESSAGES}
+                    WHERE m.id = ?
                 """, (message_id,))
                 
                 row = cursor.fetchone()
@@ -145,11 +538,87 @@ class DatabaseManager:
             logger.error(f"Errore nel recupero del messaggio {message_id}: {e}")
             return None
 
+    @classmethod
+    def update_content(
+        cls,
+        content_id: int,
+        text: Optional[str] = None,
+        media: Optional[str] = None,
+        caption: Optional[str] = None
+    ) -> bool:
+        """Modifica un contenuto condiviso: tutte le programmazioni che lo usano vedono la modifica."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(
+                    "SELECT message_type FROM message_contents WHERE id = ?",
+                    (content_id,)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return False
+
+                content_hash = cls._content_hash(row[0], text, media, caption)
+                cursor.execute(
+                    "SELECT id FROM message_contents WHERE content_hash = ? AND id != ?",
+                    (content_hash, content_id)
+                )
+                duplicate = cursor.fetchone()
+
+                # Il messaggio originale non riflette più il contenuto modificato:
+                # da qui in poi si invia il contenuto salvato
+                cursor.execute("""
+                    UPDATE scheduled_messages
+                    SET source_chat_id = NULL, source_message_id = NULL
+                    WHERE content_id = ?
+                """, (content_id,))
+
+                if duplicate:
+                    # Il nuovo contenuto esiste già: le programmazioni vengono
+                    # spostate su quello e il vecchio viene rimosso
+                    cursor.execute(
+                        "UPDATE scheduled_messages SET content_id = ? WHERE content_id = ?",
+                        (duplicate[0], content_id)
+                    )
+                    cursor.execute("DELETE FROM message_contents WHERE id = ?", (content_id,))
+                else:
+                    cursor.execute("""
+                        UPDATE message_contents
+                        SET content_hash = ?, text = ?, media = ?, caption = ?
+                        WHERE id = ?
+                    """, (content_hash, text, media, caption, content_id))
+
+                conn.commit()
+                return True
+
+        except Exception as e:
+            logger.error(f"Errore nell'aggiornamento del contenuto {content_id}: {e}")
+            return False
+
+    @classmethod
+    def clear_message_source(cls, message_id: int) -> bool:
+        """Dimentica il messaggio originale, ad esempio perché è stato eliminato."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE scheduled_messages
+                    SET source_chat_id = NULL, source_message_id = NULL
+                    WHERE id = ?
+                """, (message_id,))
+                conn.commit()
+                return cursor.rowcount > 0
+
+        except Exception as e:
+            logger.error(f"Errore nella rimozione dell'originale del messaggio {message_id}: {e}")
+            return False
+
     @classmethod
     def toggle_message(cls, message_id: int) -> bool:
         """Attiva/disattiva un messaggio programmato."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -169,7 +638,7 @@ class DatabaseManager:
     def delete_message(cls, message_id: int) -> bool:
         """Elimina un messaggio programmato."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -188,7 +657,7 @@ class DatabaseManager:
     def update_send_time(cls, message_id: int, new_time: datetime) -> bool:
         """Aggiorna l'orario di invio di un messaggio."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -208,7 +677,7 @@ class DatabaseManager:
     def mark_as_sent(cls, message_id: int) -> bool:
         """Marca un messaggio come inviato (disattivandolo)."""
         try:
-            with sqlite3.connect(cls.DB_PATH) as conn:
+            with cls._connect() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute("""
@@ -222,4 +691,1076 @@ class DatabaseManager:
                 
         except Exception as e:
             logger.error(f"Errore nella marcatura come inviato del messaggio {message_id}: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def _build_filters(
+        chat_id: Optional[int] = None,
+        recurrence_type: Optional[str] = None,
+        active: Optional[bool] = None
+    ) -> Tuple[str, list]:
+        """Costruisce la clausola WHERE per le operazioni di massa."""
+        clauses = []
+        params = []
+        if chat_id is not None:
+            clauses.append("chat_id = ?")
+            params.append(chat_id)
+        if recurrence_type is not None:
+            clauses.append("recurrence_type = ?")
+            params.append(recurrence_type)
+        if active is not None:
+            clauses.append("active = ?")
+            params.append(int(active))
+        where = " AND ".join(clauses) if clauses else "1"
+        return where, params
+
+    @classmethod
+    def count_messages(
+        cls,
+        chat_id: Optional[int] = None,
+        recurrence_type: Optional[str] = None,
+        active: Optional[bool] = None
+    ) -> int:
+        """Conta i messaggi che corrispondono ai filtri indicati."""
+        where, params = cls._build_filters(chat_id, recurrence_type, active)
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM scheduled_messages WHERE {where}",
+                    params
+                )
+                return cursor.fetchone()[0]
+
+        except Exception as e:
+            logger.error(f"Errore nel conteggio dei messaggi: {e}")
+            return 0
+
+    @classmethod
+    def bulk_set_active(
+        cls,
+        active: bool,
+        chat_id: Optional[int] = None,
+        recurrence_type: Optional[str] = None
+    ) -> int:
+        """Attiva/disattiva in un'unica UPDATE tutti i messaggi filtrati.
+
+        Restituisce il numero di messaggi effettivamente modificati.
+        """
+        where, params = cls._build_filters(chat_id, recurrence_type, not active)
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"UPDATE scheduled_messages SET active = ? WHERE {where}",
+                    [int(active)] + params
+                )
+                conn.commit()
+                logger.info(f"Aggiornati {cursor.rowcount} messaggi (active={active})")
+                return cursor.rowcount
+
+        except Exception as e:
+            logger.error(f"Errore nell'aggiornamento di massa: {e}")
+            return 0
+
+    @classmethod
+    def bulk_delete(
+        cls,
+        chat_id: Optional[int] = None,
+        recurrence_type: Optional[str] = None,
+        active: Optional[bool] = None
+    ) -> int:
+        """Elimina in un'unica DELETE tutti i messaggi filtrati.
+
+        Restituisce il numero di messaggi eliminati.
+        """
+        where, params = cls._build_filters(chat_id, recurrence_type, active)
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"DELETE FROM scheduled_messages WHERE {where}",
+                    params
+                )
+                conn.commit()
+                logger.info(f"Eliminati {cursor.rowcount} messaggi")
+                return cursor.rowcount
+
+        except Exception as e:
+            logger.error(f"Errore nell'eliminazione di massa: {e}")
+            return 0
+
+    @classmethod
+    def archive_inactive_messages(cls, cutoff: datetime, batch_size: int = 500,
+                                  pause: float = 0.01) -> int:
+        """Sposta in scheduled_messages_archive i messaggi singoli già partiti prima di `cutoff`.
+
+        Sono archiviati solo i messaggi 'once' disattivati dopo l'invio (o
+        dopo il fallimento definitivo) e quelli disattivati senza alcuna
+        occorrenza, come i singoli inviati prima delle occorrenze
+        materializzate: i ricorrenti sospesi dall'admin restano dove sono,
+        così come quelli con un invio fallito da riaccodare. Lavora a lotti,
+        ognuno in una transazione breve, così gli scheduler non restano bloccati.
+        Restituisce i messaggi archiviati.
+        """
+        archived = 0
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    cursor.execute("""
+                        SELECT id FROM scheduled_messages m
+                        WHERE active = 0 AND recurrence_type = 'once' AND send_time < ?
+                        AND (
+                            EXISTS (
+                                SELECT 1 FROM message_occurrences o
+                                WHERE o.message_id = m.id AND o.status IN ('sent', 'dead')
+                            )
+                            OR NOT EXISTS (
+                                SELECT 1 FROM message_occurrences o WHERE o.message_id = m.id
+                            )
+                        )
+                        AND NOT EXISTS (SELECT 1 FROM dead_letters d WHERE d.message_id = m.id)
+                        ORDER BY id
+                        LIMIT ?
+                    """, (cutoff.isoformat(), batch_size))
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if not ids:
+                        conn.commit()
+                        break
+
+                    placeholders = ','.join('?' * len(ids))
+                    cursor.execute(f"""
+                        INSERT OR IGNORE INTO scheduled_messages_archive (
+                            id, chat_id, message_type, send_time, text, media, caption,
+                            pin, active, recurrence_type, recurrence_days, schedule_hour,
+                            schedule_minute, cron_expression, interval_seconds,
+                            anchor_time, priority, archived_at
+                        )
+                        SELECT
+                            m.id, m.chat_id, COALESCE(c.message_type, m.message_type),
+                            m.send_time, COALESCE(c.text, m.text), COALESCE(c.media, m.media),
+                            COALESCE(c.caption, m.caption), m.pin, m.active,
+                            m.recurrence_type, m.recurrence_days, m.schedule_hour,
+                            m.schedule_minute, m.cron_expression, m.interval_seconds,
+                            m.anchor_time, m.priority, ?
+                        FROM scheduled_messages m
+                        LEFT JOIN message_contents c ON c.id = m.content_id
+                        WHERE m.id IN ({placeholders})
+                    """, [datetime.now(timezone.utc).isoformat()] + ids)
+                    # I trigger eliminano occorrenze, orizzonte e contenuti non più usati
+                    cursor.execute(
+                        f"DELETE FROM scheduled_messages WHERE id IN ({placeholders})",
+                        ids
+                    )
+                    conn.commit()
+                    archived += len(ids)
+                    if pause:
+                        time.sleep(pause)
+
+        except Exception as e:
+            logger.error(f"Errore nell'archiviazione dei messaggi inattivi: {e}")
+
+        if archived:
+            logger.info(f"Archiviati {archived} messaggi inattivi")
+        return archived
+
+    @classmethod
+    def prune_occurrences(cls, cutoff: datetime, batch_size: int = 500,
+                          pause: float = 0.01) -> int:
+        """Elimina le occorrenze concluse con fire_time precedente a `cutoff`.
+
+        Senza questa pulizia i ricorrenti accumulano una riga per invio (un
+        intervallo di un minuto ne aggiunge oltre 500.000 l'anno). Le
+        occorrenze con un dead letter restano finché l'admin non lo gestisce.
+        Lavora a lotti, ognuno in una transazione breve. Restituisce le
+        occorrenze eliminate.
+        """
+        pruned = 0
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                while True:
+                    cursor.execute("BEGIN IMMEDIATE")
+                    cursor.execute("""
+                        DELETE FROM message_occurrences
+                        WHERE (message_id, scheduled_time) IN (
+                            SELECT o.message_id, o.scheduled_time
+                            FROM message_occurrences o
+                            WHERE o.status IN ('sent', 'dead', 'missed', 'skipped')
+                            AND o.fire_time < ?
+                            AND NOT EXISTS (
+                                SELECT 1 FROM dead_letters d
+                                WHERE d.message_id = o.message_id
+                                AND d.scheduled_time = o.scheduled_time
+                            )
+                            LIMIT ?
+                        )
+                    """, (cutoff.isoformat(), batch_size))
+                    deleted = cursor.rowcount
+                    conn.commit()
+                    pruned += deleted
+                    if deleted < batch_size:
+                        break
+                    if pause:
+                        time.sleep(pause)
+
+        except Exception as e:
+            logger.error(f"Errore nella pulizia delle occorrenze concluse: {e}")
+
+        if pruned:
+            logger.info(f"Eliminate {pruned} occorrenze concluse")
+        return pruned
+
+    @classmethod
+    def incremental_vacuum(cls, max_pages: int = 1000) -> int:
+        """Restituisce al filesystem fino a `max_pages` pagine libere.
+
+        Richiede auto_vacuum incrementale; senza, registra come attivarlo.
+        Restituisce le pagine liberate (0 se non ce ne sono o in caso di errore).
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    logger.info(
+                        "Vacuum incrementale non disponibile: a bot fermo eseguire "
+                        "python -m database.migrations --enable-incremental-vacuum"
+                    )
+                    return 0
+                before = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                if not before:
+                    return 0
+                # Con execute il modulo sqlite3 si ferma al primo passo (una sola
+                # pagina); executescript esegue il pragma fino in fondo
+                cursor.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+                after = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                return before - after
+
+        except Exception as e:
+            logger.error(f"Errore nel vacuum incrementale: {e}")
+            return 0
+
+    @classmethod
+    def import_scheduled_messages(cls, rows: List[dict]) -> int:
+        """Inserisce un lotto di programmazioni già validate in un'unica transazione.
+
+        Le righe hanno la forma di `message_data` di add_scheduled_message; i
+        contenuti vengono deduplicati con un solo executemany per lotto.
+        Restituisce il numero di messaggi inseriti (0 se il lotto fallisce).
+        """
+        if not rows:
+            return 0
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                contents = {}
+                row_hashes = []
+                for row in rows:
+                    content = (row['message_type'].value, row.get('text'),
+                               row.get('media'), row.get('caption'))
+                    content_hash = cls._content_hash(*content)
+                    contents.setdefault(content_hash, content)
+                    row_hashes.append(content_hash)
+
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO message_contents (
+                        content_hash, message_type, text, media, caption
+                    ) VALUES (?, ?, ?, ?, ?)
+                """, [(content_hash, *content) for content_hash, content in contents.items()])
+
+                # Gli ID dei contenuti, letti a blocchi per restare sotto il limite di parametri
+                hashes = list(contents)
+                content_ids = {}
+                for start in range(0, len(hashes), 500):
+                    chunk = hashes[start:start + 500]
+                    cursor.execute(f"""
+                        SELECT content_hash, id FROM message_contents
+                        WHERE content_hash IN ({','.join('?' * len(chunk))})
+                    """, chunk)
+                    content_ids.update(cursor.fetchall())
+
+                cursor.executemany("""
+                    INSERT INTO scheduled_messages (
+                        chat_id, message_type, send_time, content_id,
+                        pin, active, recurrence_type, recurrence_days,
+                        schedule_hour, schedule_minute, cron_expression,
+                        interval_seconds, anchor_time, priority,
+                        source_chat_id, source_message_id
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (
+                        row['chat_id'],
+                        row['message_type'].value,
+                        row['send_time'].isoformat(),
+                        content_ids[content_hash],
+                        row['pin'],
+                        row['active'],
+                        row['recurrence_type'],
+                        row.get('recurrence_days', ''),
+                        row['schedule_hour'],
+                        row['schedule_minute'],
+                        row.get('cron_expression'),
+                        row.get('interval_seconds'),
+                        row['anchor_time'].isoformat() if row.get('anchor_time') else None,
+                        row.get('priority', 1),
+                        row.get('source_chat_id'),
+                        row.get('source_message_id')
+                    )
+                    for row, content_hash in zip(rows, row_hashes)
+                ])
+
+                conn.commit()
+                return len(rows)
+
+        except Exception as e:
+            logger.error(f"Errore nell'importazione di un lotto di {len(rows)} messaggi: {e}")
+            return 0
+
+    @classmethod
+    def iter_scheduled_messages(cls, batch_size: int = 1000) -> Iterator[ScheduledMessage]:
+        """Scorre tutti i messaggi programmati leggendoli dal cursore a blocchi.
+
+        A differenza di get_filtered_messages non carica l'intera tabella in
+        memoria; un errore di lettura viene registrato e rilanciato, perché
+        un'esportazione troncata in silenzio non è accettabile.
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    {cls.SELECT_MESSAGES}
+                    ORDER BY m.id
+                """)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield ScheduledMessage.from_db_row(row)
+
+        except Exception as e:
+            logger.error(f"Errore nella lettura dei messaggi da esportare: {e}")
+            raise
+
+    @classmethod
+    def expand_occurrences(cls, now: datetime, horizon: timedelta,
+                           min_ahead: timedelta = timedelta(0),
+                           max_per_message: int = 500) -> int:
+        """Materializza le occorrenze dei messaggi attivi fino a now + horizon.
+
+        Vengono elaborati solo i messaggi nuovi o modificati e quelli la cui
+        espansione copre meno di `min_ahead`. I messaggi molto frequenti
+        (intervalli brevi) vengono espansi al massimo di `max_per_message`
+        occorrenze per volta. Restituisce le occorrenze inserite.
+        """
+        until = now + horizon
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                # I messaggi nuovi o modificati hanno expanded_until = '' (vedi i
+                # trigger): bastano le righe di orizzonte in scadenza, lette dall'indice
+                cursor.execute(f"""
+                    SELECT h.expanded_until, {cls.MESSAGE_COLUMNS}
+                    FROM occurrence_horizon h
+                    CROSS JOIN scheduled_messages m ON m.id = h.message_id
+                    LEFT JOIN message_contents c ON c.id = m.content_id
+                    WHERE h.expanded_until < ? AND m.active = 1
+                """, ((now + min_ahead).isoformat(),))
+                rows = cursor.fetchall()
+
+                occurrences = []
+                horizons = []
+                for row in rows:
+                    msg = ScheduledMessage.from_db_row(row[1:])
+                    expanded_until = datetime.fromisoformat(row[0]) if row[0] else None
+
+                    # send_time è sempre un'occorrenza (eventualmente in ritardo)
+                    if (expanded_until is None or msg.send_time > expanded_until) \
+                            and msg.send_time <= until:
+                        occurrences.append((msg.id, msg.send_time.isoformat()))
+
+                    after = max(filter(None, [msg.send_time, expanded_until, now]))
+                    covered_until = until
+                    for count, occurrence in enumerate(msg.occurrences(after, until), 1):
+                        occurrences.append((msg.id, occurrence.isoformat()))
+                        if count >= max_per_message:
+                            covered_until = occurrence
+                            break
+                    horizons.append((msg.id, covered_until.isoformat()))
+
+                cursor.executemany("""
+                    INSERT OR IGNORE INTO message_occurrences (message_id, scheduled_time, fire_time)
+                    VALUES (?, ?, ?)
+                """, [(message_id, time, time) for message_id, time in occurrences])
+                cursor.executemany("""
+                    INSERT OR REPLACE INTO occurrence_horizon (message_id, expanded_until)
+                    VALUES (?, ?)
+                """, horizons)
+
+                conn.commit()
+                if occurrences:
+                    logger.info(f"Materializzate {len(occurrences)} occorrenze per {len(horizons)} messaggi")
+                return len(occurrences)
+
+        except Exception as e:
+            logger.error(f"Errore nell'espansione delle occorrenze: {e}")
+            return 0
+
+    @classmethod
+    def claim_due_occurrences(cls, worker_id: str, now: datetime, lease: timedelta,
+                              limit: int = 50,
+                              phase: Optional[Callable[[str], ContextManager]] = None
+                              ) -> List[Tuple[ScheduledMessage, str]]:
+        """Prende in carico atomicamente fino a `limit` occorrenze scadute con un lease.
+
+        Solo le occorrenze senza lease o con lease scaduto (worker caduto)
+        possono essere prese: due worker non ricevono mai la stessa occorrenza.
+        Le occorrenze dei messaggi a priorità più alta vengono prese per prime.
+        Le chat con circuit breaker aperto vengono saltate fino al prossimo probe.
+        Restituisce un'occorrenza per messaggio, la più recente.
+
+        `phase` (come SchedulerInstrumentation.phase) misura separatamente
+        presa in carico, lettura dei messaggi e costruzione dei modelli.
+        """
+        phase = phase or (lambda name: nullcontext())
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                with phase('claim.update'):
+                    cursor.execute("""
+                        UPDATE message_occurrences
+                        SET lease_owner = ?, lease_expires = ?
+                        WHERE (message_id, scheduled_time) IN (
+                            SELECT o.message_id, o.scheduled_time FROM message_occurrences o
+                            JOIN scheduled_messages m ON m.id = o.message_id
+                            WHERE o.status = 'pending' AND o.fire_time <= ?
+                            AND (o.lease_expires IS NULL OR o.lease_expires < ?)
+                            AND m.active = 1
+                            AND m.chat_id NOT IN (
+                                SELECT chat_id FROM chat_circuits
+                                WHERE state = 'open' AND next_probe_at > ?
+                            )
+                            ORDER BY m.priority DESC, o.fire_time ASC
+                            LIMIT ?
+                        )
+                        RETURNING message_id, scheduled_time, fire_time
+                    """, (worker_id, (now + lease).isoformat(), now.isoformat(), now.isoformat(),
+                          now.isoformat(), limit))
+                    claimed = cursor.fetchall()
+                    conn.commit()
+
+                if not claimed:
+                    return []
+
+                latest = {}
+                for message_id, scheduled_time, fire_time in sorted(claimed, key=lambda r: r[2]):
+                    latest[message_id] = scheduled_time
+
+                placeholders = ",".join("?" * len(latest))
+                with phase('claim.fetch'):
+                    cursor.execute(f"""
+                        {cls.SELECT_MESSAGES}
+                        WHERE m.id IN ({placeholders})
+                    """, list(latest))
+                    rows = cursor.fetchall()
+                with phase('claim.build'):
+                    messages = {row[0]: ScheduledMessage.from_db_row(row) for row in rows}
+
+                return [
+                    (messages[message_id], scheduled_time)
+                    for message_id, scheduled_time in latest.items()
+                    if message_id in messages
+                ]
+
+        except Exception as e:
+            logger.error(f"Errore nella presa in carico delle occorrenze: {e}")
+            return []
+
+    @classmethod
+    def renew_lease(cls, worker_id: str, message_id: int, scheduled_time: str,
+                    expires: datetime) -> bool:
+        """Rinnova il lease di un'occorrenza; False se il lease è stato perso."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE message_occurrences SET lease_expires = ?
+                    WHERE message_id = ? AND scheduled_time = ?
+                    AND lease_owner = ? AND status = 'pending'
+                """, (expires.isoformat(), message_id, scheduled_time, worker_id))
+
+                conn.commit()
+                return cursor.rowcount > 0
+
+        except Exception as e:
+            logger.error(f"Errore nel rinnovo del lease {message_id}@{scheduled_time}: {e}")
+            return False
+
+    @classmethod
+    def release_leases(cls, worker_id: str) -> int:
+        """Libera le occorrenze ancora in attesa prese in carico da un worker.
+
+        Usato allo spegnimento (occorrenze in coda non ancora inviate) e
+        all'avvio dopo un arresto non ordinato: un altro worker può prenderle
+        subito invece di attendere la scadenza del lease.
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE message_occurrences SET lease_owner = NULL, lease_expires = NULL
+                    WHERE lease_owner = ? AND status = 'pending'
+                """, (worker_id,))
+                conn.commit()
+                return cursor.rowcount
+
+        except Exception as e:
+            logger.error(f"Errore nel rilascio dei lease del worker {worker_id}: {e}")
+            return 0
+
+    @classmethod
+    def complete_occurrence(cls, message_id: int, scheduled_time: str,
+                            worker_id: Optional[str] = None) -> bool:
+        """Segna un'occorrenza come inviata e quelle precedenti non inviate come perse."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE message_occurrences
+                    SET status = 'sent', lease_owner = NULL, lease_expires = NULL
+                    WHERE message_id = ? AND scheduled_time = ?
+                    AND (? IS NULL OR lease_owner = ?)
+                """, (message_id, scheduled_time, worker_id, worker_id))
+                updated = cursor.rowcount
+                cursor.execute("""
+                    UPDATE message_occurrences
+                    SET status = 'missed', lease_owner = NULL, lease_expires = NULL
+                    WHERE message_id = ? AND +status = 'pending' AND fire_time < (
+                        SELECT fire_time FROM message_occurrences
+                        WHERE message_id = ? AND scheduled_time = ?
+                    )
+                """, (message_id, message_id, scheduled_time))
+
+                conn.commit()
+                return updated > 0
+
+        except Exception as e:
+            logger.error(f"Errore nel completamento dell'occorrenza {message_id}@{scheduled_time}: {e}")
+            return False
+
+    @classmethod
+    def skip_occurrence(cls, message_id: int, scheduled_time: datetime) -> bool:
+        """Salta un singolo invio di un messaggio ricorrente."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE message_occurrences SET status = 'skipped'
+                    WHERE message_id = ? AND scheduled_time = ? AND status = 'pending'
+                """, (message_id, scheduled_time.isoformat()))
+
+                conn.commit()
+                return cursor.rowcount > 0
+
+        except Exception as e:
+            logger.error(f"Errore nel salto dell'occorrenza {message_id}: {e}")
+            return False
+
+    @classmethod
+    def reschedule_occurrence(cls, message_id: int, scheduled_time: datetime,
+                              fire_time: datetime) -> bool:
+        """Sposta un singolo invio senza modificare la ricorrenza."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE message_occurrences SET fire_time = ?
+                    WHERE message_id = ? AND scheduled_time = ? AND status = 'pending'
+                """, (fire_time.isoformat(), message_id, scheduled_time.isoformat()))
+
+                conn.commit()
+                return cursor.rowcount > 0
+
+        except Exception as e:
+            logger.error(f"Errore nello spostamento dell'occorrenza {message_id}: {e}")
+            return False
+
+    @classmethod
+    def get_upcoming_occurrences(
+        cls,
+        start: datetime,
+        end: datetime,
+        chat_id: Optional[int] = None
+    ) -> List[Tuple[ScheduledMessage, datetime]]:
+        """Recupera gli invii previsti nell'intervallo [start, end] con una scansione per intervallo."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                query = f"""
+                    SELECT sm.*, o.fire_time FROM message_occurrences o
+                    JOIN ({cls.SELECT_MESSAGES}) sm ON sm.id = o.message_id
+                    WHERE o.status = 'pending' AND o.fire_time BETWEEN ? AND ?
+                """
+                params = [start.isoformat(), end.isoformat()]
+                if chat_id is not None:
+                    query += " AND sm.chat_id = ?"
+                    params.append(chat_id)
+                cursor.execute(query + " ORDER BY o.fire_time ASC", params)
+
+                return [
+                    (ScheduledMessage.from_db_row(row[:-1]), datetime.fromisoformat(row[-1]))
+                    for row in cursor.fetchall()
+                ]
+
+        except Exception as e:
+            logger.error(f"Errore nel recupero dei prossimi invii: {e}")
+            return []
+
+    @classmethod
+    def get_next_fire_time(cls) -> Optional[datetime]:
+        """Restituisce il prossimo orario di invio libero, per dormire fino ad allora.
+
+        Le tre parti leggono solo righe raggiungibili da un indice: la prima
+        occorrenza libera in ordine di fire_time, le poche occorrenze con un
+        lease (in invio o rimandate) e quelle delle chat con circuito aperto,
+        partendo da chat_circuits (CROSS JOIN fissa l'ordine delle tabelle).
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                # Per le occorrenze rimandate conta la scadenza del lease (prossimo
+                # tentativo), per le chat con circuito aperto il prossimo probe
+                cursor.execute("""
+                    SELECT MIN(next_time) FROM (
+                        SELECT * FROM (
+                            SELECT o.fire_time AS next_time FROM message_occurrences o
+                            JOIN scheduled_messages m ON m.id = o.message_id
+                            WHERE o.status = 'pending' AND o.lease_expires IS NULL AND m.active = 1
+                            AND m.chat_id NOT IN (SELECT chat_id FROM chat_circuits WHERE state = 'open')
+                            ORDER BY o.fire_time
+                            LIMIT 1
+                        )
+                        UNION ALL
+                        SELECT MIN(MAX(o.fire_time, o.lease_expires))
+                        FROM message_occurrences o INDEXED BY idx_message_occurrences_leased
+                        JOIN scheduled_messages m ON m.id = o.message_id
+                        WHERE o.status = 'pending' AND o.lease_expires IS NOT NULL AND m.active = 1
+                        AND m.chat_id NOT IN (SELECT chat_id FROM chat_circuits WHERE state = 'open')
+                        UNION ALL
+                        SELECT MIN(MAX(o.fire_time, COALESCE(o.lease_expires, ''), cc.next_probe_at))
+                        FROM chat_circuits cc
+                        CROSS JOIN scheduled_messages m ON m.chat_id = cc.chat_id
+                        CROSS JOIN message_occurrences o ON o.message_id = m.id
+                        WHERE cc.state = 'open' AND o.status = 'pending' AND m.active = 1
+                    )
+                """)
+
+                row = cursor.fetchone()
+                return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+        except Exception as e:
+            logger.error(f"Errore nel recupero del prossimo invio: {e}")
+            return None
+
+    @classmethod
+    def get_next_expansion_time(cls) -> Optional[datetime]:
+        """Fin dove sono materializzate le occorrenze di tutti i messaggi attivi.
+
+        Oltre questo istante qualche messaggio potrebbe avere invii non
+        ancora espansi: chi dorme a lungo deve svegliarsi prima.
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                # Dall'indice in ordine di orizzonte, fino al primo messaggio attivo
+                cursor.execute("""
+                    SELECT h.expanded_until FROM occurrence_horizon h
+                    CROSS JOIN scheduled_messages m ON m.id = h.message_id
+                    WHERE m.active = 1
+                    ORDER BY h.expanded_until LIMIT 1
+                """)
+
+                row = cursor.fetchone()
+                if row is None:
+                    return None
+                # '' = messaggio ancora da espandere: va fatto subito
+                return datetime.fromisoformat(row[0]) if row[0] else datetime.min.replace(tzinfo=timezone.utc)
+
+        except Exception as e:
+            logger.error(f"Errore nel recupero dell'orizzonte delle occorrenze: {e}")
+            return None
+
+    @classmethod
+    def record_failure(cls, message_id: int, scheduled_time: str, error: str) -> int:
+        """Registra un tentativo fallito e restituisce il numero di tentativi falliti."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE message_occurrences
+                    SET attempts = attempts + 1, last_error = ?
+                    WHERE message_id = ? AND scheduled_time = ?
+                    RETURNING attempts
+                """, (error, message_id, scheduled_time))
+                row = cursor.fetchone()
+
+                conn.commit()
+                return row[0] if row else 1
+
+        except Exception as e:
+            logger.error(f"Errore nella registrazione del fallimento {message_id}@{scheduled_time}: {e}")
+            return 1
+
+    @classmethod
+    def defer_occurrence(cls, worker_id: str, message_id: int, scheduled_time: str,
+                         retry_at: datetime) -> bool:
+        """Rimanda un'occorrenza: il lease scade a `retry_at` e nessuno la riprende prima."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE message_occurrences SET lease_owner = NULL, lease_expires = ?
+                    WHERE message_id = ? AND scheduled_time = ? AND lease_owner = ?
+                """, (retry_at.isoformat(), message_id, scheduled_time, worker_id))
+
+                conn.commit()
+                return cursor.rowcount > 0
+
+        except Exception as e:
+            logger.error(f"Errore nel rinvio dell'occorrenza {message_id}@{scheduled_time}: {e}")
+            return False
+
+    @classmethod
+    def dead_letter_occurrence(cls, message_id: int, scheduled_time: str, chat_id: int,
+                               error_kind: str, error: str, now: Optional[datetime] = None) -> bool:
+        """Sposta un'occorrenza esaurita nella tabella dead_letters.
+
+        Le altre occorrenze già scadute dello stesso messaggio vengono
+        segnate come perse: il messaggio riparte dal prossimo invio
+        invece di ritentare una per una le occorrenze arretrate.
+        """
+        now = now or datetime.now(timezone.utc)
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE message_occurrences
+                    SET status = 'dead', lease_owner = NULL, lease_expires = NULL
+                    WHERE message_id = ? AND scheduled_time = ?
+                    RETURNING attempts
+                """, (message_id, scheduled_time))
+                row = cursor.fetchone()
+                cursor.execute("""
+                    UPDATE message_occurrences
+                    SET status = 'missed', lease_owner = NULL, lease_expires = NULL
+                    WHERE message_id = ? AND +status = 'pending' AND fire_time <= ?
+                """, (message_id, now.isoformat()))
+
+                cursor.execute("""
+                    INSERT INTO dead_letters (
+                        message_id, scheduled_time, chat_id, error_kind, error, attempts, created_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, (message_id, scheduled_time, chat_id, error_kind, error,
+                      row[0] if row else 1, now.isoformat()))
+
+                conn.commit()
+                logger.warning(f"Occorrenza {message_id}@{scheduled_time} spostata nei dead letter ({error_kind})")
+                return True
+
+        except Exception as e:
+            logger.error(f"Errore nello spostamento nei dead letter di {message_id}@{scheduled_time}: {e}")
+            return False
+
+    @classmethod
+    def get_dead_letters(cls, limit: int = 20) -> List[tuple]:
+        """Recupera gli ultimi invii falliti definitivamente."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    SELECT id, message_id, scheduled_time, chat_id, error_kind, error, attempts, created_at
+                    FROM dead_letters
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (limit,))
+
+                return cursor.fetchall()
+
+        except Exception as e:
+            logger.error(f"Errore nel recupero dei dead letter: {e}")
+            return []
+
+    @classmethod
+    def requeue_dead_letter(cls, dead_letter_id: int) -> bool:
+        """Rimette in coda un invio fallito: viene ritentato subito con contatori azzerati."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(
+                    "SELECT message_id, scheduled_time FROM dead_letters WHERE id = ?",
+                    (dead_letter_id,)
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return False
+                message_id, scheduled_time = row
+
+                # Riattiva il messaggio (i singoli vengono disattivati quando falliscono)
+                cursor.execute(
+                    "UPDATE scheduled_messages SET active = 1 WHERE id = ? AND active = 0",
+                    (message_id,)
+                )
+                cursor.execute("""
+                    UPDATE message_occurrences
+                    SET status = 'pending', attempts = 0, last_error = NULL,
+                        lease_owner = NULL, lease_expires = NULL, fire_time = ?
+                    WHERE message_id = ? AND scheduled_time = ? AND status = 'dead'
+                """, (datetime.now(timezone.utc).isoformat(), message_id, scheduled_time))
+                if cursor.rowcount == 0:
+                    # Occorrenza non più presente (o già rimessa in coda): il dead letter resta
+                    conn.rollback()
+                    logger.warning(f"Dead letter {dead_letter_id}: occorrenza {message_id}@{scheduled_time} non trovata")
+                    return False
+                cursor.execute("DELETE FROM dead_letters WHERE id = ?", (dead_letter_id,))
+
+                conn.commit()
+                return True
+
+        except Exception as e:
+            logger.error(f"Errore nel reinserimento del dead letter {dead_letter_id}: {e}")
+            return False
+
+    @classmethod
+    def delete_dead_letters(cls) -> int:
+        """Svuota la tabella dei dead letter."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM dead_letters")
+                conn.commit()
+                return cursor.rowcount
+
+        except Exception as e:
+            logger.error(f"Errore nell'eliminazione dei dead letter: {e}")
+            return 0
+
+    @classmethod
+    def get_chat_circuits(cls) -> dict:
+        """Recupera lo stato dei circuit breaker: chat_id -> (stato, prossimo probe)."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT chat_id, state, next_probe_at FROM chat_circuits")
+                return {
+                    chat_id: (state, datetime.fromisoformat(next_probe_at) if next_probe_at else None)
+                    for chat_id, state, next_probe_at in cursor.fetchall()
+                }
+
+        except Exception as e:
+            logger.error(f"Errore nel recupero dei circuit breaker: {e}")
+            return {}
+
+    @classmethod
+    def record_chat_failure(cls, chat_id: int, error: str, now: datetime, threshold: int,
+                            probe_base: int, probe_max: int) -> Tuple[str, Optional[datetime], bool]:
+        """Registra un errore permanente verso una chat.
+
+        Apre il circuito al raggiungimento di `threshold` errori consecutivi; con il
+        circuito aperto (probe fallito) raddoppia l'attesa fino a `probe_max` secondi.
+        Restituisce (stato, prossimo probe, aperto_ora).
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    INSERT INTO chat_circuits (chat_id, failures, last_error) VALUES (?, 1, ?)
+                    ON CONFLICT(chat_id) DO UPDATE
+                    SET failures = failures + 1, last_error = excluded.last_error
+                    RETURNING state, failures, probe_backoff
+                """, (chat_id, error))
+                state, failures, probe_backoff = cursor.fetchone()
+
+                opened_now = False
+                next_probe_at = None
+                if state == 'closed' and failures >= threshold:
+                    next_probe_at = now + timedelta(seconds=probe_base)
+                    cursor.execute("""
+                        UPDATE chat_circuits
+                        SET state = 'open', opened_at = ?, probe_backoff = ?, next_probe_at = ?
+                        WHERE chat_id = ? AND state = 'closed'
+                    """, (now.isoformat(), probe_base, next_probe_at.isoformat(), chat_id))
+                    opened_now = cursor.rowcount > 0
+                    state = 'open'
+                elif state == 'open':
+                    probe_backoff = min(probe_max, max(probe_backoff, probe_base) * 2)
+                    next_probe_at = now + timedelta(seconds=probe_backoff)
+                    cursor.execute("""
+                        UPDATE chat_circuits SET probe_backoff = ?, next_probe_at = ?
+                        WHERE chat_id = ?
+                    """, (probe_backoff, next_probe_at.isoformat(), chat_id))
+
+                conn.commit()
+                return state, next_probe_at, opened_now
+
+        except Exception as e:
+            logger.error(f"Errore nella registrazione del fallimento per la chat {chat_id}: {e}")
+            return 'closed', None, False
+
+    @classmethod
+    def acquire_chat_probe(cls, chat_id: int, now: datetime,
+                           hold: timedelta) -> Tuple[bool, Optional[datetime]]:
+        """Prova a prendere il probe di una chat con circuito aperto.
+
+        Un solo invio (e un solo worker) fa da probe: chi lo prende sposta il
+        prossimo probe di `hold`, finché l'esito non chiude o riapre il circuito.
+        Restituisce (preso, prossimo probe).
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    UPDATE chat_circuits SET next_probe_at = ?
+                    WHERE chat_id = ? AND state = 'open' AND next_probe_at <= ?
+                """, ((now + hold).isoformat(), chat_id, now.isoformat()))
+                if cursor.rowcount:
+                    conn.commit()
+                    return True, None
+
+                cursor.execute(
+                    "SELECT state, next_probe_at FROM chat_circuits WHERE chat_id = ?",
+                    (chat_id,)
+                )
+                row = cursor.fetchone()
+                if not row or row[0] != 'open':
+                    return True, None
+                return False, datetime.fromisoformat(row[1])
+
+        except Exception as e:
+            logger.error(f"Errore nel probe della chat {chat_id}: {e}")
+            return True, None
+
+    @classmethod
+    def record_chat_success(cls, chat_id: int) -> bool:
+        """Chiude il circuito di una chat; True se era aperto."""
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute(
+                    "DELETE FROM chat_circuits WHERE chat_id = ? RETURNING state",
+                    (chat_id,)
+                )
+                row = cursor.fetchone()
+
+                conn.commit()
+                return bool(row) and row[0] == 'open'
+
+        except Exception as e:
+            logger.error(f"Errore nella chiusura del circuito della chat {chat_id}: {e}")
+            return False
+
+    @classmethod
+    def record_deliveries(cls, records: List[tuple]) -> bool:
+        """Scrive un lotto di esiti di invio e aggiorna gli aggregati giornalieri.
+
+        Ogni record è (message_id, chat_id, message_type, scheduled_time, status,
+        error_kind, logged_at) con status 'sent', 'failed' o 'dead'. Registro e
+        aggregati vengono aggiornati nella stessa transazione.
+        """
+        rollups = {}
+        for _, chat_id, message_type, _, status, _, logged_at in records:
+            counts = rollups.setdefault((logged_at[:10], chat_id, message_type), [0, 0, 0])
+            counts[('sent', 'failed', 'dead').index(status)] += 1
+
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.executemany("""
+                    INSERT INTO delivery_log (
+                        message_id, chat_id, message_type, scheduled_time,
+                        status, error_kind, logged_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """, records)
+                cursor.executemany("""
+                    INSERT INTO delivery_stats_daily (day, chat_id, message_type, sent, failed, dead)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(day, chat_id, message_type) DO UPDATE SET
+                        sent = sent + excluded.sent,
+                        failed = failed + excluded.failed,
+                        dead = dead + excluded.dead
+                """, [key + tuple(counts) for key, counts in rollups.items()])
+
+                conn.commit()
+                return True
+
+        except Exception as e:
+            logger.error(f"Errore nella scrittura del registro degli invii: {e}")
+            return False
+
+    @classmethod
+    def get_delivery_summary(cls) -> dict:
+        """Invii riusciti per messaggio: message_id -> (invii, ritardo massimo in secondi).
+
+        Il ritardo è la distanza tra l'orario previsto dell'occorrenza e la
+        registrazione dell'invio.
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    SELECT message_id, COUNT(*),
+                           MAX((julianday(logged_at) - julianday(scheduled_time)) * 86400)
+                    FROM delivery_log
+                    WHERE status = 'sent'
+                    GROUP BY message_id
+                """)
+
+                return {message_id: (count, delay or 0.0) for message_id, count, delay in cursor.fetchall()}
+
+        except Exception as e:
+            logger.error(f"Errore nel riepilogo degli invii: {e}")
+            return {}
+
+    @classmethod
+    def get_delivery_stats(cls, since_day: str) -> List[tuple]:
+        """Recupera gli aggregati giornalieri a partire da `since_day` (YYYY-MM-DD).
+
+        Restituisce righe (giorno, chat_id, tipo, inviati, falliti, persi).
+        """
+        try:
+            with cls._connect() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    SELECT day, chat_id, message_type, sent, failed, dead
+                    FROM delivery_stats_daily
+                    WHERE day >= ?
+                    ORDER BY day DESC
+                """, (since_day,))
+
+                return cursor.fetchall()
+
+        except Exception as e:
+            logger.error(f"Errore nel recupero delle statistiche di invio: {e}")
+            return []
\ No newline at end of file
@@ -0,0 +1,336 @@
+"""Migrazioni versionate dello schema, tracciate con PRAGMA user_version.
+
+init_db crea lo schema di base in modo idempotente e poi applica, in ordine,
+le migrazioni con versione maggiore di quella registrata nel file. Le
+riscritture dei dati procedono a piccoli lotti, ognuno nella sua
+transazione, così gli scheduler in esecuzione sullo stesso database non
+restano bloccati; per questo ogni riscrittura deve essere idempotente
+(una migrazione interrotta riparte da capo al riavvio successivo).
+
+Uso (dalla cartella smsbot3), anche con il bot in esecuzione:
+    python -m database.migrations            # applica le migrazioni mancanti
+    python -m database.migrations --status   # mostra versione e migrazioni in attesa
+
+Solo a bot fermo, una volta sui database creati prima di auto_vacuum incrementale:
+    python -m database.migrations --enable-incremental-vacuum
+"""
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Migration:
+    """Una modifica dello schema o dei dati identificata da un numero di versione."""
+
+    def __init__(self, version: int, description: str,
+                 apply: Callable[[sqlite3.Connection, 'MigrationRunner'], None]):
+        self.version = version
+        self.description = description
+        self.apply = apply
+
+
+class MigrationRunner:
+    """Applica le migrazioni mancanti e riporta avanzamento e tempi nel log.
+
+    `batch_size` è il numero di righe riscritte per transazione e `pause` la
+    pausa (secondi) tra due lotti, che lascia spazio alle scritture degli
+    scheduler; l'avanzamento viene registrato al più ogni `report_interval`
+    secondi.
+    """
+
+    def __init__(self, db_path: Path, migrations: Optional[Sequence[Migration]] = None,
+                 batch_size: int = 500, pause: float = 0.01, report_interval: float = 2.0):
+        self.db_path = db_path
+        self.migrations = sorted(MIGRATIONS if migrations is None else migrations,
+                                 key=lambda migration: migration.version)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.report_interval = report_interval
+
+    @staticmethod
+    def get_version(conn: sqlite3.Connection) -> int:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def current_version(self) -> int:
+        with sqlite3.connect(self.db_path) as conn:
+            return self.get_version(conn)
+
+    def pending(self) -> List[Migration]:
+        """Migrazioni non ancora applicate al database."""
+        version = self.current_version()
+        return [migration for migration in self.migrations if migration.version > version]
+
+    def run(self) -> int:
+        """Applica in ordine le migrazioni mancanti e restituisce la versione finale."""
+        pending = self.pending()
+        if not pending:
+            return self.current_version()
+
+        started = time.perf_counter()
+        for migration in pending:
+            self._apply(migration)
+        logger.info(
+            f"Schema aggiornato alla versione {pending[-1].version}: "
+            f"{len(pending)} migrazioni in {time.perf_counter() - started:.2f}s"
+        )
+        return pending[-1].version
+
+    def _apply(self, migration: Migration) -> None:
+        logger.info(f"Migrazione {migration.version}: {migration.description}")
+        started = time.perf_counter()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            migration.apply(conn, self)
+            if conn.in_transaction:
+                conn.commit()
+            # Un altro worker può aver completato la stessa migrazione nel frattempo:
+            # la versione registrata non torna mai indietro
+            conn.execute("BEGIN IMMEDIATE")
+            if self.get_version(conn) < migration.version:
+                conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Migrazione {migration.version} non riuscita: {e}")
+            raise
+        finally:
+            conn.close()
+        logger.info(
+            f"Migrazione {migration.version} completata in {time.perf_counter() - started:.2f}s"
+        )
+
+    def rewrite_in_batches(self, conn: sqlite3.Connection, table: str, columns: Sequence[str],
+                           transform: Callable[[tuple], Optional[tuple]],
+                           label: Optional[str] = None) -> int:
+        """Riscrive `columns` di `table` scorrendo la tabella per rowid a lotti.
+
+        `transform` riceve i valori correnti delle colonne e restituisce i nuovi
+        valori, oppure None se la riga non va modificata. Ogni lotto è una
+        transazione breve seguita da una pausa. Restituisce le righe modificate.
+        """
+        label = label or f"{table}({', '.join(columns)})"
+        total = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        select_sql = f"""
+            SELECT rowid, {', '.join(columns)} FROM {table}
+            WHERE rowid > ? ORDER BY rowid LIMIT ?
+        """
+        update_sql = f"""
+            UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)}
+            WHERE rowid = ?
+        """
+
+        last_rowid = -1
+        scanned = changed = 0
+        started = last_report = time.perf_counter()
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(select_sql, (last_rowid, self.batch_size)).fetchall()
+            if not rows:
+                conn.commit()
+                break
+
+            updates: List[Tuple] = []
+            for rowid, *values in rows:
+                new_values = transform(tuple(values))
+                if new_values is not None and tuple(new_values) != tuple(values):
+                    updates.append((*new_values, rowid))
+            if updates:
+                conn.executemany(update_sql, updates)
+            conn.commit()
+
+            last_rowid = rows[-1][0]
+            scanned += len(rows)
+            changed += len(updates)
+
+            now = time.perf_counter()
+            if now - last_report >= self.report_interval:
+                last_report = now
+                percent = scanned * 100 // total if total else 100
+                logger.info(
+                    f"{label}: {scanned}/{total} righe ({percent}%), "
+                    f"{changed} modificate, {scanned / (now - started):.0f} righe/s"
+                )
+            if self.pause:
+                time.sleep(self.pause)
+
+        logger.info(
+            f"{label}: {scanned} righe esaminate, {changed} modificate "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+        return changed
+
+
+def _normalize_timestamp(value):
+    """Porta un timestamp ISO al formato UTC usato nelle query (…+00:00)."""
+    if not isinstance(value, str) or not value:
+        return value
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+
+def _baseline(conn: sqlite3.Connection, runner: MigrationRunner) -> None:
+    """Lo schema di base è creato da DatabaseManager.init_db."""
+
+
+def _normalize_schedule_timestamps(conn: sqlite3.Connection, runner: MigrationRunner) -> None:
+    # send_time e anchor_time sono confrontati e ordinati come testo:
+    # valori naive o con fusi diversi finirebbero nel punto sbagliato
+    runner.rewrite_in_batches(
+        conn, 'scheduled_messages', ('send_time', 'anchor_time'),
+        lambda values: tuple(_normalize_timestamp(value) for value in values)
+    )
+
+
+def _index_messages_by_chat(conn: sqlite3.Connection, runner: MigrationRunner) -> None:
+    # La lista filtrata per gruppo ordina per send_time i messaggi di una chat
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_scheduled_messages_chat_time
+        ON scheduled_messages(chat_id, send_time)
+    """)
+    conn.commit()
+
+
+def _archive_table(conn: sqlite3.Connection, runner: MigrationRunner) -> None:
+    # Messaggi inattivi spostati dal job di retention, con il contenuto già risolto
+    # perché message_contents viene ripulita quando l'originale è eliminato
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS scheduled_messages_archive (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            message_type TEXT NOT NULL,
+            send_time TIMESTAMP NOT NULL,
+            text TEXT,
+            media TEXT,
+            caption TEXT,
+            pin BOOLEAN NOT NULL DEFAULT 0,
+            active BOOLEAN NOT NULL DEFAULT 0,
+            recurrence_type TEXT NOT NULL,
+            recurrence_days TEXT DEFAULT '',
+            schedule_hour INTEGER DEFAULT 0,
+            schedule_minute INTEGER DEFAULT 0,
+            cron_expression TEXT,
+            interval_seconds INTEGER,
+            anchor_time TIMESTAMP,
+            priority INTEGER NOT NULL DEFAULT 1,
+            archived_at TEXT NOT NULL
+        );
+    """)
+    # Nessun VACUUM qui: riscriverebbe l'intero file bloccando gli scheduler.
+    # I database nuovi nascono con auto_vacuum incrementale (vedi init_db),
+    # quelli esistenti si convertono offline con --enable-incremental-vacuum
+
+
+def _message_source(conn: sqlite3.Connection, runner: MigrationRunner) -> None:
+    # Chat e ID del messaggio originale, copiato con copy_message al momento dell'invio
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(scheduled_messages)")}
+    for column in ('source_chat_id', 'source_message_id'):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE scheduled_messages ADD COLUMN {column} INTEGER")
+    conn.commit()
+
+
+def _index_leases_and_horizons(conn: sqlite3.Connection, runner: MigrationRunner) -> None:
+    # get_next_fire_time legge le sole occorrenze con un lease (in invio o
+    # rimandate); expand_occurrences i soli messaggi con l'orizzonte in scadenza.
+    # Da qui ogni messaggio attivo ha una riga di orizzonte ('' se mai espanso)
+    conn.executescript("""
+        INSERT OR IGNORE INTO occurrence_horizon (message_id, expanded_until)
+        SELECT id, '' FROM scheduled_messages WHERE active = 1;
+
+        CREATE INDEX IF NOT EXISTS idx_message_occurrences_leased
+        ON message_occurrences(lease_expires)
+        WHERE status = 'pending' AND lease_expires IS NOT NULL;
+
+        CREATE INDEX IF NOT EXISTS idx_occurrence_horizon_until
+        ON occurrence_horizon(expanded_until);
+    """)
+
+
+def enable_incremental_vacuum(db_path: Path) -> bool:
+    """Converte il database ad auto_vacuum incrementale con un VACUUM completo.
+
+    Il VACUUM riscrive l'intero file e blocca ogni scrittura fino alla fine:
+    va eseguito a bot fermo. Restituisce False se il database era già
+    convertito.
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        started = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info(f"auto_vacuum incrementale attivato in {time.perf_counter() - started:.2f}s")
+        return True
+    finally:
+        conn.close()
+
+
+# Elenco ordinato delle migrazioni: si aggiungono in fondo, senza modificare
+# quelle già rilasciate
+MIGRATIONS = [
+    Migration(1, "schema di base", _baseline),
+    Migration(2, "normalizzazione in UTC di send_time e anchor_time", _normalize_schedule_timestamps),
+    Migration(3, "indice dei messaggi per chat e orario", _index_messages_by_chat),
+    Migration(4, "archivio dei messaggi inattivi", _archive_table),
+    Migration(5, "messaggio originale da copiare all'invio", _message_source),
+    Migration(6, "indici per lease e orizzonte delle occorrenze", _index_leases_and_horizons),
+]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from .database import DatabaseManager
+
+    parser = argparse.ArgumentParser(
+        prog='python -m database.migrations',
+        description="Applica le migrazioni dello schema al database dei messaggi."
+    )
+    parser.add_argument('--db', type=Path, default=DatabaseManager.DB_PATH,
+                        help="percorso del database (predefinito: database/messages.db)")
+    parser.add_argument('--status', action='store_true',
+                        help="mostra la versione corrente e le migrazioni in attesa")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="converte il database ad auto_vacuum incrementale "
+                             "(VACUUM completo: solo a bot fermo)")
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help="righe riscritte per transazione")
+    parser.add_argument('--pause', type=float, default=0.01,
+                        help="pausa in secondi tra due lotti")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    DatabaseManager.DB_PATH = args.db
+    runner = MigrationRunner(args.db, batch_size=args.batch_size, pause=args.pause)
+
+    if args.status:
+        pending = runner.pending()
+        print(f"Versione corrente: {runner.current_version()}")
+        print(f"Ultima versione disponibile: {runner.migrations[-1].version}")
+        for migration in pending:
+            print(f"  in attesa: {migration.version} - {migration.description}")
+        return 0
+
+    if args.enable_incremental_vacuum:
+        if not enable_incremental_vacuum(args.db):
+            print("auto_vacuum incrementale già attivo")
+        return 0
+
+    # init_db crea lo schema di base e applica le migrazioni con questo runner
+    DatabaseManager.init_db(runner)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
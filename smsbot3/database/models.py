@@ -1,6 +1,7 @@
 from enum import Enum
-from datetime import datetime
-from typing import Optional, List
+from datetime import datetime, timedelta
+from typing import Iterator, Optional, List
+from .cron import compile_cron
 
 class MessageType(Enum):
     """Tipi di messaggio supportati."""
@@ -8,12 +9,31 @@ class MessageType(Enum):
     PHOTO = "photo"
     VIDEO = "video"
     DOCUMENT = "document"
+    AUDIO = "audio"
+    VOICE = "voice"
+    ANIMATION = "animation"
+    STICKER = "sticker"
+    VIDEO_NOTE = "video_note"
+    # Contenuti senza equivalente salvabile (sondaggi, posizioni, contatti...):
+    # vengono inviati solo come copia del messaggio originale
+    COPY = "copy"
 
 class RecurrenceType(Enum):
     """Tipi di ricorrenza per i messaggi programmati."""
     ONCE = "once"      # Una volta sola
     DAILY = "daily"    # Ogni giorno
     WEEKLY = "weekly"  # Settimanale (giorni specifici)
+    CRON = "cron"      # Espressione cron (es. primo lunedì del mese)
+    INTERVAL = "interval"  # Ogni N secondi a partire da un orario di riferimento
+
+class MessagePriority(Enum):
+    """Priorità di invio: le corsie più alte vengono servite per prime."""
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+# Codici dei giorni usati in recurrence_days, nell'ordine di datetime.weekday()
+WEEKDAY_CODES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
 
 class ScheduledMessage:
     """Modello per i messaggi programmati."""
@@ -31,7 +51,14 @@ class ScheduledMessage:
         recurrence_type: str = "once",
         recurrence_days: str = "",
         schedule_hour: int = 0,
-        schedule_minute: int = 0
+        schedule_minute: int = 0,
+        content_id: Optional[int] = None,
+        cron_expression: Optional[str] = None,
+        interval_seconds: Optional[int] = None,
+        anchor_time: Optional[datetime] = None,
+        priority: int = MessagePriority.NORMAL.value,
+        source_chat_id: Optional[int] = None,
+        source_message_id: Optional[int] = None
     ):
         self.id = id
         self.chat_id = chat_id
@@ -46,6 +73,14 @@ class ScheduledMessage:
         self.recurrence_days = recurrence_days
         self.schedule_hour = schedule_hour
         self.schedule_minute = schedule_minute
+        self.content_id = content_id
+        self.cron_expression = cron_expression
+        self.interval_seconds = interval_seconds
+        self.anchor_time = anchor_time
+        self.priority = priority
+        # Messaggio originale da copiare all'invio (conserva la formattazione)
+        self.source_chat_id = source_chat_id
+        self.source_message_id = source_message_id
 
     @classmethod
     def from_db_row(cls, row: tuple) -> 'ScheduledMessage':
@@ -63,8 +98,78 @@ class ScheduledMessage:
             recurrence_type=row[9],
             recurrence_days=row[10],
             schedule_hour=row[11],
-            schedule_minute=row[12]
+            schedule_minute=row[12],
+            content_id=row[13] if len(row) > 13 else None,
+            cron_expression=row[14] if len(row) > 14 else None,
+            interval_seconds=row[15] if len(row) > 15 else None,
+            anchor_time=datetime.fromisoformat(row[16]) if len(row) > 16 and row[16] else None,
+            priority=row[17] if len(row) > 17 else MessagePriority.NORMAL.value,
+            source_chat_id=row[18] if len(row) > 18 else None,
+            source_message_id=row[19] if len(row) > 19 else None
+        )
+
+    def content(self) -> dict:
+        """Contenuto da inviare, nel formato usato da sender.send_content."""
+        return {
+            'message_type': self.message_type,
+            'text': self.text,
+            'media': self.media,
+            'caption': self.caption,
+            'source_chat_id': self.source_chat_id,
+            'source_message_id': self.source_message_id
+        }
+
+    def next_occurrence(self, after: datetime) -> Optional[datetime]:
+        """Calcola il primo invio strettamente successivo ad `after` (None se non ricorrente)."""
+        if self.recurrence_type == RecurrenceType.ONCE.value:
+            return None
+
+        if self.recurrence_type == RecurrenceType.CRON.value:
+            if not self.cron_expression:
+                return None
+            return compile_cron(self.cron_expression).next_after(after)
+
+        if self.recurrence_type == RecurrenceType.INTERVAL.value:
+            if not self.interval_seconds or not self.anchor_time:
+                return None
+            # anchor + k·intervallo: il ritardo di un invio non si accumula sui successivi
+            interval = timedelta(seconds=self.interval_seconds)
+            if after < self.anchor_time:
+                return self.anchor_time
+            return self.anchor_time + ((after - self.anchor_time) // interval + 1) * interval
+
+        candidate = after.replace(
+            hour=self.schedule_hour,
+            minute=self.schedule_minute,
+            second=0,
+            microsecond=0
         )
+        if candidate <= after:
+            candidate += timedelta(days=1)
+
+        if self.recurrence_type == RecurrenceType.DAILY.value:
+            return candidate
+
+        if self.recurrence_type == RecurrenceType.WEEKLY.value:
+            days = {
+                WEEKDAY_CODES.index(day)
+                for day in (self.recurrence_days or '').split(',')
+                if day in WEEKDAY_CODES
+            }
+            if not days:
+                return None
+            while candidate.weekday() not in days:
+                candidate += timedelta(days=1)
+            return candidate
+
+        return None
+
+    def occurrences(self, after: datetime, until: datetime) -> Iterator[datetime]:
+        """Genera gli invii compresi tra `after` (escluso) e `until` (incluso)."""
+        current = self.next_occurrence(after)
+        while current is not None and current <= until:
+            yield current
+            current = self.next_occurrence(current)
 
     def to_dict(self) -> dict:
         """Converte l'oggetto in dizionario."""
@@ -81,5 +186,12 @@ class ScheduledMessage:
             'recurrence_type': self.recurrence_type,
             'recurrence_days': self.recurrence_days,
             'schedule_hour': self.schedule_hour,
-            'schedule_minute': self.schedule_minute
+            'schedule_minute': self.schedule_minute,
+            'content_id': self.content_id,
+            'cron_expression': self.cron_expression,
+            'interval_seconds': self.interval_seconds,
+            'anchor_time': self.anchor_time.isoformat() if self.anchor_time else None,
+            'priority': self.priority,
+            'source_chat_id': self.source_chat_id,
+            'source_message_id': self.source_message_id
         }
\ No newline at end of file
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from clock import SystemClock
+from database.database import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryLogWriter:
+    """Raccoglie gli esiti di invio in memoria e li scrive nel database a lotti.
+
+    Il lotto viene scritto quando raggiunge `batch_size` record o al più tardi
+    ogni `flush_interval` secondi; in caso di errore i record restano in
+    memoria (al massimo `max_pending`) e vengono riscritti al giro successivo.
+    """
+
+    def __init__(self, batch_size: int = 100, flush_interval: float = 5.0, max_pending: int = 10000,
+                 clock: Optional[SystemClock] = None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.clock = clock or SystemClock()
+        self._pending: List[tuple] = []
+
+    def record(self, message, scheduled_time: Optional[str], status: str,
+               error_kind: Optional[str] = None) -> None:
+        """Accoda l'esito ('sent', 'failed' o 'dead') di un invio."""
+        self._pending.append((
+            message.id,
+            message.chat_id,
+            message.message_type.value,
+            scheduled_time,
+            status,
+            error_kind,
+            self.clock.now().isoformat()
+        ))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Scrive i record in attesa."""
+        if not self._pending:
+            return
+
+        records, self._pending = self._pending, []
+        if DatabaseManager.record_deliveries(records):
+            return
+
+        self._pending = records + self._pending
+        if len(self._pending) > self.max_pending:
+            dropped = len(self._pending) - self.max_pending
+            self._pending = self._pending[dropped:]
+            logger.warning(f"Registro degli invii pieno: scartati {dropped} record")
+
+    async def run(self) -> None:
+        """Scrive periodicamente i record in attesa; all'arresto scrive gli ultimi."""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        finally:
+            self.flush()
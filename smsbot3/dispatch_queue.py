@@ -0,0 +1,63 @@
+import asyncio
+from collections import deque
+from typing import Any, List, Optional
+
+from clock import SystemClock
+
+
+class PriorityDispatchQueue:
+    """Coda di invio a più corsie: le corsie più alte vengono servite per prime.
+
+    Per evitare che le corsie basse restino ferme durante un picco, una corsia
+    non vuota scavalcata `starvation_limit` volte viene servita al giro successivo.
+    """
+
+    def __init__(self, lanes: int = 3, starvation_limit: int = 5):
+        self._lanes: List[deque] = [deque() for _ in range(lanes)]
+        self._skipped = [0] * lanes
+        self.starvation_limit = starvation_limit
+
+    def __len__(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    def push(self, priority: int, item: Any) -> None:
+        """Accoda un elemento nella corsia della sua priorità."""
+        lane = min(max(priority, 0), len(self._lanes) - 1)
+        self._lanes[lane].append(item)
+
+    def pop(self) -> Any:
+        """Estrae il prossimo elemento da inviare."""
+        candidates = [i for i, lane in enumerate(self._lanes) if lane]
+        if not candidates:
+            raise IndexError("Coda di invio vuota")
+
+        highest = candidates[-1]
+        starved = [i for i in candidates if i != highest and self._skipped[i] >= self.starvation_limit]
+        chosen = starved[-1] if starved else highest
+
+        for i in candidates:
+            self._skipped[i] = 0 if i == chosen else self._skipped[i] + 1
+        return self._lanes[chosen].popleft()
+
+
+class RateLimiter:
+    """Token bucket asincrono: al massimo `rate` invii al secondo, con raffiche fino a `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1, clock: Optional[SystemClock] = None):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock or SystemClock()
+        self._tokens = float(burst)
+        self._updated = self.clock.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = self.clock.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await self.clock.sleep((1 - self._tokens) / self.rate)
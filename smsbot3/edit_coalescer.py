@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingEdit:
+    __slots__ = ('wanted', 'shown', 'task')
+
+    def __init__(self, shown: Optional[InlineKeyboardMarkup]):
+        self.wanted: Optional[InlineKeyboardMarkup] = None
+        self.shown = shown
+        self.task: Optional[asyncio.Task] = None
+
+
+class KeyboardEditCoalescer:
+    """Raggruppa le modifiche ravvicinate alla tastiera di un messaggio.
+
+    La prima modifica parte subito; quelle che arrivano nei `delay` secondi
+    successivi si accumulano e ne viene inviata solo l'ultima, con
+    edit_message_reply_markup (il testo non cambia). Una tastiera uguale a
+    quella già mostrata non viene inviata. Chi modifica il messaggio in
+    altro modo deve prima chiamare cancel(), altrimenti una modifica in
+    attesa potrebbe rimettere la tastiera vecchia.
+    """
+
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self._pending: Dict[Tuple[int, int], _PendingEdit] = {}
+
+    @staticmethod
+    def _key(message: Message) -> Tuple[int, int]:
+        return message.chat.id, message.message_id
+
+    def update(self, bot: Bot, message: Message, markup: InlineKeyboardMarkup) -> None:
+        """Richiede di mostrare `markup` sotto `message`, il messaggio del callback."""
+        key = self._key(message)
+        pending = self._pending.get(key)
+        if pending is None:
+            # Il messaggio del callback riporta la tastiera mostrata al momento del tocco
+            pending = self._pending[key] = _PendingEdit(message.reply_markup)
+        pending.wanted = markup
+        if pending.task is None:
+            pending.task = asyncio.create_task(self._run(bot, key, pending))
+
+    def cancel(self, message: Message) -> None:
+        """Annulla le modifiche in attesa per `message`."""
+        pending = self._pending.pop(self._key(message), None)
+        if pending is not None and pending.task is not None:
+            pending.task.cancel()
+
+    async def _run(self, bot: Bot, key: Tuple[int, int], pending: _PendingEdit) -> None:
+        chat_id, message_id = key
+        try:
+            while pending.wanted != pending.shown:
+                markup = pending.wanted
+                try:
+                    await bot.edit_message_reply_markup(
+                        chat_id=chat_id, message_id=message_id, reply_markup=markup
+                    )
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    continue
+                except TelegramBadRequest as e:
+                    if 'message is not modified' not in str(e):
+                        logger.warning(f"Modifica della tastiera non riuscita: {e}")
+                        return
+                pending.shown = markup
+                # Finestra in cui i tocchi successivi si sommano in un'unica modifica
+                await asyncio.sleep(self.delay)
+        except Exception as e:
+            logger.error(f"Errore nella modifica della tastiera: {e}")
+        finally:
+            if self._pending.get(key) is pending:
+                del self._pending[key]
@@ -0,0 +1,138 @@
+import logging
+from collections import OrderedDict, deque
+from copy import copy
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from clock import SystemClock
+
+logger = logging.getLogger(__name__)
+
+# Motivo per cui una conversazione attiva è stata rimossa (vedi pop_expired)
+EXPIRED = 'expired'
+EVICTED = 'evicted'
+
+_REASON_LOG = {
+    EXPIRED: 'scaduta',
+    EVICTED: 'scartata per limite di memoria',
+}
+
+
+class _Record:
+    __slots__ = ('state', 'data', 'touched')
+
+    def __init__(self, touched: float):
+        self.state: Optional[str] = None
+        self.data: Dict[str, Any] = {}
+        self.touched = touched
+
+
+class ExpiringMemoryStorage(BaseStorage):
+    """Storage FSM in memoria con scadenza per inattività e numero massimo di conversazioni.
+
+    A differenza di MemoryStorage, la lettura di una chiave sconosciuta non
+    crea record e una conversazione senza stato né dati viene rimossa.
+    Le conversazioni ferme da più di `ttl` secondi scadono (anche alla prima
+    lettura, prima del giro di pulizia); oltre `max_entries` viene scartata
+    quella inattiva da più tempo. Le conversazioni interrotte con uno stato
+    attivo si ritirano con pop_expired(), insieme al motivo (EXPIRED o
+    EVICTED), per avvisare l'utente.
+    """
+
+    def __init__(self, ttl: float = 1800, max_entries: int = 1000,
+                 clock: Optional[SystemClock] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock or SystemClock()
+        # Dalla meno recente alla più recente: la pulizia si ferma alla prima non scaduta
+        self._records: 'OrderedDict[StorageKey, _Record]' = OrderedDict()
+        self._expired: deque = deque(maxlen=max_entries)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _get(self, key: StorageKey) -> Optional[_Record]:
+        record = self._records.get(key)
+        if record is None:
+            return None
+        now = self.clock.monotonic()
+        if now - record.touched > self.ttl:
+            self._drop(key, EXPIRED)
+            return None
+        record.touched = now
+        self._records.move_to_end(key)
+        return record
+
+    def _get_or_create(self, key: StorageKey) -> _Record:
+        record = self._get(key)
+        if record is None:
+            record = self._records[key] = _Record(self.clock.monotonic())
+            while len(self._records) > self.max_entries:
+                self._drop(next(iter(self._records)), EVICTED)
+        return record
+
+    def _drop(self, key: StorageKey, reason: str) -> None:
+        record = self._records.pop(key)
+        if record.state is not None:
+            logger.info(f"Conversazione {record.state} di {key.user_id} {_REASON_LOG[reason]}")
+            self._expired.append((key, record.state, reason))
+
+    def _discard_if_empty(self, key: StorageKey, record: _Record) -> None:
+        if record.state is None and not record.data:
+            del self._records[key]
+
+    def expire(self) -> int:
+        """Rimuove le conversazioni inattive da più di `ttl` secondi; restituisce quante."""
+        deadline = self.clock.monotonic() - self.ttl
+        expired = 0
+        while self._records:
+            key, record = next(iter(self._records.items()))
+            if record.touched >= deadline:
+                break
+            self._drop(key, EXPIRED)
+            expired += 1
+        return expired
+
+    def pop_expired(self) -> List[Tuple[StorageKey, str, str]]:
+        """Chiave, stato e motivo delle conversazioni attive scadute o scartate dall'ultima chiamata."""
+        expired = list(self._expired)
+        self._expired.clear()
+        return expired
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        record = self._get_or_create(key) if state is not None else self._get(key)
+        if record is not None:
+            record.state = state
+            self._discard_if_empty(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._get(key)
+        return record.state if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        record = self._get_or_create(key) if data else self._get(key)
+        if record is not None:
+            record.data = data.copy()
+            self._discard_if_empty(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._get(key)
+        return record.data.copy() if record is not None else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Any = None) -> Any:
+        record = self._get(storage_key)
+        if record is None:
+            return default
+        return copy(record.data.get(dict_key, default))
+
+    async def close(self) -> None:
+        self._records.clear()
+        self._expired.clear()
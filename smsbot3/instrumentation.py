@@ -0,0 +1,174 @@
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+# Restituito quando non ci sono hook: nessuna misura, nessuna allocazione
+_NO_TIMER = nullcontext()
+
+
+class PhaseHook:
+    """Hook dello scheduler: riceve la durata (secondi) di ogni fase e di ogni giro.
+
+    I metodi vengono chiamati nel loop, subito dopo la fase misurata:
+    devono essere veloci e non bloccare.
+    """
+
+    def on_phase(self, phase: str, duration: float) -> None:
+        pass
+
+    def on_tick(self, duration: float) -> None:
+        pass
+
+
+class _Timer:
+    __slots__ = ('instrumentation', 'phase', 'started')
+
+    def __init__(self, instrumentation: 'SchedulerInstrumentation', phase: str):
+        self.instrumentation = instrumentation
+        self.phase = phase
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation._emit(self.phase, time.perf_counter() - self.started)
+        return False
+
+
+class SchedulerInstrumentation:
+    """Misura le fasi di un giro dello scheduler e ne passa le durate agli hook.
+
+    Uso: ``with instrumentation.phase('dispatch.send'): ...`` per una fase,
+    ``with instrumentation.tick(): ...`` per il giro intero. Senza hook
+    registrati entrambi restituiscono un context manager vuoto condiviso,
+    quindi il costo è una chiamata di metodo.
+    """
+
+    TICK = None
+
+    def __init__(self, hooks: Iterable[PhaseHook] = ()):
+        self.hooks: List[PhaseHook] = list(hooks)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.hooks)
+
+    def add_hook(self, hook: PhaseHook) -> None:
+        self.hooks.append(hook)
+
+    def phase(self, name: str):
+        return _Timer(self, name) if self.hooks else _NO_TIMER
+
+    def tick(self):
+        return _Timer(self, self.TICK) if self.hooks else _NO_TIMER
+
+    def _emit(self, phase, duration: float) -> None:
+        for hook in self.hooks:
+            try:
+                if phase is self.TICK:
+                    hook.on_tick(duration)
+                else:
+                    hook.on_phase(phase, duration)
+            except Exception as e:
+                logger.error(f"Errore nell'hook {type(hook).__name__}: {e}")
+
+
+class PhaseStats(PhaseHook):
+    """Conteggi, tempo totale e massimo di ogni fase dall'avvio (o dall'ultimo reset)."""
+
+    def __init__(self):
+        # Protegge la creazione delle fasi, letta dal thread dell'endpoint HTTP
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            # Fase -> [conteggio, totale, massimo]
+            self.phases: Dict[str, list] = {}
+            self.ticks = [0, 0.0, 0.0]
+
+    @staticmethod
+    def _add(stats: list, duration: float) -> None:
+        stats[0] += 1
+        stats[1] += duration
+        if duration > stats[2]:
+            stats[2] = duration
+
+    def on_phase(self, phase: str, duration: float) -> None:
+        stats = self.phases.get(phase)
+        if stats is None:
+            with self._lock:
+                stats = self.phases.setdefault(phase, [0, 0.0, 0.0])
+        self._add(stats, duration)
+
+    def on_tick(self, duration: float) -> None:
+        self._add(self.ticks, duration)
+
+    def summary_lines(self) -> List[str]:
+        """Una riga per fase, dalla più costosa; i tempi sono in millisecondi."""
+        count, total, longest = self.ticks
+        lines = [f"giri {count}: totale {total * 1000:.0f}ms, massimo {longest * 1000:.1f}ms"]
+        for phase, (count, total, longest) in sorted(self.phases.items(), key=lambda item: -item[1][1]):
+            lines.append(
+                f"{phase}: {count} volte, totale {total * 1000:.0f}ms, "
+                f"media {total / count * 1000:.2f}ms, massimo {longest * 1000:.1f}ms"
+            )
+        return lines
+
+    def prometheus(self) -> str:
+        """Statistiche nel formato di testo di Prometheus (tempi in secondi).
+
+        Viene chiamato dal thread dell'endpoint HTTP: le statistiche vengono
+        copiate sotto il lock, mentre il loop non può aggiungere fasi.
+        """
+        with self._lock:
+            phases = sorted((phase, list(stats)) for phase, stats in self.phases.items())
+            ticks = list(self.ticks)
+        lines = [
+            "# TYPE smsbot_scheduler_tick_seconds summary",
+            f"smsbot_scheduler_tick_seconds_count {ticks[0]}",
+            f"smsbot_scheduler_tick_seconds_sum {ticks[1]:.6f}",
+            "# TYPE smsbot_scheduler_tick_max_seconds gauge",
+            f"smsbot_scheduler_tick_max_seconds {ticks[2]:.6f}",
+            "# TYPE smsbot_scheduler_phase_seconds summary",
+        ]
+        for phase, (count, total, _) in phases:
+            lines.append(f'smsbot_scheduler_phase_seconds_count{{phase="{phase}"}} {count}')
+            lines.append(f'smsbot_scheduler_phase_seconds_sum{{phase="{phase}"}} {total:.6f}')
+        lines.append("# TYPE smsbot_scheduler_phase_max_seconds gauge")
+        for phase, (_, _, longest) in phases:
+            lines.append(f'smsbot_scheduler_phase_max_seconds{{phase="{phase}"}} {longest:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+class SlowTickLogger(PhaseHook):
+    """Registra nel log la ripartizione per fase dei giri più lenti di `threshold` secondi."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._current: Dict[str, list] = {}
+
+    def on_phase(self, phase: str, duration: float) -> None:
+        stats = self._current.get(phase)
+        if stats is None:
+            self._current[phase] = [1, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+
+    def on_tick(self, duration: float) -> None:
+        phases, self._current = self._current, {}
+        if duration < self.threshold:
+            return
+        measured = sum(total for _, total in phases.values())
+        lines = [
+            f"  {phase}: {total * 1000:.1f}ms ({count}x)"
+            for phase, (count, total) in sorted(phases.items(), key=lambda item: -item[1][1])
+        ]
+        lines.append(f"  altro: {max(duration - measured, 0.0) * 1000:.1f}ms")
+        logger.warning(f"Giro dello scheduler lento: {duration * 1000:.0f}ms\n" + "\n".join(lines))
@@ -1,5 +1,26 @@
 import os
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from callbacks import (
+    GroupCallback,
+    PinCallback,
+    ScheduleGroupCallback,
+    ScheduleTypeCallback,
+    DayCallback,
+    SchedulePinCallback,
+    PriorityCallback,
+    FilterCallback,
+    DetailsCallback,
+    PreviewCallback,
+    ToggleCallback,
+    DeleteCallback,
+    ConfirmDeleteCallback,
+    SearchPageCallback,
+    DeadLetterCallback,
+    StatsCallback,
+    BulkActionCallback,
+    BulkConfirmCallback,
+    ExportCallback
+)
 
 # Prendi i nomi dei gruppi dalle variabili d'ambiente con valori di default
 GRUPPO_1_NAME = os.getenv('GRUPPO_1_NAME', 'Clienti')
@@ -25,6 +46,36 @@ def main_menu_keyboard() -> InlineKeyboardMarkup:
                 text="📋 Lista Messaggi",
                 callback_data="list_messages"
             )
+        ],
+        [
+            InlineKeyboardButton(
+                text="🔎 Cerca Messaggi",
+                callback_data="search_messages"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="🧹 Operazioni di Massa",
+                callback_data="bulk_menu"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="☠️ Invii Falliti",
+                callback_data="dead_letters"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="📊 Statistiche",
+                callback_data="delivery_stats"
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="📦 Importa/Esporta",
+                callback_data="import_export"
+            )
         ]
     ])
     return keyboard
@@ -35,19 +86,19 @@ def groups_keyboard() -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text=f"📢 {GRUPPO_1_NAME}",  # Usa il nome del gruppo
-                callback_data="group_1"
+                callback_data=GroupCallback(target="1").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text=f"📢 {GRUPPO_2_NAME}",  # Usa il nome del gruppo
-                callback_data="group_2"
+                callback_data=GroupCallback(target="2").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text="📢 Entrambi i gruppi",
-                callback_data="group_both"
+                callback_data=GroupCallback(target="both").pack()
             )
         ],
         [
@@ -65,19 +116,19 @@ def schedule_groups_keyboard() -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text=f"📅 {GRUPPO_1_NAME}",
-                callback_data="schedule_to_1"
+                callback_data=ScheduleGroupCallback(target="1").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text=f"📅 {GRUPPO_2_NAME}",
-                callback_data="schedule_to_2"
+                callback_data=ScheduleGroupCallback(target="2").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text="📅 Entrambi i gruppi",
-                callback_data="schedule_to_both"
+                callback_data=ScheduleGroupCallback(target="both").pack()
             )
         ],
         [
@@ -95,19 +146,31 @@ def schedule_type_keyboard() -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text="🕐 Una volta",
-                callback_data="schedule_type_once"
+                callback_data=ScheduleTypeCallback(kind="once").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text="📅 Ogni giorno",
-                callback_data="schedule_type_daily"
+                callback_data=ScheduleTypeCallback(kind="daily").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text="📆 Giorni specifici",
-                callback_data="schedule_type_weekly"
+                callback_data=ScheduleTypeCallback(kind="weekly").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="🧩 Espressione cron",
+                callback_data=ScheduleTypeCallback(kind="cron").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="🔁 A intervallo",
+                callback_data=ScheduleTypeCallback(kind="interval").pack()
             )
         ],
         [
@@ -140,14 +203,14 @@ def weekdays_keyboard(selected_days: list = None) -> InlineKeyboardMarkup:
         keyboard.append([
             InlineKeyboardButton(
                 text=f"{day_name} {selected}",
-                callback_data=f"day_{day_code}"
+                callback_data=DayCallback(day=day_code).pack()
             )
         ])
     
     keyboard.append([
         InlineKeyboardButton(
             text="✅ Conferma",
-            callback_data="days_confirm"
+            callback_data=DayCallback(day="confirm").pack()
         )
     ])
     
@@ -166,11 +229,11 @@ def pin_keyboard() -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text="Si",
-                callback_data="pin_yes"
+                callback_data=PinCallback(pin=True).pack()
             ),
             InlineKeyboardButton(
                 text="No",
-                callback_data="pin_no"
+                callback_data=PinCallback(pin=False).pack()
             )
         ],
         [
@@ -188,11 +251,41 @@ def schedule_pin_keyboard() -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text="Si",
-                callback_data="schedule_pin_yes"
+                callback_data=SchedulePinCallback(pin=True).pack()
             ),
             InlineKeyboardButton(
                 text="No",
-                callback_data="schedule_pin_no"
+                callback_data=SchedulePinCallback(pin=False).pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="⬅️ Menu",
+                callback_data="main_menu"
+            )
+        ]
+    ])
+    return keyboard
+
+def schedule_priority_keyboard() -> InlineKeyboardMarkup:
+    """Tastiera per la priorità di invio dei messaggi schedulati."""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text="🚨 Urgente",
+                callback_data=PriorityCallback(priority=2).pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="➖ Normale",
+                callback_data=PriorityCallback(priority=1).pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="🐢 Bassa",
+                callback_data=PriorityCallback(priority=0).pack()
             )
         ],
         [
@@ -210,19 +303,25 @@ def messages_filter_keyboard() -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text=f"📢 {GRUPPO_1_NAME}",
-                callback_data="filter_group1"
+                callback_data=FilterCallback(group="group1").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text=f"📢 {GRUPPO_2_NAME}",
-                callback_data="filter_group2"
+                callback_data=FilterCallback(group="group2").pack()
             )
         ],
         [
             InlineKeyboardButton(
                 text="📢 Tutti i gruppi",
-                callback_data="filter_all"
+                callback_data=FilterCallback(group="all").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="⏭ Prossimi invii (24h)",
+                callback_data="upcoming_messages"
             )
         ],
         [
@@ -235,14 +334,8 @@ def messages_filter_keyboard() -> InlineKeyboardMarkup:
     return keyboard
 
 def message_details_keyboard() -> InlineKeyboardMarkup:
-    """Tastiera per le azioni disponibili nella vista dettagli."""
+    """Tastiera di navigazione sotto le liste di messaggi."""
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(
-                text="🔍 Visualizza Dettagli",
-                callback_data="view_message_details"
-            )
-        ],
         [
             InlineKeyboardButton(
                 text="🔄 Aggiorna Lista",
@@ -258,6 +351,56 @@ def message_details_keyboard() -> InlineKeyboardMarkup:
     ])
     return keyboard
 
+def message_list_keyboard(message_ids: list, with_navigation: bool = True) -> InlineKeyboardMarkup:
+    """Un pulsante dei dettagli per ogni messaggio della pagina, quattro per riga."""
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                text=f"🔍 {message_id}",
+                callback_data=DetailsCallback(message_id=message_id).pack()
+            )
+            for message_id in message_ids[i:i + 4]
+        ]
+        for i in range(0, len(message_ids), 4)
+    ]
+    if with_navigation:
+        keyboard.extend(message_details_keyboard().inline_keyboard)
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def message_item_keyboard(msg_id: int, active: bool, has_media: bool,
+                          list_filter: str = "all") -> InlineKeyboardMarkup:
+    """Azioni sulla vista dettagli di un messaggio, eseguite modificando la vista stessa."""
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                text="⏸ Disattiva" if active else "▶️ Attiva",
+                callback_data=ToggleCallback(message_id=msg_id).pack()
+            ),
+            InlineKeyboardButton(
+                text="❌ Elimina",
+                callback_data=DeleteCallback(message_id=msg_id).pack()
+            )
+        ]
+    ]
+    if has_media:
+        keyboard.append([
+            InlineKeyboardButton(
+                text="🖼 Anteprima Media",
+                callback_data=PreviewCallback(message_id=msg_id).pack()
+            )
+        ])
+    keyboard.append([
+        InlineKeyboardButton(
+            text="📋 Torna alla Lista",
+            callback_data=FilterCallback(group=list_filter).pack()
+        ),
+        InlineKeyboardButton(
+            text="🏠 Menu",
+            callback_data="main_menu"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 def message_actions_keyboard(message_id: int = None) -> InlineKeyboardMarkup:
     """Crea la tastiera per le azioni sui messaggi programmati."""
     if message_id is not None:
@@ -269,7 +412,7 @@ def message_actions_keyboard(message_id: int = None) -> InlineKeyboardMarkup:
                 ),
                 InlineKeyboardButton(
                     text="❌ Elimina",
-                    callback_data=f"delete_{message_id}"
+                    callback_data=DeleteCallback(message_id=message_id).pack()
                 )
             ],
             [
@@ -306,11 +449,180 @@ def confirmation_keyboard(msg_id: int) -> InlineKeyboardMarkup:
         [
             InlineKeyboardButton(
                 text="✅ Conferma Eliminazione",
-                callback_data=f"confirm_delete_{msg_id}"
+                callback_data=ConfirmDeleteCallback(message_id=msg_id, confirm=True).pack()
+            ),
+            InlineKeyboardButton(
+                text="❌ Annulla",
+                callback_data=ConfirmDeleteCallback(message_id=msg_id, confirm=False).pack()
+            )
+        ]
+    ])
+    return keyboard
+
+def bulk_actions_keyboard() -> InlineKeyboardMarkup:
+    """Tastiera per le operazioni di massa sui messaggi programmati."""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text=f"⏸ Sospendi tutti - {GRUPPO_1_NAME}",
+                callback_data=BulkActionCallback(action="pause_group1").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text=f"⏸ Sospendi tutti - {GRUPPO_2_NAME}",
+                callback_data=BulkActionCallback(action="pause_group2").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="▶️ Riattiva tutti i giornalieri",
+                callback_data=BulkActionCallback(action="resume_daily").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="▶️ Riattiva tutti i settimanali",
+                callback_data=BulkActionCallback(action="resume_weekly").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="🗑 Elimina singoli inattivi",
+                callback_data=BulkActionCallback(action="delete_once_inactive").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="🗑 Elimina tutti gli inattivi",
+                callback_data=BulkActionCallback(action="delete_inactive").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="⬅️ Menu",
+                callback_data="main_menu"
+            )
+        ]
+    ])
+    return keyboard
+
+def import_export_keyboard() -> InlineKeyboardMarkup:
+    """Tastiera per l'esportazione delle programmazioni (l'importazione avviene inviando un file)."""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text="📤 Esporta CSV",
+                callback_data=ExportCallback(fmt="csv").pack()
+            ),
+            InlineKeyboardButton(
+                text="📤 Esporta JSONL",
+                callback_data=ExportCallback(fmt="jsonl").pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="⬅️ Menu",
+                callback_data="main_menu"
+            )
+        ]
+    ])
+    return keyboard
+
+def bulk_confirmation_keyboard(action: str) -> InlineKeyboardMarkup:
+    """Tastiera per la conferma di un'operazione di massa."""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text="✅ Conferma",
+                callback_data=BulkConfirmCallback(action=action).pack()
             ),
             InlineKeyboardButton(
                 text="❌ Annulla",
-                callback_data="cancel_delete"
+                callback_data="bulk_menu"
+            )
+        ]
+    ])
+    return keyboard
+
+def search_results_keyboard(page: int, has_next: bool) -> InlineKeyboardMarkup:
+    """Tastiera di navigazione tra le pagine dei risultati di ricerca."""
+    navigation = []
+    if page > 0:
+        navigation.append(
+            InlineKeyboardButton(
+                text="⬅️ Precedenti",
+                callback_data=SearchPageCallback(page=page - 1).pack()
+            )
+        )
+    if has_next:
+        navigation.append(
+            InlineKeyboardButton(
+                text="Successivi ➡️",
+                callback_data=SearchPageCallback(page=page + 1).pack()
+            )
+        )
+
+    keyboard = [navigation] if navigation else []
+    keyboard.append([
+        InlineKeyboardButton(
+            text="🔎 Nuova Ricerca",
+            callback_data="search_messages"
+        ),
+        InlineKeyboardButton(
+            text="🏠 Menu",
+            callback_data="main_menu"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def dead_letters_keyboard(dead_letter_ids: list) -> InlineKeyboardMarkup:
+    """Tastiera per riaccodare o eliminare gli invii falliti."""
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                text=f"♻️ Riaccoda #{dead_letter_id}",
+                callback_data=DeadLetterCallback(action="requeue", dead_letter_id=dead_letter_id).pack()
+            )
+        ]
+        for dead_letter_id in dead_letter_ids
+    ]
+    if dead_letter_ids:
+        keyboard.append([
+            InlineKeyboardButton(
+                text="🗑 Svuota Lista",
+                callback_data=DeadLetterCallback(action="purge").pack()
+            )
+        ])
+    keyboard.append([
+        InlineKeyboardButton(
+            text="⬅️ Menu",
+            callback_data="main_menu"
+        )
+    ])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+def delivery_stats_keyboard() -> InlineKeyboardMarkup:
+    """Tastiera per scegliere il periodo delle statistiche di invio."""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(
+                text="Oggi",
+                callback_data=StatsCallback(days=1).pack()
+            ),
+            InlineKeyboardButton(
+                text="7 giorni",
+                callback_data=StatsCallback(days=7).pack()
+            ),
+            InlineKeyboardButton(
+                text="30 giorni",
+                callback_data=StatsCallback(days=30).pack()
+            )
+        ],
+        [
+            InlineKeyboardButton(
+                text="⬅️ Menu",
+                callback_data="main_menu"
             )
         ]
     ])
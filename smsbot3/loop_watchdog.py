@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """Misura il ritardo dell'event loop e individua le chiamate che lo bloccano.
+
+    Un task si risveglia ogni `interval` secondi e misura di quanto arriva in
+    ritardo. Un thread di supporto controlla il battito del task: se il loop
+    resta fermo oltre `threshold` secondi campiona lo stack del thread del
+    loop ogni `sample_interval` secondi e, alla ripresa, registra nel log
+    durata del blocco e chiamata responsabile.
+    """
+
+    def __init__(self, threshold: float = 0.25, interval: float = 0.1,
+                 sample_interval: float = 0.05, project_root: Optional[Path] = None):
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_interval = sample_interval
+        self.project_root = str(project_root or Path(__file__).resolve().parent)
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall: Optional[dict] = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+
+    def current_lag(self) -> float:
+        """Ritardo attuale: l'ultimo misurato o, se il loop è fermo adesso, quello in corso."""
+        blocked = time.monotonic() - self._heartbeat - self.interval
+        return max(self.lag, blocked, 0.0)
+
+    def status(self) -> dict:
+        lag = self.current_lag()
+        return {
+            'status': 'ok' if lag < self.threshold else 'degraded',
+            'lag_ms': round(lag * 1000, 1),
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'threshold_ms': round(self.threshold * 1000, 1),
+            'stalls': self.stalls,
+            'last_stall': self.last_stall
+        }
+
+    async def run(self) -> None:
+        """Misura il ritardo del loop finché il task non viene cancellato."""
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        thread.start()
+        try:
+            while True:
+                started = time.monotonic()
+                self._heartbeat = started
+                await asyncio.sleep(self.interval)
+                self.lag = max(0.0, time.monotonic() - started - self.interval)
+                self.max_lag = max(self.max_lag, self.lag)
+        finally:
+            self._stop.set()
+
+    def _call_site(self, stack: traceback.StackSummary) -> str:
+        """Frame più interno del codice del bot (escluse libreria standard e dipendenze)."""
+        for frame in reversed(stack):
+            if frame.filename.startswith(self.project_root) and frame.filename != __file__:
+                path = Path(frame.filename).relative_to(self.project_root)
+                return f"{path}:{frame.lineno} in {frame.name}"
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} in {frame.name}"
+
+    def _watch(self) -> None:
+        stall_start = None
+        samples: Counter = Counter()
+        stacks = {}
+        while not self._stop.wait(self.sample_interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            if blocked >= self.threshold:
+                if stall_start is None:
+                    stall_start = heartbeat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    stack = traceback.extract_stack(frame)
+                    site = self._call_site(stack)
+                    samples[site] += 1
+                    stacks.setdefault(site, stack)
+            elif stall_start is not None and heartbeat != stall_start:
+                self._report(heartbeat - stall_start - self.interval, samples, stacks)
+                stall_start = None
+                samples = Counter()
+                stacks = {}
+
+    def _report(self, duration: float, samples: Counter, stacks: dict) -> None:
+        self.stalls += 1
+        total = sum(samples.values())
+        sites = samples.most_common()
+        self.last_stall = {
+            'duration_ms': round(duration * 1000, 1),
+            'call_site': sites[0][0] if sites else None,
+            'at': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        if not sites:
+            logger.warning(f"Event loop bloccato per {duration:.2f}s (stack non disponibile)")
+            return
+
+        # La durata di ogni chiamata è stimata dalla quota di campioni in cui compare
+        lines = [
+            f"  {site}: ~{duration * count / total:.2f}s ({count}/{total} campioni)"
+            for site, count in sites
+        ]
+        stack = ''.join(traceback.format_list(stacks[sites[0][0]]))
+        logger.warning(
+            f"Event loop bloccato per {duration:.2f}s. Chiamate in corso:\n"
+            + "\n".join(lines)
+            + f"\nStack della chiamata principale:\n{stack}"
+        )
+
+
+class HealthServer:
+    """Endpoint HTTP /health con il ritardo attuale dell'event loop.
+
+    Gira in un thread proprio, quindi risponde anche mentre il loop è
+    bloccato: in quel caso restituisce 503 con il ritardo in corso.
+    Con `metrics` espone anche /metrics, nel formato di testo di Prometheus.
+    """
+
+    def __init__(self, watchdog: LoopWatchdog, host: str = '127.0.0.1', port: int = 8080,
+                 metrics: Optional[Callable[[], str]] = None):
+        self.watchdog = watchdog
+        self.host = host
+        self.port = port
+        self.metrics = metrics
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> None:
+        watchdog = self.watchdog
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics' and metrics is not None:
+                    self._reply(200, 'text/plain; version=0.0.4', metrics().encode('utf-8'))
+                    return
+                if path != '/health':
+                    self.send_error(404)
+                    return
+                status = watchdog.status()
+                self._reply(200 if status['status'] == 'ok' else 503, 'application/json',
+                            json.dumps(status).encode('utf-8'))
+
+            def _reply(self, code: int, content_type: str, body: bytes):
+                self.send_response(code)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Le richieste dei controlli di salute non vanno nel log del bot
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='health-server', daemon=True).start()
+        logger.info(f"Endpoint di salute su http://{self.host}:{self._server.server_port}/health")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -3,33 +3,96 @@ import asyncio
 import logging
 import sys
 import signal
+import socket
 import functools
+import re
+import tempfile
+import time
 from datetime import datetime, timedelta
 import pytz
 from pathlib import Path
+from typing import Optional
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import CommandStart, Command
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import Message, CallbackQuery, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from dotenv import load_dotenv
 from database.database import DatabaseManager
-from database.models import MessageType, RecurrenceType
+from database.models import MessageType, RecurrenceType, MessagePriority
+from database.cron import CronError, compile_cron
+from dispatch_queue import PriorityDispatchQueue, RateLimiter
+from retry_policy import ErrorKind, RetryPolicy, classify_error
+from circuit_breaker import ChatCircuitBreaker
+from delivery_log import DeliveryLogWriter
+from checkpoint import SchedulerCheckpoint
+from clock import SystemClock
+from loop_watchdog import LoopWatchdog, HealthServer
+from sender import extract_content, send_content
+from media_ingest import MediaIngestor, MediaRejected
+from fsm_storage import EVICTED, ExpiringMemoryStorage
+from instrumentation import SchedulerInstrumentation, PhaseStats, SlowTickLogger
+from edit_coalescer import KeyboardEditCoalescer
+from callbacks import (
+    CallbackRouter,
+    GroupCallback,
+    PinCallback,
+    ScheduleGroupCallback,
+    ScheduleTypeCallback,
+    DayCallback,
+    SchedulePinCallback,
+    PriorityCallback,
+    FilterCallback,
+    DetailsCallback,
+    PreviewCallback,
+    ToggleCallback,
+    DeleteCallback,
+    ConfirmDeleteCallback,
+    SearchPageCallback,
+    DeadLetterCallback,
+    StatsCallback,
+    BulkActionCallback,
+    BulkConfirmCallback,
+    ExportCallback
+)
+from renderer import (
+    escape,
+    get_group_name,
+    format_interval,
+    format_days,
+    render_message_list,
+    render_upcoming,
+    render_search_page,
+    render_dead_letter_list,
+    render_message_details,
+    render_stats_summary,
+    render_import_report
+)
 from keyboards import (
     main_menu_keyboard,
     groups_keyboard,
     schedule_groups_keyboard,
     pin_keyboard,
     schedule_pin_keyboard,
+    schedule_priority_keyboard,
     message_actions_keyboard,
     schedule_type_keyboard,
     weekdays_keyboard,
     messages_filter_keyboard,
     message_details_keyboard,
-    confirmation_keyboard
+    message_list_keyboard,
+    message_item_keyboard,
+    confirmation_keyboard,
+    bulk_actions_keyboard,
+    bulk_confirmation_keyboard,
+    search_results_keyboard,
+    dead_letters_keyboard,
+    delivery_stats_keyboard,
+    import_export_keyboard
 )
+from schedule_io import FIELDS as IMPORT_FIELDS, FORMATS, detect_format, import_file, export_file
 
 # Carica variabili d'ambiente
 load_dotenv()
@@ -62,6 +125,96 @@ GRUPPO_2_ID = int(os.getenv('GRUPPO_2_ID', 0))
 GRUPPO_1_NAME = os.getenv('GRUPPO_1_NAME', 'Clienti')  # Valore default se non trovato
 GRUPPO_2_NAME = os.getenv('GRUPPO_2_NAME', 'Reseller') # Valore default se non trovato
 
+# Orizzonte delle occorrenze materializzate
+OCCURRENCE_HORIZON = timedelta(days=int(os.getenv('OCCURRENCE_HORIZON_DAYS', 14)))
+OCCURRENCE_REFRESH_INTERVAL = int(os.getenv('OCCURRENCE_REFRESH_INTERVAL', 3600))  # secondi
+
+# Identità del worker e durata del lease sulle occorrenze prese in carico
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+SCHEDULER_LEASE = timedelta(seconds=int(os.getenv('SCHEDULER_LEASE_SECONDS', 120)))
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', 20))
+# Invii al secondo dello scheduler e protezione dalla starvation delle corsie basse
+SCHEDULER_RATE_LIMIT = float(os.getenv('SCHEDULER_RATE_LIMIT', 20))
+SCHEDULER_STARVATION_LIMIT = int(os.getenv('SCHEDULER_STARVATION_LIMIT', 5))
+# Politica di retry degli invii falliti
+retry_policy = RetryPolicy(
+    base_delay=float(os.getenv('RETRY_BASE_DELAY', 5)),
+    max_delay=float(os.getenv('RETRY_MAX_DELAY', 900)),
+    max_attempts_transient=int(os.getenv('RETRY_MAX_ATTEMPTS_TRANSIENT', 6)),
+    max_attempts_unknown=int(os.getenv('RETRY_MAX_ATTEMPTS_UNKNOWN', 3))
+)
+# Circuit breaker per chat: errori permanenti prima dell'apertura e attesa tra i probe (secondi)
+circuit_breaker = ChatCircuitBreaker(
+    failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 3)),
+    probe_base=int(os.getenv('CIRCUIT_PROBE_BASE', 300)),
+    probe_max=int(os.getenv('CIRCUIT_PROBE_MAX', 21600)),
+    probe_hold=SCHEDULER_LEASE
+)
+# Registro degli invii: record per lotto e attesa massima prima della scrittura (secondi)
+delivery_log = DeliveryLogWriter(
+    batch_size=int(os.getenv('DELIVERY_LOG_BATCH_SIZE', 100)),
+    flush_interval=float(os.getenv('DELIVERY_LOG_FLUSH_INTERVAL', 5))
+)
+# Attesa massima tra due giri dello scheduler (secondi); si sveglia prima se c'è un invio
+SCHEDULER_MAX_SLEEP = int(os.getenv('SCHEDULER_MAX_SLEEP', 60))
+# Intervallo minimo per le ricorrenze a intervallo (secondi)
+MIN_INTERVAL_SECONDS = int(os.getenv('MIN_INTERVAL_SECONDS', 10))
+# Retention: età oltre la quale i messaggi singoli già inviati vengono archiviati e le
+# occorrenze concluse eliminate (giorni),
+# frequenza del job (secondi) e pagine liberate per ogni passo di vacuum incrementale
+RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', 30))
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', 21600))
+RETENTION_BATCH_SIZE = int(os.getenv('RETENTION_BATCH_SIZE', 500))
+VACUUM_PAGES_PER_STEP = int(os.getenv('VACUUM_PAGES_PER_STEP', 1000))
+# Righe per transazione nell'importazione da file
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 1000))
+# Dimensione massima dei file scaricabili tramite la Bot API
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+# Salva chat e ID del messaggio originale e lo invia con copy_message, che
+# conserva formattazione ed entità; il contenuto salvato resta come riserva
+COPY_FROM_SOURCE = os.getenv('COPY_FROM_SOURCE', '1').lower() not in ('0', 'false', 'no')
+# Media programmati: dimensione massima e tipi ammessi (come MAX_MEDIA_SIZE e
+# ALLOWED_MEDIA_TYPES di config.py) e processi per analisi e ricompressione
+MAX_MEDIA_SIZE = int(os.getenv('MAX_MEDIA_SIZE', 20 * 1024 * 1024))
+ALLOWED_MEDIA_TYPES = [mime.strip() for mime in os.getenv('ALLOWED_MEDIA_TYPES', ','.join([
+    'image/jpeg', 'image/png', 'image/gif',
+    'video/mp4', 'video/mpeg',
+    'application/pdf', 'application/zip',
+    'application/x-rar-compressed',
+    'application/msword',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+])).split(',') if mime.strip()]
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', 2))
+# Tipi di contenuto scaricati e validati prima della programmazione
+INGESTED_TYPES = {MessageType.PHOTO, MessageType.VIDEO, MessageType.DOCUMENT, MessageType.ANIMATION}
+# Tempo concesso all'invio in corso per terminare allo spegnimento (secondi)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 8))
+# Checkpoint per il riavvio a caldo: un file per WORKER_ID stabile; senza WORKER_ID
+# uno per host, che basta al solo processo con polling (vedi main())
+CHECKPOINT_PATH = Path(os.getenv('SCHEDULER_CHECKPOINT') or
+                       DB_DIR / f"checkpoint-{os.getenv('WORKER_ID') or socket.gethostname()}.json")
+# Watchdog dell'event loop: ritardo oltre il quale il blocco viene registrato
+# con lo stack (secondi) e porta dell'endpoint /health (0 = disattivato)
+LOOP_LAG_THRESHOLD = float(os.getenv('LOOP_LAG_THRESHOLD', 0.25))
+LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', 0.1))
+HEALTH_HOST = os.getenv('HEALTH_HOST', '127.0.0.1')
+HEALTH_PORT = int(os.getenv('HEALTH_PORT', 0))
+# Strumentazione dello scheduler: statistiche per fase (nel log ogni
+# SCHEDULER_METRICS_INTERVAL secondi e su /metrics) e giri lenti da
+# registrare con la ripartizione per fase (secondi, 0 = disattivato)
+SCHEDULER_METRICS = os.getenv('SCHEDULER_METRICS', '0') == '1'
+SCHEDULER_METRICS_INTERVAL = int(os.getenv('SCHEDULER_METRICS_INTERVAL', 300))
+SLOW_TICK_THRESHOLD = float(os.getenv('SLOW_TICK_THRESHOLD', 0))
+# Finestra in cui i tocchi ravvicinati su una tastiera producono una sola modifica (secondi)
+KEYBOARD_EDIT_DELAY = float(os.getenv('KEYBOARD_EDIT_DELAY', 0.5))
+# Conversazioni (FSM): inattività dopo cui scadono (secondi), numero massimo
+# tenuto in memoria e frequenza della pulizia che avvisa l'amministratore
+FSM_TTL = int(os.getenv('FSM_TTL', 1800))
+FSM_MAX_ENTRIES = int(os.getenv('FSM_MAX_ENTRIES', 1000))
+FSM_SWEEP_INTERVAL = int(os.getenv('FSM_SWEEP_INTERVAL', 60))
+# Avvia solo lo scheduler, senza polling (worker aggiuntivi sullo stesso database)
+SCHEDULER_ONLY = os.getenv('SCHEDULER_ONLY', '0') == '1' or '--scheduler-only' in sys.argv
+
 # Stati FSM
 class States(StatesGroup):
     # Stati per messaggi immediati
@@ -74,13 +227,19 @@ class States(StatesGroup):
     SCHEDULE_WAITING_TYPE = State()
     SCHEDULE_WAITING_TIME = State()
     SCHEDULE_WAITING_DAYS = State()
+    SCHEDULE_WAITING_CRON = State()
+    SCHEDULE_WAITING_INTERVAL = State()
     SCHEDULE_WAITING_MESSAGE = State()
     SCHEDULE_WAITING_PIN = State()
+    SCHEDULE_WAITING_PRIORITY = State()
     
     # Stati per gestione lista messaggi
-    VIEWING_MESSAGE = State()
     CONFIRMING_DELETE = State()
     FILTERING_MESSAGES = State()
+    SEARCHING_MESSAGES = State()
+    
+    # Stato per l'importazione da file
+    WAITING_IMPORT_FILE = State()
 
 # Messaggi
 MESSAGES = {
@@ -90,23 +249,117 @@ MESSAGES = {
     'delete_confirm': '⚠️ Sei sicuro di voler eliminare questo messaggio? Questa azione non può essere annullata.',
     'deleted': '✅ Messaggio eliminato con successo.',
     'toggled': '✅ Stato del messaggio aggiornato.',
-    'not_found': '❌ Messaggio non trovato.'
+    'not_found': '❌ Messaggio non trovato.',
+    'bulk_menu': '🧹 Operazioni di massa\n\nSeleziona l\'operazione da eseguire:',
+    'bulk_confirm': '⚠️ {description}\n\nMessaggi coinvolti: {count}\nConfermi l\'operazione?',
+    'bulk_empty': 'ℹ️ Nessun messaggio corrisponde a questa operazione.',
+    'bulk_done': '✅ Operazione completata. Messaggi coinvolti: {count}',
+    'search_prompt': '🔎 Invia le parole da cercare nel testo o nella didascalia dei messaggi:',
+    'search_empty': '🔎 Nessun messaggio trovato per: {query}',
+    'cron_prompt': (
+        '🧩 Invia l\'espressione cron (UTC): minuto ora giorno mese giorno_settimana\n\n'
+        'Esempi:\n'
+        '<code>0 9 * * mon#1</code> - primo lunedì del mese alle 09:00\n'
+        '<code>30 8,17 * * 1-5</code> - giorni feriali alle 08:30 e 17:30\n'
+        '<code>0 18 * * friL</code> - ultimo venerdì del mese alle 18:00'
+    ),
+    'cron_invalid': '⚠️ Espressione cron non valida: {error}',
+    'interval_prompt': (
+        '🔁 Invia l\'intervallo e, facoltativamente, l\'orario di partenza (UTC) nel formato HH:MM:SS\n\n'
+        'Esempi:\n'
+        '<code>15m</code> - ogni 15 minuti da adesso\n'
+        '<code>1h30m 08:00:00</code> - ogni ora e mezza a partire dalle 08:00:00\n'
+        '<code>45s 12:00:15</code> - ogni 45 secondi a partire dalle 12:00:15'
+    ),
+    'dead_letters_empty': '✅ Nessun invio fallito.',
+    'stats_empty': '📊 Nessun invio registrato in questo periodo.',
+    'requeued': '♻️ Invio rimesso in coda.',
+    'import_export': (
+        '📦 Importa/Esporta programmazioni\n\n'
+        'Per importare invia un file <b>.csv</b> o <b>.jsonl</b> con le colonne:\n'
+        '<code>{fields}</code>\n\n'
+        'Le date sono in formato ISO 8601 (UTC se senza fuso orario). '
+        'Il file esportato può essere reimportato così com\'è.'
+    ),
+    'import_invalid_file': '⚠️ Invia un file .csv o .jsonl (massimo 20 MB).',
+    'import_running': '⏳ Importazione in corso...',
+    'export_done': '📤 Esportate {count} programmazioni.',
+    'media_checking': '⏳ Verifica del media in corso...',
+    'media_rejected': '⚠️ Media non accettato: {reason}.\nInvia un altro file.',
+    'media_recompressed': '🗜 Immagine ricompressa: {size} KB. Questa versione sarà inviata.',
+    'flow_expired': '⌛ La procedura in corso è scaduta dopo {minutes} minuti di inattività. Ricomincia dal menu.',
+    'flow_evicted': '⚠️ La procedura in corso è stata interrotta perché erano aperte troppe procedure contemporaneamente. Ricomincia dal menu.',
+    'flow_expired_alert': '⌛ Procedura scaduta per inattività: ricomincia dal menu.',
+    'unsupported_content': '⚠️ Tipo di messaggio non supportato: invia testo, foto, video, documento, audio, vocale, GIF o sticker.',
+    'interval_invalid': '⚠️ Intervallo non valido. Usa ad esempio 30s, 15m, 2h o 1h30m (minimo {minimum}s).'
+}
+
+# Risultati per pagina nella ricerca
+SEARCH_PAGE_SIZE = 10
+
+# Operazioni di massa: codice -> (descrizione, operazione, filtri)
+BULK_ACTIONS = {
+    'pause_group1': (f"Sospensione di tutti i messaggi di {GRUPPO_1_NAME}", 'pause', {'chat_id': GRUPPO_1_ID}),
+    'pause_group2': (f"Sospensione di tutti i messaggi di {GRUPPO_2_NAME}", 'pause', {'chat_id': GRUPPO_2_ID}),
+    'resume_daily': ("Riattivazione di tutti i messaggi giornalieri", 'resume', {'recurrence_type': 'daily'}),
+    'resume_weekly': ("Riattivazione di tutti i messaggi settimanali", 'resume', {'recurrence_type': 'weekly'}),
+    'delete_once_inactive': ("Eliminazione dei messaggi singoli inattivi", 'delete', {'recurrence_type': 'once', 'active': False}),
+    'delete_inactive': ("Eliminazione di tutti i messaggi inattivi", 'delete', {'active': False})
 }
 
 # Init bot
-storage = MemoryStorage()
+storage = ExpiringMemoryStorage(ttl=FSM_TTL, max_entries=FSM_MAX_ENTRIES)
 dp = None
 bot = None
+callback_router = CallbackRouter()
+checkpoint = SchedulerCheckpoint(CHECKPOINT_PATH)
+# Orologio dello scheduler: sostituito da un VirtualClock nella simulazione
+clock = SystemClock()
+# Impostato all'arresto: niente nuovi update né nuove occorrenze
+draining = asyncio.Event()
+keyboard_edits = KeyboardEditCoalescer(KEYBOARD_EDIT_DELAY)
+media_ingestor = MediaIngestor(MAX_MEDIA_SIZE, ALLOWED_MEDIA_TYPES, workers=MEDIA_WORKERS)
+loop_watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD, interval=LOOP_WATCHDOG_INTERVAL)
+# Senza hook le fasi non vengono misurate
+instrumentation = SchedulerInstrumentation()
+phase_stats = PhaseStats() if SCHEDULER_METRICS else None
+if phase_stats is not None:
+    instrumentation.add_hook(phase_stats)
+if SLOW_TICK_THRESHOLD > 0:
+    instrumentation.add_hook(SlowTickLogger(SLOW_TICK_THRESHOLD))
+health_server = HealthServer(
+    loop_watchdog, HEALTH_HOST, HEALTH_PORT,
+    metrics=phase_stats.prometheus if phase_stats is not None else None
+) if HEALTH_PORT else None
 
 def is_admin(user_id: int) -> bool:
     return user_id == ADMIN_ID
 
-def get_group_name(chat_id: int) -> str:
-    if chat_id == GRUPPO_1_ID:
-        return GRUPPO_1_NAME
-    elif chat_id == GRUPPO_2_ID:
-        return GRUPPO_2_NAME
-    return "Entrambi i gruppi"
+def parse_interval(value: str) -> int:
+    """Converte un intervallo come '1h30m' o '45s' in secondi."""
+    value = value.strip().lower()
+    if not re.fullmatch(r'(\d+[hms])+', value):
+        raise ValueError(value)
+    units = {'h': 3600, 'm': 60, 's': 1}
+    return sum(int(amount) * units[unit] for amount, unit in re.findall(r'(\d+)([hms])', value))
+
+async def send_pages(message: Message, pages: list, reply_markup=None, edit: bool = True,
+                     page_markups: list = None):
+    """Mostra un testo diviso in pagine dal renderer.
+
+    La prima pagina sostituisce il messaggio corrente (se `edit`), le altre
+    seguono come nuovi messaggi; la tastiera va sull'ultima, oppure ogni
+    pagina ha la sua tastiera in `page_markups`.
+    """
+    for i, page in enumerate(pages):
+        if page_markups is not None:
+            markup = page_markups[i]
+        else:
+            markup = reply_markup if i == len(pages) - 1 else None
+        if i == 0 and edit:
+            await message.edit_text(page, reply_markup=markup)
+        else:
+            await message.answer(page, reply_markup=markup)
 
 # HANDLERS PER MESSAGGI IMMEDIATI
 async def cmd_start(message: Message):
@@ -129,16 +382,16 @@ async def send_message_handler(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-async def group_selection_handler(callback: CallbackQuery, state: FSMContext):
+async def group_selection_handler(callback: CallbackQuery, callback_data: GroupCallback, state: FSMContext):
     if not is_admin(callback.from_user.id):
         return
     
     chat_ids = None
-    if callback.data == "group_1":
+    if callback_data.target == "1":
         chat_ids = GRUPPO_1_ID
-    elif callback.data == "group_2":
+    elif callback_data.target == "2":
         chat_ids = GRUPPO_2_ID
-    elif callback.data == "group_both":
+    elif callback_data.target == "both":
         chat_ids = [GRUPPO_1_ID, GRUPPO_2_ID]
     
     await state.update_data(chat_id=chat_ids)
@@ -150,56 +403,33 @@ async def process_message(message: Message, state: FSMContext):
     if not is_admin(message.from_user.id):
         return
 
-    data = await state.get_data()
-    await state.update_data(
-        message_text=message.text,
-        message_photo=message.photo[-1].file_id if message.photo else None,
-        message_video=message.video.file_id if message.video else None,
-        message_document=message.document.file_id if message.document else None,
-        message_caption=message.caption
-    )
+    content = extract_content(message, COPY_FROM_SOURCE)
+    if content is None:
+        await message.answer(MESSAGES['unsupported_content'])
+        return
+    await state.update_data(message_content=content)
     
     await state.set_state(States.WAITING_PIN)
     await message.answer("📌 Vuoi pinnare questo messaggio?", reply_markup=pin_keyboard())
 
-async def process_pin(callback: CallbackQuery, state: FSMContext):
+async def process_pin(callback: CallbackQuery, callback_data: PinCallback, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer(MESSAGES['unauthorized'], show_alert=True)
         return
 
     data = await state.get_data()
+    if 'message_content' not in data:
+        await callback.answer(MESSAGES['flow_expired_alert'], show_alert=True)
+        return
     chat_ids = data['chat_id']
-    should_pin = callback.data == "pin_yes"
+    should_pin = callback_data.pin
 
     if not isinstance(chat_ids, list):
         chat_ids = [chat_ids]
 
     try:
         for chat_id in chat_ids:
-            sent_message = None
-            if data.get('message_text'):
-                sent_message = await bot.send_message(
-                    chat_id=chat_id,
-                    text=data['message_text']
-                )
-            elif data.get('message_photo'):
-                sent_message = await bot.send_photo(
-                    chat_id=chat_id,
-                    photo=data['message_photo'],
-                    caption=data.get('message_caption')
-                )
-            elif data.get('message_video'):
-                sent_message = await bot.send_video(
-                    chat_id=chat_id,
-                    video=data['message_video'],
-                    caption=data.get('message_caption')
-                )
-            elif data.get('message_document'):
-                sent_message = await bot.send_document(
-                    chat_id=chat_id,
-                    document=data['message_document'],
-                    caption=data.get('message_caption')
-                )
+            sent_message = await send_content(bot, chat_id, data['message_content'])
 
             if should_pin and sent_message:
                 await bot.pin_chat_message(
@@ -235,11 +465,11 @@ async def schedule_start_handler(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-async def schedule_group_handler(callback: CallbackQuery, state: FSMContext):
+async def schedule_group_handler(callback: CallbackQuery, callback_data: ScheduleGroupCallback, state: FSMContext):
     if not is_admin(callback.from_user.id):
         return
     
-    group_id = callback.data.replace("schedule_to_", "")
+    group_id = callback_data.target
     chat_ids = None
     
     if group_id == "1":
@@ -257,11 +487,11 @@ async def schedule_group_handler(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-async def schedule_type_handler(callback: CallbackQuery, state: FSMContext):
+async def schedule_type_handler(callback: CallbackQuery, callback_data: ScheduleTypeCallback, state: FSMContext):
     if not is_admin(callback.from_user.id):
         return
     
-    schedule_type = callback.data.replace("schedule_type_", "")
+    schedule_type = callback_data.kind
     await state.update_data(schedule_type=schedule_type)
     
     if schedule_type == "weekly":
@@ -270,6 +500,12 @@ async def schedule_type_handler(callback: CallbackQuery, state: FSMContext):
             "📆 Seleziona i giorni in cui inviare il messaggio:",
             reply_markup=weekdays_keyboard()
         )
+    elif schedule_type == "cron":
+        await state.set_state(States.SCHEDULE_WAITING_CRON)
+        await callback.message.edit_text(MESSAGES['cron_prompt'])
+    elif schedule_type == "interval":
+        await state.set_state(States.SCHEDULE_WAITING_INTERVAL)
+        await callback.message.edit_text(MESSAGES['interval_prompt'])
     else:
         await state.set_state(States.SCHEDULE_WAITING_TIME)
         current_time = datetime.now(pytz.UTC).strftime('%H:%M')
@@ -281,19 +517,20 @@ async def schedule_type_handler(callback: CallbackQuery, state: FSMContext):
     
     await callback.answer()
 
-async def schedule_days_handler(callback: CallbackQuery, state: FSMContext):
+async def schedule_days_handler(callback: CallbackQuery, callback_data: DayCallback, state: FSMContext):
     if not is_admin(callback.from_user.id):
         return
     
     data = await state.get_data()
     selected_days = data.get('selected_days', [])
     
-    if callback.data == "days_confirm":
+    if callback_data.day == "confirm":
         if not selected_days:
             await callback.answer("⚠️ Seleziona almeno un giorno!", show_alert=True)
             return
         
         await state.set_state(States.SCHEDULE_WAITING_TIME)
+        keyboard_edits.cancel(callback.message)
         current_time = datetime.now(pytz.UTC).strftime('%H:%M')
         await callback.message.edit_text(
             f"🕒 Invia l'orario di invio nel formato HH:MM\n"
@@ -301,17 +538,15 @@ async def schedule_days_handler(callback: CallbackQuery, state: FSMContext):
             f"Ora attuale (UTC): {current_time}"
         )
     else:
-        day = callback.data.replace("day_", "")
+        day = callback_data.day
         if day in selected_days:
             selected_days.remove(day)
         else:
             selected_days.append(day)
         
         await state.update_data(selected_days=selected_days)
-        await callback.message.edit_text(
-            "📆 Seleziona i giorni in cui inviare il messaggio:",
-            reply_markup=weekdays_keyboard(selected_days)
-        )
+        # Il testo non cambia: i tocchi rapidi diventano una sola modifica della tastiera
+        keyboard_edits.update(bot, callback.message, weekdays_keyboard(selected_days))
     
     await callback.answer()
 
@@ -384,6 +619,79 @@ async def process_schedule_time(message: Message, state: FSMContext):
             f"Ora attuale (UTC): {current_time}"
         )
 
+async def process_schedule_cron(message: Message, state: FSMContext):
+    """Gestisce l'input dell'espressione cron per i messaggi programmati."""
+    if not is_admin(message.from_user.id):
+        return
+
+    expression = (message.text or '').strip()
+    try:
+        cron = compile_cron(expression)
+    except CronError as e:
+        await message.answer(MESSAGES['cron_invalid'].format(error=escape(e)))
+        return
+
+    now = datetime.now(pytz.UTC)
+    first_send_time = cron.next_after(now)
+    if first_send_time is None:
+        await message.answer(MESSAGES['cron_invalid'].format(error="nessuna data futura corrispondente"))
+        return
+
+    await state.update_data(
+        cron_expression=cron.expression,
+        first_send_time=first_send_time,
+        schedule_hour=first_send_time.hour,
+        schedule_minute=first_send_time.minute
+    )
+    await state.set_state(States.SCHEDULE_WAITING_MESSAGE)
+    await message.answer(
+        f"🧩 Primo invio: {first_send_time.strftime('%Y-%m-%d %H:%M')} UTC\n\n"
+        "📝 Perfetto! Ora invia il messaggio da programmare:"
+    )
+
+async def process_schedule_interval(message: Message, state: FSMContext):
+    """Gestisce l'input dell'intervallo (ed eventuale orario di partenza)."""
+    if not is_admin(message.from_user.id):
+        return
+
+    now = datetime.now(pytz.UTC)
+    parts = (message.text or '').split()
+    try:
+        if not 1 <= len(parts) <= 2:
+            raise ValueError
+        interval_seconds = parse_interval(parts[0])
+        if interval_seconds < MIN_INTERVAL_SECONDS:
+            raise ValueError
+
+        if len(parts) == 2:
+            start = datetime.strptime(parts[1], '%H:%M:%S' if parts[1].count(':') == 2 else '%H:%M')
+            anchor_time = now.replace(hour=start.hour, minute=start.minute,
+                                      second=start.second, microsecond=0)
+        else:
+            anchor_time = now.replace(microsecond=0) + timedelta(seconds=interval_seconds)
+    except ValueError:
+        await message.answer(MESSAGES['interval_invalid'].format(minimum=MIN_INTERVAL_SECONDS))
+        return
+
+    # Il primo invio è il primo multiplo dell'intervallo dopo adesso
+    interval = timedelta(seconds=interval_seconds)
+    first_send_time = anchor_time if anchor_time > now else \
+        anchor_time + ((now - anchor_time) // interval + 1) * interval
+
+    await state.update_data(
+        interval_seconds=interval_seconds,
+        anchor_time=anchor_time,
+        first_send_time=first_send_time,
+        schedule_hour=anchor_time.hour,
+        schedule_minute=anchor_time.minute
+    )
+    await state.set_state(States.SCHEDULE_WAITING_MESSAGE)
+    await message.answer(
+        f"🔁 Ogni {format_interval(interval_seconds)}, primo invio: "
+        f"{first_send_time.strftime('%Y-%m-%d %H:%M:%S')} UTC\n\n"
+        "📝 Perfetto! Ora invia il messaggio da programmare:"
+    )
+
 async def process_scheduled_message(message: Message, state: FSMContext):
     """Gestisce il messaggio da programmare dopo aver impostato l'orario."""
     if not is_admin(message.from_user.id):
@@ -395,13 +703,21 @@ async def process_scheduled_message(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    await state.update_data(
-        schedule_text=message.text,
-        schedule_photo=message.photo[-1].file_id if message.photo else None,
-        schedule_video=message.video.file_id if message.video else None,
-        schedule_document=message.document.file_id if message.document else None,
-        schedule_caption=message.caption
-    )
+    content = extract_content(message, COPY_FROM_SOURCE)
+    if content is None:
+        await message.answer(MESSAGES['unsupported_content'])
+        return
+    if content['message_type'] in INGESTED_TYPES:
+        try:
+            content = await ingest_media(message, content)
+        except MediaRejected as e:
+            await message.answer(MESSAGES['media_rejected'].format(reason=escape(str(e))))
+            return
+        except Exception as e:
+            logger.error(f"Errore nella verifica del media: {e}")
+            await message.answer(MESSAGES['error'])
+            return
+    await state.update_data(schedule_content=content)
     
     await state.set_state(States.SCHEDULE_WAITING_PIN)
     await message.answer(
@@ -409,13 +725,65 @@ async def process_scheduled_message(message: Message, state: FSMContext):
         reply_markup=schedule_pin_keyboard()
     )
 
-async def process_schedule_pin(callback: CallbackQuery, state: FSMContext):
+async def ingest_media(message: Message, content: dict) -> dict:
+    """Scarica e valida il media da programmare, così l'invio non fallisce per tipo o dimensione.
+
+    Un'immagine ricompressa viene ricaricata nella chat dell'amministratore
+    con la stessa didascalia: il contenuto punta a quella copia.
+    """
+    attachment = (message.photo[-1] if message.photo else
+                  message.animation or message.video or message.document)
+    await message.answer(MESSAGES['media_checking'])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        media = await media_ingestor.ingest(bot, content['media'], Path(tmp_dir),
+                                            file_size=attachment.file_size)
+        if not media.recompressed:
+            return content
+
+        if content['message_type'] == MessageType.PHOTO:
+            uploaded = await message.answer_photo(FSInputFile(media.path), caption=message.caption,
+                                                  caption_entities=message.caption_entities, parse_mode=None)
+            file_id = uploaded.photo[-1].file_id
+        else:
+            filename = f"{Path(message.document.file_name or 'immagine').stem}.jpg"
+            uploaded = await message.answer_document(FSInputFile(media.path, filename=filename),
+                                                     caption=message.caption,
+                                                     caption_entities=message.caption_entities, parse_mode=None)
+            file_id = uploaded.document.file_id
+
+    await message.answer(MESSAGES['media_recompressed'].format(size=media.size // 1024))
+    return {
+        **content,
+        'media': file_id,
+        'source_chat_id': uploaded.chat.id if COPY_FROM_SOURCE else None,
+        'source_message_id': uploaded.message_id if COPY_FROM_SOURCE else None
+    }
+
+async def process_schedule_pin(callback: CallbackQuery, callback_data: SchedulePinCallback, state: FSMContext):
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    await state.update_data(schedule_pin=callback_data.pin)
+    await state.set_state(States.SCHEDULE_WAITING_PRIORITY)
+    await callback.message.edit_text(
+        "🚦 Seleziona la priorità di invio:\n"
+        "i messaggi urgenti partono per primi quando molti invii scadono insieme.",
+        reply_markup=schedule_priority_keyboard()
+    )
+    await callback.answer()
+
+async def process_schedule_priority(callback: CallbackQuery, callback_data: PriorityCallback, state: FSMContext):
     if not is_admin(callback.from_user.id):
         await callback.answer(MESSAGES['unauthorized'], show_alert=True)
         return
 
     data = await state.get_data()
-    should_pin = callback.data == "schedule_pin_yes"
+    if 'schedule_content' not in data:
+        await callback.answer(MESSAGES['flow_expired_alert'], show_alert=True)
+        return
+    should_pin = data.get('schedule_pin', False)
+    priority = callback_data.priority
     chat_ids = data['schedule_chat_id']
     
     if not isinstance(chat_ids, list):
@@ -431,54 +799,31 @@ async def process_schedule_pin(callback: CallbackQuery, state: FSMContext):
                 'recurrence_type': data['schedule_type'],
                 'recurrence_days': ','.join(data.get('selected_days', [])),
                 'schedule_hour': data['schedule_hour'],
-                'schedule_minute': data['schedule_minute']
+                'schedule_minute': data['schedule_minute'],
+                'cron_expression': data.get('cron_expression'),
+                'interval_seconds': data.get('interval_seconds'),
+                'anchor_time': data.get('anchor_time'),
+                'priority': priority,
+                **data['schedule_content']
             }
 
-            if data.get('schedule_text'):
-                message_data.update({
-                    'message_type': MessageType.TEXT,
-                    'text': data['schedule_text']
-                })
-            elif data.get('schedule_photo'):
-                message_data.update({
-                    'message_type': MessageType.PHOTO,
-                    'media': data['schedule_photo'],
-                    'caption': data.get('schedule_caption')
-                })
-            elif data.get('schedule_video'):
-                message_data.update({
-                    'message_type': MessageType.VIDEO,
-                    'media': data['schedule_video'],
-                    'caption': data.get('schedule_caption')
-                })
-            elif data.get('schedule_document'):
-                message_data.update({
-                    'message_type': MessageType.DOCUMENT,
-                    'media': data['schedule_document'],
-                    'caption': data.get('schedule_caption')
-                })
-
             DatabaseManager.add_scheduled_message(message_data)
 
         schedule_type = data['schedule_type']
-        days_map = {
-            'mon': 'Lunedì',
-            'tue': 'Martedì',
-            'wed': 'Mercoledì',
-            'thu': 'Giovedì',
-            'fri': 'Venerdì',
-            'sat': 'Sabato',
-            'sun': 'Domenica'
-        }
         
         if schedule_type == 'once':
             time_str = data['first_send_time'].strftime('%Y-%m-%d %H:%M')
             msg = f"✅ Messaggio programmato per: {time_str}"
         elif schedule_type == 'daily':
             msg = f"✅ Messaggio programmato ogni giorno alle {data['schedule_hour']:02d}:{data['schedule_minute']:02d}"
+        elif schedule_type == 'cron':
+            time_str = data['first_send_time'].strftime('%Y-%m-%d %H:%M')
+            msg = f"✅ Messaggio programmato con cron <code>{escape(data['cron_expression'])}</code>\nPrimo invio: {time_str}"
+        elif schedule_type == 'interval':
+            time_str = data['first_send_time'].strftime('%Y-%m-%d %H:%M:%S')
+            msg = f"✅ Messaggio programmato ogni {format_interval(data['interval_seconds'])}\nPrimo invio: {time_str}"
         else:  # weekly
-            days = data.get('selected_days', [])
-            days_str = ', '.join(days_map[day] for day in days)
+            days_str = format_days(','.join(data.get('selected_days', [])))
             msg = f"✅ Messaggio programmato per {days_str} alle {data['schedule_hour']:02d}:{data['schedule_minute']:02d}"
         
         current_time = datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
@@ -512,13 +857,20 @@ async def list_messages_handler(callback: CallbackQuery, state: FSMContext):
     )
     await callback.answer()
 
-async def filter_messages_handler(callback: CallbackQuery, state: FSMContext):
+async def filter_messages_handler(callback: CallbackQuery, callback_data: FilterCallback, state: FSMContext):
     """Gestisce il filtro dei messaggi per gruppo."""
     if not is_admin(callback.from_user.id):
         await callback.answer(MESSAGES['unauthorized'], show_alert=True)
         return
 
-    filter_type = callback.data.replace("filter_", "")
+    filter_type = callback_data.group
+    # Il filtro serve per tornare alla stessa lista dai dettagli
+    await state.update_data(list_filter=filter_type)
+    await show_filtered_list(callback.message, filter_type)
+    await callback.answer()
+
+async def show_filtered_list(message: Message, filter_type: str):
+    """Carica i messaggi del gruppo indicato dal filtro e mostra la lista."""
     chat_id = None
     
     if filter_type == "group1":
@@ -527,8 +879,7 @@ async def filter_messages_handler(callback: CallbackQuery, state: FSMContext):
         chat_id = GRUPPO_2_ID
     
     messages = DatabaseManager.get_filtered_messages(chat_id)
-    await show_messages_list(callback.message, messages, filter_type)
-    await callback.answer()
+    await show_messages_list(message, messages, filter_type)
 
 async def show_messages_list(message: Message, messages: list, filter_type: str):
     """Mostra la lista dei messaggi filtrati."""
@@ -541,236 +892,100 @@ async def show_messages_list(message: Message, messages: list, filter_type: str)
         )
         return
 
-    # Organizziamo i messaggi per tipo
-    once_messages = []
-    daily_messages = []
-    weekly_messages = []
-    
-    days_map = {
-        'mon': 'Lunedì',
-        'tue': 'Martedì',
-        'wed': 'Mercoledì',
-        'thu': 'Giovedì',
-        'fri': 'Venerdì',
-        'sat': 'Sabato',
-        'sun': 'Domenica'
-    }
-
-    for msg in messages:
-        group_name = get_group_name(msg.chat_id)
-        msg_info = {
-            'id': msg.id,
-            'status': "✅" if msg.active else "❌",
-            'pin': "📌" if msg.pin else "",
-            'type': "📝" if msg.message_type == MessageType.TEXT else (
-                   "📷" if msg.message_type == MessageType.PHOTO else (
-                   "🎥" if msg.message_type == MessageType.VIDEO else "📎")),
-            'group': group_name
-        }
-
-        if msg.recurrence_type == 'once':
-            msg_info['time'] = msg.send_time.strftime('%Y-%m-%d %H:%M')
-            once_messages.append(msg_info)
-        elif msg.recurrence_type == 'daily':
-            msg_info['time'] = f"{msg.schedule_hour:02d}:{msg.schedule_minute:02d}"
-            daily_messages.append(msg_info)
-        else:  # weekly
-            days = msg.recurrence_days.split(',')
-            days_str = ', '.join(days_map[day] for day in days)
-            msg_info['time'] = f"{msg.schedule_hour:02d}:{msg.schedule_minute:02d}"
-            msg_info['days'] = days_str
-            weekly_messages.append(msg_info)
-
-    # Creiamo il messaggio
     group_filter = {
         "group1": GRUPPO_1_NAME,
         "group2": GRUPPO_2_NAME,
         "all": "tutti i gruppi"
     }
-    
-    text = f"📋 Lista Messaggi - {group_filter.get(filter_type, 'tutti i gruppi')}\n\n"
-    
-    if once_messages:
-        text += "🔹 MESSAGGI SINGOLI:\n"
-        for msg in once_messages:
-            text += (f"ID: {msg['id']} {msg['status']} {msg['pin']} {msg['type']}\n"
-                    f"👥 {msg['group']}\n"
-                    f"📅 {msg['time']}\n\n")
-    
-    if daily_messages:
-        text += "🔹 MESSAGGI GIORNALIERI:\n"
-        for msg in daily_messages:
-            text += (f"ID: {msg['id']} {msg['status']} {msg['pin']} {msg['type']}\n"
-                    f"👥 {msg['group']}\n"
-                    f"⏰ Ogni giorno alle {msg['time']}\n\n")
-    
-    if weekly_messages:
-        text += "🔹 MESSAGGI SETTIMANALI:\n"
-        for msg in weekly_messages:
-            text += (f"ID: {msg['id']} {msg['status']} {msg['pin']} {msg['type']}\n"
-                    f"👥 {msg['group']}\n"
-                    f"📆 {msg['days']}\n⏰ Alle {msg['time']}\n\n")
+    pages = render_message_list(
+        messages,
+        group_filter.get(filter_type, 'tutti i gruppi'),
+        datetime.now(pytz.UTC)
+    )
+    # Ogni pagina ha i pulsanti dei propri messaggi, l'ultima anche la navigazione
+    await send_pages(
+        message,
+        [text for text, _ in pages],
+        page_markups=[
+            message_list_keyboard(ids, with_navigation=i == len(pages) - 1)
+            for i, (_, ids) in enumerate(pages)
+        ]
+    )
 
-    current_time = datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
-    text += f"\nData/Ora attuale (UTC): {current_time}"
+async def upcoming_messages_handler(callback: CallbackQuery):
+    """Mostra gli invii previsti nelle prossime 24 ore."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
 
-    try:
-        await message.edit_text(
-            text, 
-            reply_markup=message_details_keyboard(),
-            parse_mode=ParseMode.HTML
+    now = datetime.now(pytz.UTC)
+    upcoming = DatabaseManager.get_upcoming_occurrences(now, now + timedelta(hours=24))
+    await send_pages(callback.message, render_upcoming(upcoming, now), reply_markup=message_details_keyboard())
+    await callback.answer()
+
+async def show_message_details(message: Message, msg, list_filter: str):
+    """Sostituisce il messaggio corrente con i dettagli di un messaggio programmato."""
+    await message.edit_text(
+        render_message_details(msg, datetime.now(pytz.UTC)),
+        reply_markup=message_item_keyboard(
+            msg.id, msg.active, msg.message_type != MessageType.TEXT, list_filter
         )
-    except Exception as e:
-        # Se il messaggio è troppo lungo, lo dividiamo in più parti
-        chunks = [text[i:i+4096] for i in range(0, len(text), 4096)]
-        for i, chunk in enumerate(chunks):
-            if i == len(chunks) - 1:  # Ultimo chunk
-                await message.answer(chunk, reply_markup=message_details_keyboard())
-            else:
-                await message.answer(chunk)
+    )
 
-async def view_message_details(callback: CallbackQuery, state: FSMContext):
-    """Handler per vedere i dettagli di un messaggio specifico."""
+async def message_details_handler(callback: CallbackQuery, callback_data: DetailsCallback, state: FSMContext):
+    """Apre i dettagli di un messaggio dal pulsante della lista, modificando la lista stessa."""
     if not is_admin(callback.from_user.id):
         await callback.answer(MESSAGES['unauthorized'], show_alert=True)
         return
 
-    await state.set_state(States.VIEWING_MESSAGE)
-    await callback.message.edit_text(
-        "🔍 Inserisci l'ID del messaggio che vuoi visualizzare:",
-        reply_markup=message_actions_keyboard()
-    )
-    await callback.answer()
-
-async def process_message_details(message: Message, state: FSMContext):
-    """Processa la richiesta di dettagli per un messaggio specifico."""
-    if not is_admin(message.from_user.id):
+    msg_id = callback_data.message_id
+    msg = DatabaseManager.get_message_by_id(msg_id)
+    if not msg:
+        await callback.answer(MESSAGES['not_found'], show_alert=True)
         return
 
-    try:
-        msg_id = int(message.text)
-        msg = DatabaseManager.get_message_by_id(msg_id)
-        
-        if not msg:
-            await message.answer(
-                f"{MESSAGES['not_found']}\n"
-                "Inserisci un ID valido o torna alla lista messaggi.",
-                reply_markup=message_actions_keyboard()
-            )
-            return
+    data = await state.get_data()
+    await show_message_details(callback.message, msg, data.get('list_filter', 'all'))
+    await callback.answer()
 
-        # Prepara il testo dettagliato
-        text = f"🔍 Dettagli Messaggio #{msg.id}\n\n"
-        text += f"Stato: {'✅ Attivo' if msg.active else '❌ Inattivo'}\n"
-        text += f"Gruppo: {get_group_name(msg.chat_id)}\n"
-        text += f"Pin: {'📌 Sì' if msg.pin else '❌ No'}\n"
-        text += f"Tipo: {msg.message_type.name}\n\n"
-        
-        if msg.message_type == MessageType.TEXT:
-            preview = msg.text[:500] + "..." if len(msg.text) > 500 else msg.text
-            text += f"Contenuto:\n{preview}\n\n"
-        else:
-            if msg.caption:
-                preview = msg.caption[:200] + "..." if len(msg.caption) > 200 else msg.caption
-                text += f"Didascalia:\n{preview}\n\n"
-        
-        if msg.recurrence_type == 'once':
-            text += f"Data/Ora invio: {msg.send_time.strftime('%Y-%m-%d %H:%M')}\n"
-        else:
-            text += f"Orario invio: {msg.schedule_hour:02d}:{msg.schedule_minute:02d}\n"
-            
-            if msg.recurrence_type == 'weekly':
-                days_map = {
-                    'mon': 'Lunedì',
-                    'tue': 'Martedì',
-                    'wed': 'Mercoledì',
-                    'thu': 'Giovedì',
-                    'fri': 'Venerdì',
-                    'sat': 'Sabato',
-                    'sun': 'Domenica'
-                }
-                days = msg.recurrence_days.split(',')
-                days_str = ', '.join(days_map[day] for day in days)
-                text += f"Giorni: {days_str}\n"
+async def message_preview_handler(callback: CallbackQuery, callback_data: PreviewCallback):
+    """Invia l'anteprima del media di un messaggio, solo quando viene richiesta."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
 
-        current_time = datetime.now(pytz.UTC).strftime('%Y-%m-%d %H:%M:%S')
-        text += f"\nData/Ora attuale (UTC): {current_time}"
-
-        # Crea la tastiera per le azioni specifiche del messaggio
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(
-                    text="▶️ Attiva/Disattiva",
-                    callback_data=f"toggle_{msg.id}"
-                ),
-                InlineKeyboardButton(
-                    text="❌ Elimina",
-                    callback_data=f"delete_{msg.id}"
-                )
-            ],
-            [
-                InlineKeyboardButton(
-                    text="📋 Torna alla Lista",
-                    callback_data="list_messages"
-                )
-            ]
-        ])
+    msg_id = callback_data.message_id
+    msg = DatabaseManager.get_message_by_id(msg_id)
+    if not msg or msg.message_type == MessageType.TEXT:
+        await callback.answer(MESSAGES['not_found'], show_alert=True)
+        return
 
-        # Se c'è un media, aggiungiamo l'anteprima
-        if msg.message_type != MessageType.TEXT:
-            try:
-                if msg.message_type == MessageType.PHOTO:
-                    await message.answer_photo(
-                        photo=msg.media,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-                elif msg.message_type == MessageType.VIDEO:
-                    await message.answer_video(
-                        video=msg.media,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-                elif msg.message_type == MessageType.DOCUMENT:
-                    await message.answer_document(
-                        document=msg.media,
-                        caption=text,
-                        reply_markup=keyboard
-                    )
-            except Exception as e:
-                logger.error(f"Errore nell'invio del media: {e}")
-                await message.answer(
-                    text + "\n\n⚠️ Non è stato possibile mostrare l'anteprima del media.",
-                    reply_markup=keyboard
-                )
-        else:
-            await message.answer(text, reply_markup=keyboard)
-        
-    except ValueError:
-        await message.answer(
-            "⚠️ ID non valido. Inserisci un numero.",
-            reply_markup=message_actions_keyboard()
+    try:
+        await send_content(
+            bot, callback.message.chat.id, msg.content(),
+            on_source_lost=functools.partial(DatabaseManager.clear_message_source, msg.id)
         )
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Errore nell'invio del media: {e}")
+        await callback.answer("⚠️ Non è stato possibile mostrare l'anteprima del media.", show_alert=True)
 
-async def toggle_message_handler(callback: CallbackQuery):
+async def toggle_message_handler(callback: CallbackQuery, callback_data: ToggleCallback, state: FSMContext):
     """Handler per attivare/disattivare un messaggio."""
     if not is_admin(callback.from_user.id):
         await callback.answer(MESSAGES['unauthorized'], show_alert=True)
         return
 
     try:
-        msg_id = int(callback.data.split('_')[1])
+        msg_id = callback_data.message_id
         success = DatabaseManager.toggle_message(msg_id)
         
         if success:
-            await callback.answer(MESSAGES['toggled'], show_alert=True)
-            text = callback.message.text
-            # Aggiorna lo stato nel testo
-            text = text.replace("✅ Attivo", "❌ Inattivo") if "✅ Attivo" in text else text.replace("❌ Inattivo", "✅ Attivo")
-            await callback.message.edit_text(
-                text,
-                reply_markup=callback.message.reply_markup
-            )
+            await callback.answer(MESSAGES['toggled'])
+            # Ridisegna i dettagli dal database nella stessa vista
+            msg = DatabaseManager.get_message_by_id(msg_id)
+            data = await state.get_data()
+            await show_message_details(callback.message, msg, data.get('list_filter', 'all'))
         else:
             await callback.answer(MESSAGES['not_found'], show_alert=True)
     
@@ -778,53 +993,63 @@ async def toggle_message_handler(callback: CallbackQuery):
         logger.error(f"Errore nel toggle del messaggio: {e}")
         await callback.answer(MESSAGES['error'], show_alert=True)
 
-async def delete_message_handler(callback: CallbackQuery, state: FSMContext):
+async def delete_message_handler(callback: CallbackQuery, callback_data: DeleteCallback, state: FSMContext):
     """Handler per eliminare un messaggio."""
     if not is_admin(callback.from_user.id):
         await callback.answer(MESSAGES['unauthorized'], show_alert=True)
         return
 
     try:
-        msg_id = int(callback.data.split('_')[1])
+        msg_id = callback_data.message_id
         msg = DatabaseManager.get_message_by_id(msg_id)
         
         if not msg:
             await callback.answer(MESSAGES['not_found'], show_alert=True)
             return
         
-        await state.update_data(delete_msg_id=msg_id)
         await state.set_state(States.CONFIRMING_DELETE)
         
         await callback.message.edit_text(
             f"{MESSAGES['delete_confirm']}\n\n"
             f"ID Messaggio: {msg_id}\n"
-            f"Gruppo: {get_group_name(msg.chat_id)}\n"
+            f"Gruppo: {escape(get_group_name(msg.chat_id))}\n"
             f"Tipo: {msg.message_type.name}",
             reply_markup=confirmation_keyboard(msg_id)
         )
+        await callback.answer()
         
     except Exception as e:
         logger.error(f"Errore nella preparazione eliminazione: {e}")
         await callback.answer(MESSAGES['error'], show_alert=True)
 
-async def confirm_delete_handler(callback: CallbackQuery, state: FSMContext):
+async def confirm_delete_handler(callback: CallbackQuery, callback_data: ConfirmDeleteCallback, state: FSMContext):
     """Handler per confermare l'eliminazione di un messaggio."""
     if not is_admin(callback.from_user.id):
         await callback.answer(MESSAGES['unauthorized'], show_alert=True)
         return
 
-    if callback.data == "cancel_delete":
-        await state.clear()
-        await list_messages_handler(callback, state)
+    # La conferma sostituisce i dettagli: annullando si torna ai dettagli,
+    # confermando alla lista da cui si era partiti
+    data = await state.get_data()
+    list_filter = data.get('list_filter', 'all')
+    await state.set_state(None)
+
+    if not callback_data.confirm:
+        msg = DatabaseManager.get_message_by_id(callback_data.message_id)
+        if msg:
+            await show_message_details(callback.message, msg, list_filter)
+        else:
+            await show_filtered_list(callback.message, list_filter)
+        await callback.answer()
         return
 
     try:
-        msg_id = int(callback.data.split('_')[2])
+        msg_id = callback_data.message_id
         success = DatabaseManager.delete_message(msg_id)
         
         if success:
-            await callback.answer(MESSAGES['deleted'], show_alert=True)
-            await list_messages_handler(callback, state)
+            await callback.answer(MESSAGES['deleted'])
+            await show_filtered_list(callback.message, list_filter)
         else:
             await callback.answer(MESSAGES['not_found'], show_alert=True)
             await state.clear()
@@ -834,11 +1059,274 @@ async def confirm_delete_handler(callback: CallbackQuery, state: FSMContext):
         await callback.answer(MESSAGES['error'], show_alert=True)
         await state.clear()
 
+# HANDLERS PER RICERCA MESSAGGI
+async def search_start_handler(callback: CallbackQuery, state: FSMContext):
+    """Avvia la ricerca full-text sui messaggi programmati."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    await state.set_state(States.SEARCHING_MESSAGES)
+    await callback.message.edit_text(
+        MESSAGES['search_prompt'],
+        reply_markup=message_actions_keyboard()
+    )
+    await callback.answer()
+
+def render_search_results(query: str, page: int):
+    """Prepara le pagine di testo e la tastiera per una pagina di risultati di ricerca."""
+    results = DatabaseManager.search_messages(
+        query,
+        limit=SEARCH_PAGE_SIZE + 1,
+        offset=page * SEARCH_PAGE_SIZE
+    )
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+
+    if not results:
+        return [MESSAGES['search_empty'].format(query=escape(query))], search_results_keyboard(page, False)
+    return render_search_page(results, query, page), search_results_keyboard(page, has_next)
+
+async def process_search_query(message: Message, state: FSMContext):
+    """Esegue la ricerca con il testo inviato dall'admin."""
+    if not is_admin(message.from_user.id):
+        return
+
+    query = (message.text or '').strip()
+    if not query:
+        await message.answer(MESSAGES['search_prompt'])
+        return
+
+    await state.update_data(search_query=query)
+    pages, keyboard = render_search_results(query, 0)
+    await send_pages(message, pages, reply_markup=keyboard, edit=False)
+
+async def search_page_handler(callback: CallbackQuery, callback_data: SearchPageCallback, state: FSMContext):
+    """Mostra un'altra pagina dei risultati di ricerca."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    data = await state.get_data()
+    query = data.get('search_query')
+    if not query:
+        await search_start_handler(callback, state)
+        return
+
+    page = callback_data.page
+    pages, keyboard = render_search_results(query, page)
+    await send_pages(callback.message, pages, reply_markup=keyboard)
+    await callback.answer()
+
+# HANDLERS PER STATISTICHE DI INVIO
+def render_delivery_stats(days: int) -> str:
+    """Riepiloga gli invii degli ultimi `days` giorni leggendo solo gli aggregati giornalieri."""
+    since_day = (datetime.now(pytz.UTC) - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+    rows = DatabaseManager.get_delivery_stats(since_day)
+    if not rows:
+        return MESSAGES['stats_empty']
+    return render_stats_summary(rows, days)
+
+async def delivery_stats_handler(callback: CallbackQuery, callback_data: Optional[StatsCallback]):
+    """Mostra le statistiche di invio per il periodo scelto (default 7 giorni)."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    # Dal menu principale arriva senza periodo
+    days = callback_data.days if callback_data else 7
+    text = render_delivery_stats(days)
+    try:
+        await callback.message.edit_text(text, reply_markup=delivery_stats_keyboard())
+    except TelegramBadRequest:
+        # Stesso periodo selezionato di nuovo: il testo non è cambiato
+        pass
+    await callback.answer()
+
+# HANDLERS PER INVII FALLITI (DEAD LETTER)
+def render_dead_letters():
+    """Prepara pagine di testo e tastiera con gli ultimi invii falliti."""
+    dead_letters = DatabaseManager.get_dead_letters()
+    if not dead_letters:
+        return [MESSAGES['dead_letters_empty']], dead_letters_keyboard([])
+    return render_dead_letter_list(dead_letters), dead_letters_keyboard([row[0] for row in dead_letters])
+
+async def dead_letters_handler(callback: CallbackQuery):
+    """Mostra gli invii falliti definitivamente."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    pages, keyboard = render_dead_letters()
+    await send_pages(callback.message, pages, reply_markup=keyboard)
+    await callback.answer()
+
+async def dead_letter_action_handler(callback: CallbackQuery, callback_data: DeadLetterCallback):
+    """Riaccoda un invio fallito o svuota la lista."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    if callback_data.action == "purge":
+        count = DatabaseManager.delete_dead_letters()
+        await callback.answer(MESSAGES['bulk_done'].format(count=count), show_alert=True)
+    else:
+        dead_letter_id = callback_data.dead_letter_id
+        if DatabaseManager.requeue_dead_letter(dead_letter_id):
+            await callback.answer(MESSAGES['requeued'], show_alert=True)
+        else:
+            await callback.answer(MESSAGES['not_found'], show_alert=True)
+
+    pages, keyboard = render_dead_letters()
+    await send_pages(callback.message, pages, reply_markup=keyboard)
+
+# HANDLERS PER IMPORTAZIONE/ESPORTAZIONE
+async def import_export_handler(callback: CallbackQuery, state: FSMContext):
+    """Mostra le istruzioni e attende un file da importare."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    await state.set_state(States.WAITING_IMPORT_FILE)
+    await callback.message.edit_text(
+        MESSAGES['import_export'].format(fields=','.join(IMPORT_FIELDS)),
+        reply_markup=import_export_keyboard()
+    )
+    await callback.answer()
+
+async def process_import_file(message: Message, state: FSMContext):
+    """Scarica il file inviato e ne importa le programmazioni a lotti."""
+    if not is_admin(message.from_user.id):
+        return
+
+    document = message.document
+    try:
+        fmt = detect_format(document.file_name or '') if document else None
+    except ValueError:
+        fmt = None
+    if not fmt or (document.file_size or 0) > IMPORT_MAX_FILE_SIZE:
+        await message.answer(MESSAGES['import_invalid_file'])
+        return
+
+    status = await message.answer(MESSAGES['import_running'])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / f"import{Path(document.file_name).suffix.lower()}"
+        try:
+            await bot.download(document, destination=path)
+            # Lettura e inserimento in un thread: il polling e lo scheduler non si fermano
+            report = await asyncio.to_thread(
+                import_file, path, fmt,
+                chunk_size=IMPORT_CHUNK_SIZE, min_interval=MIN_INTERVAL_SECONDS
+            )
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            logger.error(f"Importazione del file {document.file_name} non riuscita: {e}")
+            await status.edit_text(f"❌ Importazione non riuscita: {escape(e)}")
+            return
+
+    await state.clear()
+    await status.edit_text(render_import_report(report), reply_markup=main_menu_keyboard())
+
+async def export_handler(callback: CallbackQuery, callback_data: ExportCallback):
+    """Esporta tutte le programmazioni nel formato scelto e le invia come documento."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    extension = next((ext for ext, fmt in FORMATS.items() if fmt == callback_data.fmt), None)
+    if extension is None:
+        await callback.answer(MESSAGES['error'], show_alert=True)
+        return
+
+    await callback.answer()
+    filename = f"programmazioni_{datetime.now(pytz.UTC).strftime('%Y%m%d_%H%M%S')}{extension}"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / filename
+        try:
+            count = await asyncio.to_thread(export_file, path, callback_data.fmt)
+            await callback.message.answer_document(
+                FSInputFile(path, filename=filename),
+                caption=MESSAGES['export_done'].format(count=count)
+            )
+        except Exception as e:
+            logger.error(f"Esportazione non riuscita: {e}")
+            await callback.message.answer(MESSAGES['error'])
+
+# HANDLERS PER OPERAZIONI DI MASSA
+def count_bulk_targets(operation: str, filters: dict) -> int:
+    """Conta i messaggi che verrebbero modificati da un'operazione di massa."""
+    if operation == 'pause':
+        return DatabaseManager.count_messages(active=True, **filters)
+    if operation == 'resume':
+        return DatabaseManager.count_messages(active=False, **filters)
+    return DatabaseManager.count_messages(**filters)
+
+async def bulk_menu_handler(callback: CallbackQuery, state: FSMContext):
+    """Mostra il menu delle operazioni di massa."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    await state.clear()
+    await callback.message.edit_text(
+        MESSAGES['bulk_menu'],
+        reply_markup=bulk_actions_keyboard()
+    )
+    await callback.answer()
+
+async def bulk_action_handler(callback: CallbackQuery, callback_data: BulkActionCallback):
+    """Chiede conferma per un'operazione di massa mostrando i messaggi coinvolti."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    action = callback_data.action
+    if action not in BULK_ACTIONS:
+        await callback.answer(MESSAGES['error'], show_alert=True)
+        return
+
+    description, operation, filters = BULK_ACTIONS[action]
+    count = count_bulk_targets(operation, filters)
+    if not count:
+        await callback.answer(MESSAGES['bulk_empty'], show_alert=True)
+        return
+
+    await callback.message.edit_text(
+        MESSAGES['bulk_confirm'].format(description=description, count=count),
+        reply_markup=bulk_confirmation_keyboard(action)
+    )
+    await callback.answer()
+
+async def bulk_confirm_handler(callback: CallbackQuery, callback_data: BulkConfirmCallback):
+    """Esegue l'operazione di massa confermata con un'unica query."""
+    if not is_admin(callback.from_user.id):
+        await callback.answer(MESSAGES['unauthorized'], show_alert=True)
+        return
+
+    action = callback_data.action
+    if action not in BULK_ACTIONS:
+        await callback.answer(MESSAGES['error'], show_alert=True)
+        return
+
+    _, operation, filters = BULK_ACTIONS[action]
+    if operation == 'pause':
+        count = DatabaseManager.bulk_set_active(False, **filters)
+    elif operation == 'resume':
+        count = DatabaseManager.bulk_set_active(True, **filters)
+    else:
+        count = DatabaseManager.bulk_delete(**filters)
+
+    await callback.message.edit_text(
+        MESSAGES['bulk_done'].format(count=count),
+        reply_markup=bulk_actions_keyboard()
+    )
+    await callback.answer()
+
 async def return_to_main_menu(callback: CallbackQuery, state: FSMContext):
     """Handler per tornare al menu principale."""
     try:
         # Pulisci lo stato corrente
         await state.clear()
+        keyboard_edits.cancel(callback.message)
         
         # Modifica il messaggio esistente con il menu principale
         await callback.message.edit_text(
@@ -853,144 +1341,379 @@ async def return_to_main_menu(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Errore nel ritorno al menu principale: {e}")
         await callback.answer("⚠️ Si è verificato un errore. Riprova.", show_alert=True)
 
+async def notify_admin(text: str):
+    """Invia una notifica all'admin senza interrompere lo scheduler."""
+    try:
+        await bot.send_message(chat_id=ADMIN_ID, text=text)
+    except Exception as e:
+        logger.error(f"Notifica all'admin non riuscita: {e}")
+
+async def handle_dispatch_failure(message, scheduled_time: str, error: Exception):
+    """Classifica l'errore e rimanda l'occorrenza o la sposta nei dead letter."""
+    kind, retry_after = classify_error(error)
+    attempts = DatabaseManager.record_failure(message.id, scheduled_time, str(error))
+
+    if kind == ErrorKind.PERMANENT and circuit_breaker.record_failure(
+        message.chat_id, str(error), clock.now()
+    ):
+        logger.warning(f"Circuito aperto per la chat {message.chat_id}: invii sospesi")
+        await notify_admin(
+            f"🔌 Invii sospesi verso la chat {message.chat_id} dopo ripetuti errori.\n"
+            f"Ultimo errore: {escape(error)}\n"
+            f"Il bot riproverà periodicamente e ti avviserà quando la chat tornerà raggiungibile."
+        )
+
+    if retry_policy.should_retry(kind, attempts):
+        delay = retry_policy.delay(kind, attempts, retry_after)
+        logger.warning(
+            f"Invio del messaggio {message.id} fallito ({kind.value}, tentativo {attempts}): {error}. "
+            f"Nuovo tentativo tra {delay:.0f}s"
+        )
+        DatabaseManager.defer_occurrence(
+            WORKER_ID, message.id, scheduled_time,
+            clock.now() + timedelta(seconds=delay)
+        )
+        delivery_log.record(message, scheduled_time, 'failed', kind.value)
+        return
+
+    logger.error(f"Invio del messaggio {message.id} fallito definitivamente ({kind.value}, {attempts} tentativi): {error}")
+    DatabaseManager.dead_letter_occurrence(
+        message.id, scheduled_time, message.chat_id, kind.value, str(error), clock.now()
+    )
+    delivery_log.record(message, scheduled_time, 'dead', kind.value)
+
+    # L'occorrenza è chiusa: i ricorrenti passano al prossimo invio, i singoli vengono disattivati
+    next_time = message.next_occurrence(clock.now())
+    if next_time:
+        DatabaseManager.update_send_time(message.id, next_time)
+    else:
+        DatabaseManager.mark_as_sent(message.id)
+
+async def dispatch_occurrence(message, scheduled_time: str, current_time: datetime):
+    """Invia un'occorrenza presa in carico e aggiorna la ricorrenza del messaggio."""
+    # Rinnova il lease prima dell'invio; se è stato perso un altro worker
+    # ha preso in carico l'occorrenza
+    lease_expires = clock.now() + SCHEDULER_LEASE
+    with instrumentation.phase('dispatch.lease'):
+        renewed = DatabaseManager.renew_lease(WORKER_ID, message.id, scheduled_time, lease_expires)
+    if not renewed:
+        logger.warning(f"Lease perso per il messaggio {message.id}, invio annullato")
+        return
+
+    # Con il circuito aperto solo un invio alla volta fa da probe, gli altri aspettano
+    allowed, next_probe_at = circuit_breaker.allow(message.chat_id, clock.now())
+    if not allowed:
+        DatabaseManager.defer_occurrence(WORKER_ID, message.id, scheduled_time, next_probe_at)
+        return
+
+    try:
+        with instrumentation.phase('dispatch.send'):
+            sent_message = await send_content(
+                bot, message.chat_id, message.content(),
+                on_source_lost=functools.partial(DatabaseManager.clear_message_source, message.id)
+            )
+    except Exception as e:
+        with instrumentation.phase('dispatch.failure'):
+            await handle_dispatch_failure(message, scheduled_time, e)
+        return
+
+    # Il messaggio è già stato consegnato: un errore nel pin non deve causare un nuovo invio
+    if message.pin and sent_message:
+        try:
+            with instrumentation.phase('dispatch.pin'):
+                await bot.pin_chat_message(
+                    chat_id=message.chat_id,
+                    message_id=sent_message.message_id
+                )
+        except Exception as e:
+            logger.error(f"Pin del messaggio {message.id} non riuscito: {e}")
+
+    if circuit_breaker.record_success(message.chat_id):
+        logger.info(f"Circuito chiuso per la chat {message.chat_id}: invii ripresi")
+        await notify_admin(f"✅ La chat {message.chat_id} è di nuovo raggiungibile: invii ripresi.")
+
+    with instrumentation.phase('dispatch.complete'):
+        DatabaseManager.complete_occurrence(message.id, scheduled_time, WORKER_ID)
+        delivery_log.record(message, scheduled_time, 'sent')
+
+    # Gestisci ricorrenza
+    with instrumentation.phase('dispatch.next_occurrence'):
+        next_time = message.next_occurrence(current_time)
+    with instrumentation.phase('dispatch.reschedule'):
+        if next_time:
+            DatabaseManager.update_send_time(message.id, next_time)
+        else:
+            DatabaseManager.mark_as_sent(message.id)
+
 # Scheduler con gestione errori migliorata
 async def scheduler():
-    retry_delay = 5  # secondi di attesa tra i tentativi in caso di errore
-    max_retries = 3  # numero massimo di tentativi per messaggio
+    rate_limiter = RateLimiter(SCHEDULER_RATE_LIMIT, burst=int(SCHEDULER_RATE_LIMIT), clock=clock)
     
+    while not draining.is_set():
+        with instrumentation.tick():
+            await scheduler_tick(rate_limiter)
+            with instrumentation.phase('next_fire_time'):
+                sleep_for = next_tick_delay()
+        await sleep_unless_draining(sleep_for)
+
+async def scheduler_tick(rate_limiter: RateLimiter):
+    """Un giro dello scheduler: materializza, prende in carico e invia le occorrenze scadute."""
+    try:
+        current_time = clock.now()
+        # Materializza subito i messaggi nuovi o modificati e rinnova
+        # quelli molto frequenti che stanno esaurendo le occorrenze
+        with instrumentation.phase('expand'):
+            DatabaseManager.expand_occurrences(
+                current_time, OCCURRENCE_HORIZON, min_ahead=timedelta(seconds=SCHEDULER_MAX_SLEEP * 2)
+            )
+        with instrumentation.phase('circuit_refresh'):
+            circuit_breaker.refresh()
+        
+        # Prende in carico lotti di occorrenze finché ne restano di libere
+        # (gli altri worker si dividono quelle rimanenti) e le invia per
+        # corsia di priorità, rispettando il limite di invii al secondo
+        queue = PriorityDispatchQueue(
+            lanes=len(MessagePriority),
+            starvation_limit=SCHEDULER_STARVATION_LIMIT
+        )
+        exhausted = False
+        # Durante il drenaggio l'invio in corso termina e la coda si ferma:
+        # le occorrenze rimaste vengono liberate da shutdown()
+        while not draining.is_set():
+            if not exhausted and len(queue) < SCHEDULER_BATCH_SIZE:
+                due = DatabaseManager.claim_due_occurrences(
+                    WORKER_ID, current_time, SCHEDULER_LEASE, limit=SCHEDULER_BATCH_SIZE,
+                    phase=instrumentation.phase
+                )
+                exhausted = not due
+                for message, scheduled_time in due:
+                    queue.push(message.priority, (message, scheduled_time))
+
+            if not queue:
+                break
+
+            message, scheduled_time = queue.pop()
+            with instrumentation.phase('rate_limit'):
+                await rate_limiter.acquire()
+            await dispatch_occurrence(message, scheduled_time, current_time)
+
+    except Exception as e:
+        logger.error(f"Errore scheduler: {e}")
+
+def next_tick_delay() -> float:
+    """Secondi fino al prossimo invio (precisione al secondo), al massimo SCHEDULER_MAX_SLEEP.
+
+    Con un orologio virtuale nessun altro modifica il database: lo scheduler
+    salta direttamente al prossimo invio e si sveglia prima solo quando va
+    rinnovato l'orizzonte delle occorrenze materializzate.
+    """
+    sleep_for = SCHEDULER_MAX_SLEEP
+    now = clock.now()
+    if clock.virtual:
+        sleep_for = OCCURRENCE_HORIZON.total_seconds()
+        expanded_until = DatabaseManager.get_next_expansion_time()
+        if expanded_until is not None:
+            # Il giro successivo rinnova i messaggi con meno di 2 * SCHEDULER_MAX_SLEEP di orizzonte
+            renew_in = (expanded_until - now).total_seconds() - SCHEDULER_MAX_SLEEP * 2 + 1
+            sleep_for = min(sleep_for, max(renew_in, 1))
+    next_fire_time = DatabaseManager.get_next_fire_time()
+    if next_fire_time is not None:
+        delay = (next_fire_time - now).total_seconds()
+        sleep_for = min(sleep_for, delay if delay > 0 else 1)
+    return sleep_for
+
+async def sleep_unless_draining(seconds: float):
+    """Attende `seconds` secondi, o meno se inizia lo spegnimento."""
+    await clock.wait(draining, seconds)
+
+async def occurrence_horizon_job(initial_delay: float = 0):
+    """Mantiene le occorrenze materializzate per l'orizzonte configurato."""
+    # Dopo un riavvio a caldo l'orizzonte è già coperto fino al prossimo giro
+    await asyncio.sleep(initial_delay)
     while True:
         try:
-            current_time = datetime.now(pytz.UTC)
-            messages = DatabaseManager.get_pending_messages()
-            
-            for message in messages:
-                if message.send_time <= current_time and message.active:
-                    for attempt in range(max_retries):
-                        try:
-                            sent_message = None
-                            if message.message_type == MessageType.TEXT:
-                                sent_message = await bot.send_message(
-                                    chat_id=message.chat_id,
-                                    text=message.text
-                                )
-                            elif message.message_type == MessageType.PHOTO:
-                                sent_message = await bot.send_photo(
-                                    chat_id=message.chat_id,
-                                    photo=message.media,
-                                    caption=message.caption
-                                )
-                            elif message.message_type == MessageType.VIDEO:
-                                sent_message = await bot.send_video(
-                                    chat_id=message.chat_id,
-                                    video=message.media,
-                                    caption=message.caption
-                                )
-                            elif message.message_type == MessageType.DOCUMENT:
-                                sent_message = await bot.send_document(
-                                    chat_id=message.chat_id,
-                                    document=message.media,
-                                    caption=message.caption
-                                )
-
-                            if message.pin and sent_message:
-                                await bot.pin_chat_message(
-                                    chat_id=message.chat_id,
-                                    message_id=sent_message.message_id
-                                )
-
-                            # Gestisci ricorrenza
-                            if message.recurrence_type != 'once':
-                                next_time = None
-                                
-                                if message.recurrence_type == 'daily':
-                                    next_time = message.send_time + timedelta(days=1)
-                                
-                                elif message.recurrence_type == 'weekly':
-                                    days = message.recurrence_days.split(',')
-                                    current_day = message.send_time.strftime('%a').lower()
-                                    days_cycle = days[days.index(current_day):] + days[:days.index(current_day)]
-                                    
-                                    for day in days_cycle[1:] + [days_cycle[0]]:
-                                        next_time = message.send_time
-                                        while next_time.strftime('%a').lower() != day:
-                                            next_time += timedelta(days=1)
-                                        if next_time > current_time:
-                                            break
-                                
-                                if next_time:
-                                    DatabaseManager.update_send_time(message.id, next_time)
-                                else:
-                                    DatabaseManager.mark_as_sent(message.id)
-                            else:
-                                DatabaseManager.mark_as_sent(message.id)
-                            
-                            # Se il messaggio è stato inviato con successo, esci dal ciclo di tentativi
-                            break
-                            
-                        except Exception as e:
-                            logger.error(f"Tentativo {attempt + 1}/{max_retries} fallito per il messaggio {message.id}: {e}")
-                            if attempt < max_retries - 1:
-                                await asyncio.sleep(retry_delay)
-                            else:
-                                logger.error(f"Messaggio {message.id} fallito dopo {max_retries} tentativi")
+            # Rinnova solo i messaggi la cui espansione scade entro il prossimo giro
+            now = datetime.now(pytz.UTC)
+            DatabaseManager.expand_occurrences(
+                now,
+                OCCURRENCE_HORIZON,
+                min_ahead=OCCURRENCE_HORIZON - timedelta(seconds=OCCURRENCE_REFRESH_INTERVAL)
+            )
+            checkpoint.mark_job('occurrence_horizon', now)
+        except Exception as e:
+            logger.error(f"Errore nell'aggiornamento delle occorrenze: {e}")
+
+        await asyncio.sleep(OCCURRENCE_REFRESH_INTERVAL)
+
+async def scheduler_metrics_job():
+    """Scrive nel log le statistiche per fase dello scheduler."""
+    while True:
+        await asyncio.sleep(SCHEDULER_METRICS_INTERVAL)
+        logger.info("Fasi dello scheduler dall'avvio:\n  " + "\n  ".join(phase_stats.summary_lines()))
 
+async def fsm_expiry_job():
+    """Rimuove le conversazioni inattive e avvisa l'amministratore che sono state interrotte."""
+    while True:
+        await asyncio.sleep(FSM_SWEEP_INTERVAL)
+        storage.expire()
+        for key, _, reason in storage.pop_expired():
+            # Una conversazione scartata per il limite di memoria non è scaduta per inattività
+            if reason == EVICTED:
+                text = MESSAGES['flow_evicted']
+            else:
+                text = MESSAGES['flow_expired'].format(minutes=FSM_TTL // 60)
+            try:
+                await bot.send_message(key.chat_id, text, reply_markup=main_menu_keyboard())
+            except Exception as e:
+                logger.error(f"Errore nell'avviso di conversazione scaduta: {e}")
+
+def run_retention(now: datetime) -> int:
+    """Archivia i messaggi inattivi ed elimina le occorrenze concluse più vecchie della retention.
+
+    Poi restituisce al filesystem lo spazio liberato; ritorna i messaggi archiviati.
+    """
+    cutoff = now - timedelta(days=RETENTION_DAYS)
+    archived = DatabaseManager.archive_inactive_messages(cutoff, batch_size=RETENTION_BATCH_SIZE)
+    DatabaseManager.prune_occurrences(cutoff, batch_size=RETENTION_BATCH_SIZE)
+    # Un passo alla volta: ogni PRAGMA tiene il lock di scrittura solo per poche pagine
+    freed = 0
+    while True:
+        pages = DatabaseManager.incremental_vacuum(VACUUM_PAGES_PER_STEP)
+        if not pages:
+            break
+        freed += pages
+        time.sleep(0.01)
+    if freed:
+        logger.info(f"Vacuum incrementale: liberate {freed} pagine")
+    return archived
+
+async def retention_job(initial_delay: float = 0):
+    """Mantiene nella tabella principale solo le programmazioni ancora vive."""
+    await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            # In un thread: archiviazione e vacuum non fermano polling e scheduler
+            now = datetime.now(pytz.UTC)
+            await asyncio.to_thread(run_retention, now)
+            checkpoint.mark_job('retention', now)
         except Exception as e:
-            logger.error(f"Errore scheduler: {e}")
+            logger.error(f"Errore nel job di retention: {e}")
 
-        await asyncio.sleep(60)
+        await asyncio.sleep(RETENTION_INTERVAL)
 
 # Registrazione degli handler
 async def register_handlers(dp: Dispatcher):
     # Handler comuni
     dp.message.register(cmd_start, CommandStart())
-    dp.callback_query.register(return_to_main_menu, lambda c: c.data == "main_menu")
+    # Tutti i callback passano dal router: un'unica ricerca per prefisso
+    dp.callback_query.register(callback_router.dispatch)
+    callback_router.register("main_menu", return_to_main_menu)
     
     # Handlers per messaggi immediati
-    dp.callback_query.register(send_message_handler, lambda c: c.data == "send_message")
-    dp.callback_query.register(group_selection_handler, lambda c: c.data.startswith("group_"))
-    dp.callback_query.register(process_pin, lambda c: c.data.startswith("pin_"))
+    callback_router.register("send_message", send_message_handler)
+    callback_router.register(GroupCallback, group_selection_handler)
+    callback_router.register(PinCallback, process_pin)
     dp.message.register(process_message, States.WAITING_MESSAGE)
     
     # Handlers per messaggi schedulati
-    dp.callback_query.register(schedule_start_handler, lambda c: c.data == "schedule_message")
-    dp.callback_query.register(schedule_group_handler, lambda c: c.data.startswith("schedule_to_"))
-    dp.callback_query.register(schedule_type_handler, lambda c: c.data.startswith("schedule_type_"))
-    dp.callback_query.register(schedule_days_handler, lambda c: c.data.startswith("day_") or c.data == "days_confirm")
+    callback_router.register("schedule_message", schedule_start_handler)
+    callback_router.register(ScheduleGroupCallback, schedule_group_handler)
+    callback_router.register(ScheduleTypeCallback, schedule_type_handler)
+    callback_router.register(DayCallback, schedule_days_handler)
     dp.message.register(process_schedule_time, States.SCHEDULE_WAITING_TIME)
+    dp.message.register(process_schedule_cron, States.SCHEDULE_WAITING_CRON)
+    dp.message.register(process_schedule_interval, States.SCHEDULE_WAITING_INTERVAL)
     dp.message.register(process_scheduled_message, States.SCHEDULE_WAITING_MESSAGE)
-    dp.callback_query.register(process_schedule_pin, lambda c: c.data.startswith("schedule_pin_"))
+    callback_router.register(SchedulePinCallback, process_schedule_pin)
+    callback_router.register(PriorityCallback, process_schedule_priority)
     
     # Handlers per lista messaggi
-    dp.callback_query.register(list_messages_handler, lambda c: c.data == "list_messages")
-    dp.callback_query.register(filter_messages_handler, lambda c: c.data.startswith("filter_"))
-    dp.callback_query.register(view_message_details, lambda c: c.data == "view_message_details")
-    dp.message.register(process_message_details, States.VIEWING_MESSAGE)
-    dp.callback_query.register(toggle_message_handler, lambda c: c.data.startswith("toggle_"))
-    dp.callback_query.register(delete_message_handler, lambda c: c.data.startswith("delete_"))
-    dp.callback_query.register(confirm_delete_handler, lambda c: c.data.startswith("confirm_delete_") or c.data == "cancel_delete")
-
-async def shutdown(loop, signal=None):
-    """Gestione pulita dello shutdown."""
-    if signal:
-        logger.info(f"Ricevuto segnale di arresto: {signal.name}")
+    callback_router.register("list_messages", list_messages_handler)
+    callback_router.register(FilterCallback, filter_messages_handler)
+    callback_router.register("upcoming_messages", upcoming_messages_handler)
+    callback_router.register(DetailsCallback, message_details_handler)
+    callback_router.register(PreviewCallback, message_preview_handler)
+    callback_router.register(ToggleCallback, toggle_message_handler)
+    callback_router.register(DeleteCallback, delete_message_handler)
+    callback_router.register(ConfirmDeleteCallback, confirm_delete_handler)
+
+    # Handlers per ricerca messaggi
+    callback_router.register("search_messages", search_start_handler)
+    callback_router.register(SearchPageCallback, search_page_handler)
+    dp.message.register(process_search_query, States.SEARCHING_MESSAGES)
+
+    # Handlers per invii falliti
+    callback_router.register("dead_letters", dead_letters_handler)
+    callback_router.register(DeadLetterCallback, dead_letter_action_handler)
+
+    # Handlers per statistiche di invio
+    callback_router.register("delivery_stats", delivery_stats_handler)
+    callback_router.register(StatsCallback, delivery_stats_handler)
+
+    # Handlers per operazioni di massa
+    callback_router.register("bulk_menu", bulk_menu_handler)
+    callback_router.register(BulkActionCallback, bulk_action_handler)
+    callback_router.register(BulkConfirmCallback, bulk_confirm_handler)
     
+    # Handler per importazione/esportazione
+    callback_router.register("import_export", import_export_handler)
+    callback_router.register(ExportCallback, export_handler)
+    dp.message.register(process_import_file, States.WAITING_IMPORT_FILE)
+
+async def request_shutdown(sig):
+    """Avvia il drenaggio alla ricezione di un segnale: si fermano gli update in arrivo."""
+    logger.info(f"Ricevuto segnale di arresto: {sig.name}")
+    draining.set()
+    if dp is not None and not SCHEDULER_ONLY:
+        try:
+            await dp.stop_polling()
+        except RuntimeError:
+            # Polling non ancora avviato o già fermo
+            pass
+
+async def shutdown(loop, scheduler_task: Optional[asyncio.Task] = None):
+    """Arresto ordinato in due fasi.
+
+    Drenaggio: lo scheduler non prende nuove occorrenze e l'invio in corso
+    termina (pin e aggiornamento del database compresi) entro DRAIN_TIMEOUT.
+    Checkpoint: le occorrenze prese in carico ma non inviate tornano libere,
+    il registro degli invii viene scritto e il checkpoint segnato come drenato.
+    """
+    draining.set()
+    if scheduler_task is not None and not scheduler_task.done():
+        done, _ = await asyncio.wait({scheduler_task}, timeout=DRAIN_TIMEOUT)
+        if not done:
+            logger.warning(f"Invio in corso non terminato entro {DRAIN_TIMEOUT:.0f}s: interrotto")
+
+    released = DatabaseManager.release_leases(WORKER_ID)
+    if released:
+        logger.info(f"Liberate {released} occorrenze prese in carico e non inviate")
+
     tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
-    
-    [task.cancel() for task in tasks]
+    for task in tasks:
+        task.cancel()
     logger.info(f"Cancellazione di {len(tasks)} task in corso")
-    
     await asyncio.gather(*tasks, return_exceptions=True)
-    loop.stop()
-    
-    if signal:
-        loop.remove_signal_handler(signal.SIGTERM)
-        loop.remove_signal_handler(signal.SIGINT)
-    
+
+    checkpoint.mark_drained(datetime.now(pytz.UTC), released)
+    if health_server is not None:
+        health_server.stop()
+    media_ingestor.close()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.remove_signal_handler(sig)
+
     await bot.session.close()
     logger.info("Connessione del bot chiusa")
 
 async def main():
     global bot, dp
+
+    # Il WORKER_ID predefinito cambia a ogni avvio: più worker scheduler sullo
+    # stesso host si sovrascriverebbero il checkpoint dell'host, perdendo
+    # quale worker è caduto e i tempi dei job
+    if SCHEDULER_ONLY and not os.getenv('WORKER_ID') and not os.getenv('SCHEDULER_CHECKPOINT'):
+        logger.error("Un worker SCHEDULER_ONLY richiede un WORKER_ID stabile (o SCHEDULER_CHECKPOINT)")
+        sys.exit(1)
     
     # Setup signal handlers
     loop = asyncio.get_running_loop()
@@ -998,12 +1721,28 @@ async def main():
     for sig in signals:
         loop.add_signal_handler(
             sig,
-            lambda s=sig: asyncio.create_task(shutdown(loop, s))
+            lambda s=sig: asyncio.create_task(request_shutdown(s))
         )
     
     logger.info("Avvio bot...")
     DatabaseManager.init_db()
     logger.info("Database inizializzato")
+
+    # Riavvio a caldo: lease del processo precedente caduto e tempi dei job dal checkpoint
+    now = datetime.now(pytz.UTC)
+    checkpoint.load()
+    crashed_worker = checkpoint.crashed_worker()
+    if crashed_worker:
+        released = DatabaseManager.release_leases(crashed_worker)
+        logger.warning(
+            f"Il worker {crashed_worker} non si è arrestato in modo ordinato: "
+            f"liberate {released} occorrenze"
+        )
+    elif checkpoint.data.get('state') == SchedulerCheckpoint.DRAINED:
+        logger.info(f"Riavvio a caldo dal checkpoint del {checkpoint.data.get('drained_at')}")
+    horizon_delay = checkpoint.job_delay('occurrence_horizon', OCCURRENCE_REFRESH_INTERVAL, now)
+    retention_delay = checkpoint.job_delay('retention', RETENTION_INTERVAL, now)
+    checkpoint.mark_running(WORKER_ID, now)
     
     # Initialize bot and dispatcher
     bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
@@ -1014,13 +1753,30 @@ async def main():
     
     # Start bot and scheduler
     scheduler_task = asyncio.create_task(scheduler())
+    background_tasks = [
+        asyncio.create_task(occurrence_horizon_job(horizon_delay)),
+        asyncio.create_task(delivery_log.run()),
+        asyncio.create_task(retention_job(retention_delay)),
+        asyncio.create_task(loop_watchdog.run()),
+        asyncio.create_task(fsm_expiry_job())
+    ]
+    if phase_stats is not None:
+        background_tasks.append(asyncio.create_task(scheduler_metrics_job()))
+    if health_server is not None:
+        health_server.start()
+    logger.info(f"Avviati {len(background_tasks)} job in background")
     
     try:
-        logger.info(f"Bot avviato. Admin ID: {ADMIN_ID}")
-        await dp.start_polling(bot, skip_updates=True)
+        if SCHEDULER_ONLY:
+            logger.info(f"Worker scheduler avviato senza polling. Worker ID: {WORKER_ID}")
+            await draining.wait()
+        else:
+            logger.info(f"Bot avviato. Admin ID: {ADMIN_ID}, Worker ID: {WORKER_ID}")
+            # I segnali restano a request_shutdown, che ferma il polling e avvia il drenaggio
+            await dp.start_polling(bot, skip_updates=True, handle_signals=False)
     finally:
         logger.info("Arresto del bot...")
-        await shutdown(loop)
+        await shutdown(loop, scheduler_task)
 
 if __name__ == "__main__":
     try:
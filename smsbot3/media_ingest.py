@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional
+
+from aiogram import Bot
+
+try:
+    from PIL import Image
+except ImportError:  # la ricompressione delle immagini richiede Pillow
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# La Bot API non permette di scaricare file più grandi di così
+BOT_API_DOWNLOAD_LIMIT = 20 * 1024 * 1024
+
+# Firme all'inizio del file: (offset, byte, tipo MIME)
+MAGIC_SIGNATURES = [
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (4, b'ftyp', 'video/mp4'),
+    (0, b'\x00\x00\x01\xba', 'video/mpeg'),
+    (0, b'\x00\x00\x01\xb3', 'video/mpeg'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'PK\x03\x04', 'application/zip'),
+    (0, b'Rar!\x1a\x07', 'application/x-rar-compressed'),
+    (0, b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/msword'),
+]
+# Byte letti per riconoscere il tipo
+SNIFF_SIZE = 16
+
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+# Immagini che possono essere ricompresse in JPEG se superano il limite
+RECOMPRESSIBLE_TYPES = {'image/jpeg', 'image/png'}
+# Tentativi di ricompressione: qualità JPEG, poi riduzioni successive del lato
+JPEG_QUALITIES = (85, 75, 60)
+MAX_DOWNSCALE_STEPS = 6
+
+
+class MediaRejected(Exception):
+    """Il media non può essere programmato; il messaggio è mostrato all'amministratore."""
+
+
+class IngestedMedia:
+    """Media scaricato e validato, pronto per l'invio (eventualmente ricompresso)."""
+
+    def __init__(self, path: Path, mime: str, size: int, recompressed: bool = False):
+        self.path = path
+        self.mime = mime
+        self.size = size
+        self.recompressed = recompressed
+
+
+def format_size(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """Riconosce il tipo dai primi byte del file (None se sconosciuto)."""
+    for offset, signature, mime in MAGIC_SIGNATURES:
+        if head[offset:offset + len(signature)] == signature:
+            return mime
+    return None
+
+
+def inspect_media(path: str) -> str:
+    """Tipo MIME completo del file; distingue i documenti Word dagli archivi zip."""
+    with open(path, 'rb') as f:
+        mime = sniff_mime(f.read(SNIFF_SIZE))
+    if mime == 'application/zip':
+        try:
+            with zipfile.ZipFile(path) as archive:
+                if 'word/document.xml' in archive.namelist():
+                    return DOCX_MIME
+        except zipfile.BadZipFile:
+            raise MediaRejected("archivio zip danneggiato")
+    return mime or 'application/octet-stream'
+
+
+def recompress_image(source: str, destination: str, max_size: int) -> int:
+    """Salva l'immagine come JPEG entro `max_size` byte; restituisce la nuova dimensione.
+
+    Prova prima a ridurre la qualità, poi rimpicciolisce l'immagine del 25%
+    alla volta. Gira in un processo separato: è lavoro di CPU.
+    """
+    with Image.open(source) as original:
+        image = original.convert('RGB')
+    for _ in range(MAX_DOWNSCALE_STEPS + 1):
+        for quality in JPEG_QUALITIES:
+            image.save(destination, 'JPEG', quality=quality, optimize=True)
+            size = os.path.getsize(destination)
+            if size <= max_size:
+                return size
+        image = image.resize((max(1, image.width * 3 // 4), max(1, image.height * 3 // 4)),
+                             Image.LANCZOS)
+    raise MediaRejected(f"impossibile ridurre l'immagine sotto {format_size(max_size)}")
+
+
+class MediaIngestor:
+    """Scarica, valida e se serve ricomprime i media prima della programmazione.
+
+    Il download procede a blocchi e si interrompe appena supera il limite;
+    il tipo viene riconosciuto dai primi byte, senza fidarsi del nome o del
+    tipo dichiarato. Analisi completa e ricompressione girano in un pool di
+    processi, così l'event loop non resta bloccato.
+    """
+
+    def __init__(self, max_size: int, allowed_types: Iterable[str], workers: int = 2,
+                 chunk_size: int = 65536, timeout: int = 60):
+        self.max_size = max_size
+        self.allowed_types = set(allowed_types)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if Image is None:
+            logger.warning("Pillow non è installato: le immagini troppo grandi verranno rifiutate, non ricompresse")
+
+    def _allowed(self, mime: Optional[str]) -> bool:
+        # Un documento Word è anche un archivio zip: si decide dopo il download
+        if mime == 'application/zip':
+            return bool(self.allowed_types & {'application/zip', DOCX_MIME})
+        return mime in self.allowed_types
+
+    def _can_recompress(self, mime: Optional[str]) -> bool:
+        return Image is not None and mime in RECOMPRESSIBLE_TYPES
+
+    async def _run(self, function, *args):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, function, *args)
+
+    async def _download(self, bot: Bot, file_id: str, destination: Path) -> tuple:
+        """Scarica il file controllando tipo e dimensione durante lo streaming."""
+        file = await bot.get_file(file_id)
+        url = bot.session.api.file_url(bot.token, file.file_path)
+        mime = None
+        limit = self.max_size
+        size = 0
+        with open(destination, 'wb') as f:
+            async for chunk in bot.session.stream_content(url=url, timeout=self.timeout,
+                                                          chunk_size=self.chunk_size):
+                if mime is None:
+                    mime = sniff_mime(chunk[:SNIFF_SIZE]) or 'application/octet-stream'
+                    if not self._allowed(mime):
+                        raise MediaRejected(f"tipo di file non consentito ({mime})")
+                    # Le immagini oltre il limite si scaricano comunque per ricomprimerle
+                    if self._can_recompress(mime):
+                        limit = max(limit, BOT_API_DOWNLOAD_LIMIT)
+                size += len(chunk)
+                if size > limit:
+                    raise MediaRejected(f"file più grande di {format_size(limit)}")
+                f.write(chunk)
+        if mime is None:
+            raise MediaRejected("file vuoto")
+        return mime, size
+
+    async def ingest(self, bot: Bot, file_id: str, work_dir: Path,
+                     file_size: Optional[int] = None) -> IngestedMedia:
+        """Scarica e valida un media in `work_dir`; solleva MediaRejected se non è accettabile.
+
+        `file_size` è la dimensione dichiarata da Telegram: se supera ogni
+        limite il file viene rifiutato senza scaricarlo.
+        """
+        hard_limit = max(self.max_size, BOT_API_DOWNLOAD_LIMIT if Image is not None else 0)
+        if file_size and file_size > hard_limit:
+            raise MediaRejected(f"file più grande di {format_size(hard_limit)}")
+
+        path = work_dir / 'media'
+        mime, size = await self._download(bot, file_id, path)
+        mime = await self._run(inspect_media, str(path))
+        if mime not in self.allowed_types:
+            raise MediaRejected(f"tipo di file non consentito ({mime})")
+        if size <= self.max_size:
+            return IngestedMedia(path, mime, size)
+
+        if not self._can_recompress(mime):
+            raise MediaRejected(f"file più grande di {format_size(self.max_size)}")
+
+        recompressed = work_dir / 'media.jpg'
+        new_size = await self._run(recompress_image, str(path), str(recompressed), self.max_size)
+        logger.info(f"Immagine ricompressa da {size} a {new_size} byte")
+        return IngestedMedia(recompressed, 'image/jpeg', new_size, recompressed=True)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,362 @@
+import html
+import os
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Tuple
+
+from database.models import MessageType, MessagePriority
+
+# ID e nomi dei gruppi dalle variabili d'ambiente, come in keyboards.py
+GRUPPO_1_ID = int(os.getenv('GRUPPO_1_ID', 0))
+GRUPPO_2_ID = int(os.getenv('GRUPPO_2_ID', 0))
+GRUPPO_1_NAME = os.getenv('GRUPPO_1_NAME', 'Clienti')
+GRUPPO_2_NAME = os.getenv('GRUPPO_2_NAME', 'Reseller')
+
+# Limiti di Telegram per il testo dei messaggi e per le didascalie
+MAX_MESSAGE_LENGTH = 4096
+MAX_CAPTION_LENGTH = 1024
+
+DAYS_MAP = {
+    'mon': 'Lunedì',
+    'tue': 'Martedì',
+    'wed': 'Mercoledì',
+    'thu': 'Giovedì',
+    'fri': 'Venerdì',
+    'sat': 'Sabato',
+    'sun': 'Domenica'
+}
+
+TYPE_ICONS = {
+    MessageType.TEXT: "📝",
+    MessageType.PHOTO: "📷",
+    MessageType.VIDEO: "🎥",
+    MessageType.DOCUMENT: "📎",
+    MessageType.AUDIO: "🎵",
+    MessageType.VOICE: "🎤",
+    MessageType.ANIMATION: "🎞",
+    MessageType.STICKER: "🏷",
+    MessageType.VIDEO_NOTE: "⏺",
+    MessageType.COPY: "📋"
+}
+
+TYPE_LABELS = {
+    MessageType.TEXT.value: "📝 Testo",
+    MessageType.PHOTO.value: "📷 Foto",
+    MessageType.VIDEO.value: "🎥 Video",
+    MessageType.DOCUMENT.value: "📎 Documento",
+    MessageType.AUDIO.value: "🎵 Audio",
+    MessageType.VOICE.value: "🎤 Vocale",
+    MessageType.ANIMATION.value: "🎞 GIF",
+    MessageType.STICKER.value: "🏷 Sticker",
+    MessageType.VIDEO_NOTE.value: "⏺ Videomessaggio",
+    MessageType.COPY.value: "📋 Copia"
+}
+
+# Voci per messaggio della lista: ognuna ha un pulsante e Telegram ne accetta al massimo 100
+LIST_ENTRIES_PER_PAGE = 60
+
+# Sezioni della lista messaggi, nell'ordine in cui vengono mostrate
+LIST_SECTIONS = (
+    ('once', "🔹 MESSAGGI SINGOLI:\n"),
+    ('daily', "🔹 MESSAGGI GIORNALIERI:\n"),
+    ('weekly', "🔹 MESSAGGI SETTIMANALI:\n"),
+    ('cron', "🔹 MESSAGGI CRON:\n"),
+    ('interval', "🔹 MESSAGGI A INTERVALLO:\n"),
+)
+
+
+def escape(value) -> str:
+    """Escape HTML di un valore inserito nel testo (una sola volta, al rendering)."""
+    return html.escape(str(value)) if value is not None else ''
+
+
+def get_group_name(chat_id: int) -> str:
+    if chat_id == GRUPPO_1_ID:
+        return GRUPPO_1_NAME
+    elif chat_id == GRUPPO_2_ID:
+        return GRUPPO_2_NAME
+    return "Entrambi i gruppi"
+
+
+def format_interval(seconds: int) -> str:
+    """Formatta un intervallo in secondi come '1h30m'."""
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    parts = [f"{hours}h" if hours else "", f"{minutes}m" if minutes else "", f"{secs}s" if secs else ""]
+    return ''.join(parts) or "0s"
+
+
+def format_days(recurrence_days: str) -> str:
+    return ', '.join(DAYS_MAP.get(day, day) for day in recurrence_days.split(','))
+
+
+def describe_recurrence(msg) -> str:
+    """Descrizione breve della ricorrenza di un messaggio programmato."""
+    if msg.recurrence_type == 'once':
+        return f"📅 {msg.send_time.strftime('%Y-%m-%d %H:%M')}"
+    if msg.recurrence_type == 'cron':
+        return f"🧩 Cron: {escape(msg.cron_expression)}"
+    if msg.recurrence_type == 'interval':
+        return f"🔁 Ogni {format_interval(msg.interval_seconds)} (prossimo: {msg.send_time.strftime('%Y-%m-%d %H:%M:%S')})"
+    time_str = f"{msg.schedule_hour:02d}:{msg.schedule_minute:02d}"
+    if msg.recurrence_type == 'daily':
+        return f"⏰ Ogni giorno alle {time_str}"
+    return f"📆 {format_days(msg.recurrence_days)} alle {time_str}"
+
+
+def current_time_footer(now: datetime) -> str:
+    return f"\nData/Ora attuale (UTC): {now.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+def truncate(text: str, limit: int, marker: str = "...") -> str:
+    """Escape di un testo accorciato in modo che il risultato non superi `limit` caratteri."""
+    escaped = escape(text)
+    if len(escaped) <= limit:
+        return escaped
+    # L'escape allunga alcuni caratteri: conta la lunghezza escapata di ognuno
+    budget = limit - len(marker)
+    size = 0
+    for i, char in enumerate(text):
+        size += len(escape(char))
+        if size > budget:
+            return escape(text[:i]) + marker
+    return escaped
+
+def _cut_entry(entry: str, limit: int) -> str:
+    """Accorcia una voce già formattata senza spezzare righe o entità HTML."""
+    cut = entry.rfind('\n', 0, limit - 1)
+    if cut <= 0:
+        cut = limit - 1
+        amp = entry.rfind('&', 0, cut)
+        if amp > entry.rfind(';', 0, cut):
+            cut = amp
+    return entry[:cut] + '…'
+
+
+def pack_keyed_entries(entries: Iterable[Tuple[Any, str]], header: str = '', footer: str = '',
+                       limit: int = MAX_MESSAGE_LENGTH,
+                       max_entries: Optional[int] = None) -> List[Tuple[str, list]]:
+    """Raggruppa voci intere in messaggi di al massimo `limit` caratteri.
+
+    Le voci sono coppie (chiave, testo); per ogni messaggio restituisce il testo
+    e le chiavi delle voci che contiene. L'intestazione apre il primo messaggio
+    e il piede chiude l'ultimo. Una voce non viene mai divisa tra due messaggi:
+    solo una voce più lunga del limite viene accorciata a fine riga.
+    """
+    pages: List[Tuple[str, list]] = []
+    buffer: List[str] = [header]
+    keys: list = []
+    size = len(header)
+    available = limit - len(footer)
+
+    for key, entry in entries:
+        # Si va a capo quando il messaggio ha già delle voci (non basta l'intestazione):
+        # così solo una voce che da sola supera il limite viene accorciata
+        if keys and (size + len(entry) > available or len(keys) == max_entries):
+            pages.append((''.join(buffer), keys))
+            buffer, keys, size = [], [], 0
+        if size + len(entry) > available:
+            entry = _cut_entry(entry, available - size)
+        buffer.append(entry)
+        keys.append(key)
+        size += len(entry)
+
+    buffer.append(footer)
+    pages.append((''.join(buffer), keys))
+    return pages
+
+
+def pack_entries(entries: Iterable[str], header: str = '', footer: str = '',
+                 limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Come pack_keyed_entries, per voci senza chiave: restituisce solo i testi."""
+    return [text for text, _ in pack_keyed_entries(((None, entry) for entry in entries),
+                                                   header, footer, limit)]
+
+
+def entry_header(msg) -> str:
+    """Riga di intestazione di un messaggio: ID, stato, pin, priorità e tipo."""
+    return (f"ID: {msg.id} {'✅' if msg.active else '❌'} {'📌' if msg.pin else ''}"
+            f"{' 🚨' if msg.priority == MessagePriority.HIGH.value else ''} "
+            f"{TYPE_ICONS.get(msg.message_type, '📎')}")
+
+
+def render_entry(msg, *lines: str) -> str:
+    """Voce di una lista: intestazione, gruppo e righe aggiuntive già escapate."""
+    return '\n'.join((entry_header(msg), f"👥 {escape(get_group_name(msg.chat_id))}", *lines)) + "\n\n"
+
+
+def _schedule_lines(msg) -> tuple:
+    if msg.recurrence_type == 'once':
+        return (f"📅 {msg.send_time.strftime('%Y-%m-%d %H:%M')}",)
+    if msg.recurrence_type == 'daily':
+        return (f"⏰ Ogni giorno alle {msg.schedule_hour:02d}:{msg.schedule_minute:02d}",)
+    if msg.recurrence_type == 'cron':
+        return (f"🧩 {escape(msg.cron_expression)}",
+                f"⏭ Prossimo: {msg.send_time.strftime('%Y-%m-%d %H:%M')}")
+    if msg.recurrence_type == 'interval':
+        return (f"🔁 Ogni {format_interval(msg.interval_seconds)}",
+                f"⏭ Prossimo: {msg.send_time.strftime('%Y-%m-%d %H:%M:%S')}")
+    return (f"📆 {format_days(msg.recurrence_days)}",
+            f"⏰ Alle {msg.schedule_hour:02d}:{msg.schedule_minute:02d}")
+
+
+def render_message_list(messages: list, title: str, now: datetime) -> List[Tuple[str, list]]:
+    """Lista dei messaggi programmati raggruppata per tipo di ricorrenza.
+
+    Restituisce per ogni messaggio Telegram il testo e gli ID dei messaggi
+    programmati che contiene, per costruire i pulsanti dei dettagli.
+    """
+    sections = {key: [] for key, _ in LIST_SECTIONS}
+    for msg in messages:
+        sections.get(msg.recurrence_type, sections['weekly']).append(
+            (msg.id, render_entry(msg, *_schedule_lines(msg)))
+        )
+
+    entries = []
+    for key, section_title in LIST_SECTIONS:
+        if sections[key]:
+            # Il titolo resta attaccato alla prima voce della sezione
+            first_id, first_entry = sections[key][0]
+            entries.append((first_id, section_title + first_entry))
+            entries.extend(sections[key][1:])
+
+    return pack_keyed_entries(
+        entries,
+        header=f"📋 Lista Messaggi - {escape(title)}\n\n",
+        footer=current_time_footer(now),
+        max_entries=LIST_ENTRIES_PER_PAGE
+    )
+
+
+def render_upcoming(upcoming: list, now: datetime) -> List[str]:
+    """Invii previsti nelle prossime 24 ore."""
+    if not upcoming:
+        return pack_entries([], header="⏭ Nessun invio previsto nelle prossime 24 ore.\n\n",
+                            footer=current_time_footer(now).lstrip('\n'))
+    entries = (
+        f"{fire_time.strftime('%d/%m %H:%M')} - ID: {msg.id} {'📌' if msg.pin else ''}\n"
+        f"👥 {escape(get_group_name(msg.chat_id))}\n\n"
+        for msg, fire_time in upcoming
+    )
+    return pack_entries(entries, header="⏭ Prossimi invii (24h):\n\n",
+                        footer=current_time_footer(now).lstrip('\n'))
+
+
+def render_search_page(results: list, query: str, page: int) -> List[str]:
+    """Una pagina di risultati della ricerca full-text."""
+    entries = (
+        render_entry(msg, describe_recurrence(msg), f"💬 {escape(snippet or '')}")
+        for msg, snippet in results
+    )
+    return pack_entries(entries, header=f"🔎 Risultati per: {escape(query)} (pagina {page + 1})\n\n")
+
+
+def render_dead_letter_list(dead_letters: list) -> List[str]:
+    """Ultimi invii falliti definitivamente."""
+    entries = (
+        f"#{dead_letter_id} - Messaggio ID: {message_id}\n"
+        f"👥 {escape(get_group_name(chat_id))}\n"
+        f"📅 {datetime.fromisoformat(scheduled_time).strftime('%Y-%m-%d %H:%M')}\n"
+        f"⚠️ {error_kind} dopo {attempts} tentativi: {truncate(error or '', 200)}\n\n"
+        for dead_letter_id, message_id, scheduled_time, chat_id, error_kind, error, attempts, created_at
+        in dead_letters
+    )
+    return pack_entries(entries, header="☠️ Invii falliti definitivamente:\n\n")
+
+
+def render_message_details(msg, now: datetime, limit: int = MAX_MESSAGE_LENGTH) -> str:
+    """Dettagli di un messaggio, con anteprima del testo o della didascalia entro `limit`."""
+    head = [
+        f"🔍 Dettagli Messaggio #{msg.id}\n\n",
+        f"Stato: {'✅ Attivo' if msg.active else '❌ Inattivo'}\n",
+        f"Gruppo: {escape(get_group_name(msg.chat_id))}\n",
+        f"Pin: {'📌 Sì' if msg.pin else '❌ No'}\n",
+        f"Priorità: {MessagePriority(msg.priority).name}\n",
+        f"Tipo: {msg.message_type.name}\n\n",
+    ]
+
+    tail = []
+    if msg.recurrence_type == 'once':
+        tail.append(f"Data/Ora invio: {msg.send_time.strftime('%Y-%m-%d %H:%M')}\n")
+    elif msg.recurrence_type == 'cron':
+        tail.append(f"Cron: {escape(msg.cron_expression)}\n")
+        tail.append(f"Prossimo invio: {msg.send_time.strftime('%Y-%m-%d %H:%M')}\n")
+    elif msg.recurrence_type == 'interval':
+        tail.append(f"Intervallo: ogni {format_interval(msg.interval_seconds)}\n")
+        tail.append(f"Prossimo invio: {msg.send_time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    else:
+        tail.append(f"Orario invio: {msg.schedule_hour:02d}:{msg.schedule_minute:02d}\n")
+        if msg.recurrence_type == 'weekly':
+            tail.append(f"Giorni: {format_days(msg.recurrence_days)}\n")
+    tail.append(current_time_footer(now))
+
+    # L'anteprima del contenuto usa lo spazio lasciato libero dal resto
+    if msg.message_type == MessageType.TEXT:
+        label, content, preview_limit = "Contenuto", msg.text, 500
+    else:
+        label, content, preview_limit = "Didascalia", msg.caption, 200
+
+    if content:
+        label = f"{label}:\n"
+        fixed = sum(map(len, head)) + sum(map(len, tail)) + len(label) + 2
+        if len(content) > preview_limit:
+            content = content[:preview_limit] + "..."
+        head.extend((label, truncate(content, max(limit - fixed, 0)), "\n\n"))
+
+    return ''.join(head + tail)
+
+
+def format_counts(counts: list) -> str:
+    sent, failed, dead = counts
+    return f"✅ {sent} · ⚠️ {failed} · ☠️ {dead}"
+
+
+def render_stats_summary(rows: list, days: int) -> str:
+    """Riepilogo degli invii a partire dagli aggregati giornalieri."""
+    total = [0, 0, 0]
+    by_day = {}
+    by_group = {}
+    for day, chat_id, message_type, *counts in rows:
+        day_counts = by_day.setdefault(day, [0, 0, 0])
+        group = by_group.setdefault(chat_id, {'total': [0, 0, 0], 'types': {}})
+        type_counts = group['types'].setdefault(message_type, [0, 0, 0])
+        for i, count in enumerate(counts):
+            total[i] += count
+            day_counts[i] += count
+            group['total'][i] += count
+            type_counts[i] += count
+
+    period = "oggi" if days == 1 else f"ultimi {days} giorni"
+    parts = [
+        f"📊 Statistiche invii ({period})\n",
+        "✅ inviati · ⚠️ tentativi falliti · ☠️ persi\n\n",
+        f"Totale: {format_counts(total)}\n\n",
+    ]
+    for chat_id, group in by_group.items():
+        parts.append(f"👥 {escape(get_group_name(chat_id))}: {format_counts(group['total'])}\n")
+        parts.extend(
+            f"   {TYPE_LABELS.get(message_type, escape(message_type))}: {format_counts(counts)}\n"
+            for message_type, counts in sorted(group['types'].items())
+        )
+        parts.append("\n")
+    if days > 1:
+        parts.append("📅 Per giorno:\n")
+        parts.extend(f"{day}: {format_counts(counts)}\n" for day, counts in by_day.items())
+    return ''.join(parts)
+
+
+def render_import_report(report) -> str:
+    """Esito di un'importazione con i primi errori per riga."""
+    parts = [
+        "📥 Importazione completata\n\n",
+        f"Righe lette: {report.total}\n",
+        f"✅ Inserite: {report.imported}\n",
+        f"⚠️ Scartate: {report.failed}\n",
+        f"⏱ Tempo: {report.elapsed:.1f}s\n",
+    ]
+    if report.errors:
+        parts.append("\nErrori:\n")
+        parts.extend(f"riga {line}: {escape(error)}\n" for line, error in report.errors)
+        if report.failed > len(report.errors):
+            parts.append(f"... e altri {report.failed - len(report.errors)} errori\n")
+    text = ''.join(parts)
+    return text if len(text) <= MAX_MESSAGE_LENGTH else _cut_entry(text, MAX_MESSAGE_LENGTH)
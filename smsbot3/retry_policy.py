@@ -0,0 +1,93 @@
+import asyncio
+import random
+from enum import Enum
+from typing import Optional, Tuple
+
+from aiohttp import ClientError
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramEntityTooLarge,
+    TelegramForbiddenError,
+    TelegramMigrateToChat,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+    TelegramUnauthorizedError
+)
+
+
+class ErrorKind(Enum):
+    """Classi di errore di invio, ognuna con la propria politica di retry."""
+    FLOOD_WAIT = "flood_wait"  # Telegram chiede di attendere (retry_after)
+    TRANSIENT = "transient"    # Rete, timeout, errori 5xx
+    PERMANENT = "permanent"    # Chat inesistente, bot rimosso, file_id non valido...
+    UNKNOWN = "unknown"
+
+
+# Frammenti dei messaggi di TelegramBadRequest che non si risolvono riprovando
+PERMANENT_BAD_REQUESTS = (
+    'chat not found',
+    'wrong file identifier',
+    'wrong remote file identifier',
+    'file_id',
+    'not enough rights',
+    'have no rights',
+    'bot is not a member',
+    'message is too long',
+    'caption is too long',
+    'message text is empty',
+    'group chat was upgraded',
+    'peer_id_invalid',
+    'message to copy not found',
+)
+
+
+def classify_error(error: Exception) -> Tuple[ErrorKind, Optional[float]]:
+    """Classifica un errore di invio; per i flood wait restituisce anche l'attesa richiesta."""
+    if isinstance(error, TelegramRetryAfter):
+        return ErrorKind.FLOOD_WAIT, float(error.retry_after)
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, ClientError, asyncio.TimeoutError)):
+        return ErrorKind.TRANSIENT, None
+    if isinstance(error, (TelegramForbiddenError, TelegramUnauthorizedError, TelegramNotFound,
+                          TelegramMigrateToChat, TelegramEntityTooLarge)):
+        return ErrorKind.PERMANENT, None
+    if isinstance(error, TelegramBadRequest):
+        description = str(error).lower()
+        if any(fragment in description for fragment in PERMANENT_BAD_REQUESTS):
+            return ErrorKind.PERMANENT, None
+    return ErrorKind.UNKNOWN, None
+
+
+class RetryPolicy:
+    """Decide se e quando riprovare un invio fallito (backoff esponenziale con jitter)."""
+
+    def __init__(
+        self,
+        base_delay: float = 5,
+        max_delay: float = 900,
+        max_attempts_transient: int = 6,
+        max_attempts_unknown: int = 3,
+        max_attempts_flood: int = 10
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = {
+            ErrorKind.FLOOD_WAIT: max_attempts_flood,
+            ErrorKind.TRANSIENT: max_attempts_transient,
+            ErrorKind.UNKNOWN: max_attempts_unknown,
+            ErrorKind.PERMANENT: 1,
+        }
+
+    def should_retry(self, kind: ErrorKind, attempts: int) -> bool:
+        """`attempts` è il numero di tentativi già falliti, compreso l'ultimo."""
+        return attempts < self.max_attempts[kind]
+
+    def delay(self, kind: ErrorKind, attempts: int, retry_after: Optional[float] = None) -> float:
+        """Secondi di attesa prima del prossimo tentativo."""
+        if kind == ErrorKind.FLOOD_WAIT and retry_after is not None:
+            # Rispetta l'attesa richiesta, con un piccolo margine casuale
+            return retry_after + random.uniform(0, 1)
+        # "Equal jitter": metà del backoff è fissa, metà casuale
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return backoff / 2 + random.uniform(0, backoff / 2)
@@ -0,0 +1,472 @@
+"""Importazione ed esportazione delle programmazioni in CSV o JSONL.
+
+Le righe vengono lette e scritte una alla volta e inserite a lotti, quindi
+la memoria usata non dipende dalla dimensione del file.
+
+Uso (dalla cartella smsbot3):
+    python -m schedule_io import programmazioni.csv
+    python -m schedule_io export programmazioni.jsonl
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Iterator, List, Optional, Tuple
+
+import pytz
+
+from database.cron import compile_cron
+from database.database import DatabaseManager
+from database.models import (
+    MessagePriority,
+    MessageType,
+    RecurrenceType,
+    ScheduledMessage,
+    WEEKDAY_CODES
+)
+from renderer import MAX_CAPTION_LENGTH, MAX_MESSAGE_LENGTH
+
+logger = logging.getLogger(__name__)
+
+# Colonne del file, nello stesso ordine in CSV e JSONL
+FIELDS = [
+    'chat_id', 'message_type', 'send_time', 'text', 'media', 'caption',
+    'pin', 'active', 'recurrence_type', 'recurrence_days', 'schedule_hour',
+    'schedule_minute', 'cron_expression', 'interval_seconds', 'anchor_time',
+    'priority', 'source_chat_id', 'source_message_id'
+]
+
+# Estensioni riconosciute per ciascun formato
+FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl'
+}
+
+PRIORITIES = {priority.value for priority in MessagePriority}
+TRUE_VALUES = {'1', 'true', 'yes', 'si', 'sì'}
+FALSE_VALUES = {'0', 'false', 'no'}
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_MIN_INTERVAL = 10
+
+
+class ImportReport:
+    """Esito di un'importazione: righe lette, inserite e primi errori per riga."""
+
+    MAX_ERRORS = 50
+
+    def __init__(self):
+        self.total = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors: List[Tuple[int, str]] = []
+        self.elapsed = 0.0
+
+    def add_error(self, line: int, error: str) -> None:
+        self.failed += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append((line, error))
+
+
+def detect_format(filename: str) -> str:
+    """Ricava il formato ('csv' o 'jsonl') dall'estensione del file."""
+    suffix = Path(filename).suffix.lower()
+    if suffix not in FORMATS:
+        raise ValueError(f"formato non riconosciuto per '{filename}' (usa .csv o .jsonl)")
+    return FORMATS[suffix]
+
+
+def _read_csv(stream: IO[str]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    reader = csv.DictReader(stream)
+    missing = {'chat_id', 'message_type'} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"colonne obbligatorie mancanti: {', '.join(sorted(missing))}")
+    for record in reader:
+        yield reader.line_num, record, None
+
+
+def _read_jsonl(stream: IO[str]) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_number, None, f"JSON non valido: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "ogni riga deve essere un oggetto JSON"
+            continue
+        yield line_number, record, None
+
+
+def read_records(stream: IO[str], fmt: str) -> Iterator[Tuple[int, Optional[dict], Optional[str]]]:
+    """Restituisce (numero di riga, record, errore di decodifica) per ogni riga del file."""
+    if fmt == 'csv':
+        return _read_csv(stream)
+    return _read_jsonl(stream)
+
+
+def _value(record: dict, field: str):
+    """Valore di un campo, con stringhe vuote e spazi trattati come assenti."""
+    value = record.get(field)
+    if isinstance(value, str):
+        value = value.strip()
+    return None if value in ('', None) else value
+
+
+def _text(record: dict, field: str) -> Optional[str]:
+    """Come _value, ma conserva gli spazi del testo."""
+    value = record.get(field)
+    if value is None or value == '' or (isinstance(value, str) and not value.strip()):
+        return None
+    return str(value)
+
+
+def _int(record: dict, field: str) -> Optional[int]:
+    value = _value(record, field)
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{field}: atteso un numero intero")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field}: atteso un numero intero, trovato '{value}'")
+
+
+def _bool(record: dict, field: str, default: bool) -> bool:
+    value = _value(record, field)
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"{field}: atteso un valore booleano, trovato '{value}'")
+
+
+def _datetime(record: dict, field: str) -> Optional[datetime]:
+    """Legge una data ISO 8601; senza fuso orario viene considerata UTC."""
+    value = _value(record, field)
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"{field}: data non valida '{value}' (usa il formato ISO 8601)")
+    if parsed.tzinfo is None:
+        return pytz.UTC.localize(parsed)
+    return parsed.astimezone(pytz.UTC)
+
+
+def parse_record(record: dict, now: datetime, min_interval: int = DEFAULT_MIN_INTERVAL) -> dict:
+    """Valida un record e lo converte nel `message_data` di add_scheduled_message.
+
+    Solleva ValueError con la descrizione del primo campo non valido.
+    """
+    chat_id = _int(record, 'chat_id')
+    if chat_id is None:
+        raise ValueError("chat_id mancante")
+
+    message_type = _value(record, 'message_type')
+    if message_type is None:
+        raise ValueError("message_type mancante")
+    try:
+        message_type = MessageType(message_type)
+    except ValueError:
+        raise ValueError(f"message_type non valido: '{message_type}'")
+
+    # Messaggio originale da copiare all'invio (obbligatorio per il tipo copy)
+    source_chat_id = _int(record, 'source_chat_id')
+    source_message_id = _int(record, 'source_message_id')
+    if (source_chat_id is None) != (source_message_id is None):
+        raise ValueError("source_chat_id e source_message_id vanno indicati insieme")
+
+    text = _text(record, 'text')
+    media = _value(record, 'media')
+    caption = _text(record, 'caption')
+    if message_type == MessageType.COPY:
+        if source_message_id is None:
+            raise ValueError("source_chat_id e source_message_id mancanti per un messaggio di tipo copy")
+        if text or media:
+            raise ValueError("text e media non sono ammessi per un messaggio di tipo copy")
+    elif message_type == MessageType.TEXT:
+        if not text:
+            raise ValueError("text mancante per un messaggio di testo")
+        if media or caption:
+            raise ValueError("media e caption non sono ammessi per un messaggio di testo")
+        if len(text) > MAX_MESSAGE_LENGTH:
+            raise ValueError(f"text supera i {MAX_MESSAGE_LENGTH} caratteri")
+    else:
+        if not media:
+            raise ValueError(f"media mancante per un messaggio di tipo {message_type.value}")
+        if text:
+            raise ValueError("text non è ammesso per un messaggio multimediale (usa caption)")
+        if caption and len(caption) > MAX_CAPTION_LENGTH:
+            raise ValueError(f"caption supera i {MAX_CAPTION_LENGTH} caratteri")
+
+    recurrence_type = _value(record, 'recurrence_type') or RecurrenceType.ONCE.value
+    try:
+        RecurrenceType(recurrence_type)
+    except ValueError:
+        raise ValueError(f"recurrence_type non valido: '{recurrence_type}'")
+
+    priority = _int(record, 'priority')
+    if priority is None:
+        priority = MessagePriority.NORMAL.value
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority non valida: {priority}")
+
+    send_time = _datetime(record, 'send_time')
+    anchor_time = _datetime(record, 'anchor_time')
+    schedule_hour = _int(record, 'schedule_hour')
+    schedule_minute = _int(record, 'schedule_minute')
+    recurrence_days = ''
+    cron_expression = None
+    interval_seconds = None
+    active = _bool(record, 'active', True)
+
+    if recurrence_type == RecurrenceType.ONCE.value:
+        if send_time is None:
+            raise ValueError("send_time mancante per un invio singolo")
+        if active and send_time <= now:
+            raise ValueError("send_time nel passato per un invio singolo attivo")
+    elif recurrence_type in (RecurrenceType.DAILY.value, RecurrenceType.WEEKLY.value):
+        if schedule_hour is None and send_time is not None:
+            schedule_hour, schedule_minute = send_time.hour, send_time.minute
+        if schedule_hour is None:
+            raise ValueError("schedule_hour mancante")
+        if recurrence_type == RecurrenceType.WEEKLY.value:
+            days = [day.strip().lower() for day in str(_value(record, 'recurrence_days') or '').split(',')]
+            days = [day for day in days if day]
+            invalid = [day for day in days if day not in WEEKDAY_CODES]
+            if invalid or not days:
+                raise ValueError(
+                    f"recurrence_days non valido: usa codici separati da virgola tra {','.join(WEEKDAY_CODES)}"
+                )
+            recurrence_days = ','.join(day for day in WEEKDAY_CODES if day in days)
+    elif recurrence_type == RecurrenceType.CRON.value:
+        cron_expression = _value(record, 'cron_expression')
+        if not cron_expression:
+            raise ValueError("cron_expression mancante")
+        try:
+            cron_expression = compile_cron(str(cron_expression)).expression
+        except ValueError as e:
+            raise ValueError(f"cron_expression non valida: {e}")
+    else:  # interval
+        interval_seconds = _int(record, 'interval_seconds')
+        if interval_seconds is None or interval_seconds < min_interval:
+            raise ValueError(f"interval_seconds mancante o inferiore a {min_interval}")
+        anchor_time = anchor_time or send_time
+        if anchor_time is None:
+            raise ValueError("anchor_time o send_time mancante per una ricorrenza a intervallo")
+    if recurrence_type != RecurrenceType.INTERVAL.value:
+        anchor_time = None
+
+    schedule_minute = schedule_minute or 0
+    if schedule_hour is not None and not (0 <= schedule_hour <= 23 and 0 <= schedule_minute <= 59):
+        raise ValueError("schedule_hour/schedule_minute fuori intervallo")
+
+    message_data = {
+        'chat_id': chat_id,
+        'message_type': message_type,
+        'text': text,
+        'media': media,
+        'caption': caption,
+        'pin': _bool(record, 'pin', False),
+        'active': active,
+        'recurrence_type': recurrence_type,
+        'recurrence_days': recurrence_days,
+        'schedule_hour': schedule_hour or 0,
+        'schedule_minute': schedule_minute,
+        'cron_expression': cron_expression,
+        'interval_seconds': interval_seconds,
+        'anchor_time': anchor_time,
+        'priority': priority,
+        'source_chat_id': source_chat_id,
+        'source_message_id': source_message_id
+    }
+
+    # Per i ricorrenti senza send_time il primo invio si calcola dalla ricorrenza
+    if send_time is None:
+        send_time = ScheduledMessage(
+            id=0, chat_id=chat_id, message_type=message_type.value, send_time=now,
+            **{key: message_data[key] for key in (
+                'recurrence_type', 'recurrence_days', 'schedule_hour', 'schedule_minute',
+                'cron_expression', 'interval_seconds', 'anchor_time'
+            )}
+        ).next_occurrence(now)
+        if send_time is None:
+            raise ValueError("la ricorrenza non ha invii futuri")
+    message_data['send_time'] = send_time
+    # Come nel flusso guidato, ora e minuto seguono il primo invio quando non sono indicati
+    if schedule_hour is None or recurrence_type == RecurrenceType.CRON.value:
+        message_data['schedule_hour'] = send_time.hour
+        message_data['schedule_minute'] = send_time.minute
+    return message_data
+
+
+def import_schedules(stream: IO[str], fmt: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                     min_interval: int = DEFAULT_MIN_INTERVAL,
+                     now: Optional[datetime] = None) -> ImportReport:
+    """Valida e inserisce le programmazioni del file a lotti di `chunk_size` righe.
+
+    Le righe non valide vengono saltate e riportate nel report; se il
+    database rifiuta un lotto vengono riportate solo le righe che non riesce
+    a inserire.
+    """
+    report = ImportReport()
+    now = now or datetime.now(pytz.UTC)
+    started = time.perf_counter()
+    chunk: List[dict] = []
+    chunk_lines: List[int] = []
+
+    def insert(rows: List[dict], lines: List[int]):
+        if DatabaseManager.import_scheduled_messages(rows):
+            report.imported += len(rows)
+        elif len(rows) == 1:
+            report.add_error(lines[0], "errore del database durante l'inserimento della riga")
+        else:
+            # Lotto rifiutato: lo si divide a metà finché restano le sole righe
+            # che il database non accetta, senza scartare quelle valide
+            half = len(rows) // 2
+            insert(rows[:half], lines[:half])
+            insert(rows[half:], lines[half:])
+
+    def flush():
+        insert(chunk, chunk_lines)
+        chunk.clear()
+        chunk_lines.clear()
+
+    for line, record, error in read_records(stream, fmt):
+        report.total += 1
+        if error is None:
+            try:
+                chunk.append(parse_record(record, now, min_interval))
+                chunk_lines.append(line)
+            except ValueError as e:
+                error = str(e)
+        if error is not None:
+            report.add_error(line, error)
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    report.elapsed = time.perf_counter() - started
+    logger.info(
+        f"Importazione completata: {report.imported}/{report.total} righe inserite, "
+        f"{report.failed} scartate in {report.elapsed:.2f}s"
+    )
+    return report
+
+
+def _export_record(message: ScheduledMessage) -> dict:
+    return {
+        'chat_id': message.chat_id,
+        'message_type': message.message_type.value,
+        'send_time': message.send_time.isoformat(),
+        'text': message.text,
+        'media': message.media,
+        'caption': message.caption,
+        'pin': bool(message.pin),
+        'active': bool(message.active),
+        'recurrence_type': message.recurrence_type,
+        'recurrence_days': message.recurrence_days or '',
+        'schedule_hour': message.schedule_hour,
+        'schedule_minute': message.schedule_minute,
+        'cron_expression': message.cron_expression,
+        'interval_seconds': message.interval_seconds,
+        'anchor_time': message.anchor_time.isoformat() if message.anchor_time else None,
+        'priority': message.priority,
+        'source_chat_id': message.source_chat_id,
+        'source_message_id': message.source_message_id
+    }
+
+
+def export_schedules(stream: IO[str], fmt: str) -> int:
+    """Scrive tutte le programmazioni leggendole dal cursore; restituisce quante."""
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+        for message in DatabaseManager.iter_scheduled_messages():
+            record = _export_record(message)
+            record['pin'] = int(record['pin'])
+            record['active'] = int(record['active'])
+            writer.writerow(record)
+            count += 1
+    else:
+        for message in DatabaseManager.iter_scheduled_messages():
+            stream.write(json.dumps(_export_record(message), ensure_ascii=False) + '\n')
+            count += 1
+    logger.info(f"Esportate {count} programmazioni in formato {fmt}")
+    return count
+
+
+def import_file(path: Path, fmt: Optional[str] = None, **kwargs) -> ImportReport:
+    """Importa un file dal disco; il formato si ricava dall'estensione se non indicato."""
+    fmt = fmt or detect_format(str(path))
+    # utf-8-sig accetta anche i CSV salvati da Excel con il BOM
+    with open(path, newline='', encoding='utf-8-sig') as stream:
+        return import_schedules(stream, fmt, **kwargs)
+
+
+def export_file(path: Path, fmt: Optional[str] = None) -> int:
+    """Esporta tutte le programmazioni in un file sul disco."""
+    fmt = fmt or detect_format(str(path))
+    with open(path, 'w', newline='', encoding='utf-8') as stream:
+        return export_schedules(stream, fmt)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m schedule_io',
+        description="Importa o esporta le programmazioni in CSV o JSONL."
+    )
+    parser.add_argument('action', choices=['import', 'export'])
+    parser.add_argument('path', type=Path)
+    parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                        help="formato del file (predefinito: dall'estensione)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="righe per transazione durante l'importazione")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    DatabaseManager.init_db()
+
+    try:
+        if args.action == 'export':
+            started = time.perf_counter()
+            count = export_file(args.path, args.format)
+            print(f"Esportate {count} programmazioni in {time.perf_counter() - started:.2f}s")
+            return 0
+
+        report = import_file(args.path, args.format, chunk_size=args.chunk_size)
+    except (OSError, ValueError) as e:
+        print(f"Errore: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Righe lette: {report.total}")
+    print(f"Inserite: {report.imported}")
+    print(f"Scartate: {report.failed}")
+    print(f"Tempo: {report.elapsed:.2f}s")
+    for line, error in report.errors:
+        print(f"  riga {line}: {error}", file=sys.stderr)
+    if report.failed > len(report.errors):
+        print(f"  ... e altri {report.failed - len(report.errors)} errori", file=sys.stderr)
+    return 0 if not report.failed else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
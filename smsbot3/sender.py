@@ -0,0 +1,111 @@
+import logging
+from typing import Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from database.models import MessageType
+
+logger = logging.getLogger(__name__)
+
+
+# Tipo di contenuto -> (metodo del bot, parametro con testo o file_id) per
+# l'invio del contenuto salvato; COPY non ha equivalente e si invia solo come copia
+SEND_METHODS = {
+    MessageType.TEXT: ('send_message', 'text'),
+    MessageType.PHOTO: ('send_photo', 'photo'),
+    MessageType.VIDEO: ('send_video', 'video'),
+    MessageType.DOCUMENT: ('send_document', 'document'),
+    MessageType.AUDIO: ('send_audio', 'audio'),
+    MessageType.VOICE: ('send_voice', 'voice'),
+    MessageType.ANIMATION: ('send_animation', 'animation'),
+    MessageType.STICKER: ('send_sticker', 'sticker'),
+    MessageType.VIDEO_NOTE: ('send_video_note', 'video_note'),
+}
+
+# Tipi che Telegram invia senza didascalia
+CAPTIONLESS_TYPES = {MessageType.TEXT, MessageType.STICKER, MessageType.VIDEO_NOTE}
+
+
+def extract_content(message: Message, keep_source: bool = True) -> Optional[dict]:
+    """Contenuto di un messaggio ricevuto, nel formato di ScheduledMessage.content().
+
+    Con `keep_source` vengono salvati anche chat e ID del messaggio, così
+    l'invio può copiarlo conservando formattazione ed entità. Restituisce
+    None se il tipo non è supportato (i tipi COPY richiedono `keep_source`).
+    """
+    if message.text:
+        message_type, media = MessageType.TEXT, None
+    elif message.photo:
+        message_type, media = MessageType.PHOTO, message.photo[-1].file_id
+    # Le GIF hanno anche il campo document: animation va controllato prima
+    elif message.animation:
+        message_type, media = MessageType.ANIMATION, message.animation.file_id
+    elif message.video:
+        message_type, media = MessageType.VIDEO, message.video.file_id
+    elif message.document:
+        message_type, media = MessageType.DOCUMENT, message.document.file_id
+    elif message.audio:
+        message_type, media = MessageType.AUDIO, message.audio.file_id
+    elif message.voice:
+        message_type, media = MessageType.VOICE, message.voice.file_id
+    elif message.sticker:
+        message_type, media = MessageType.STICKER, message.sticker.file_id
+    elif message.video_note:
+        message_type, media = MessageType.VIDEO_NOTE, message.video_note.file_id
+    elif keep_source:
+        message_type, media = MessageType.COPY, None
+    else:
+        return None
+
+    return {
+        'message_type': message_type,
+        'text': message.text,
+        'media': media,
+        'caption': None if message_type in CAPTIONLESS_TYPES else message.caption,
+        'source_chat_id': message.chat.id if keep_source else None,
+        'source_message_id': message.message_id if keep_source else None
+    }
+
+
+async def send_stored_content(bot: Bot, chat_id: int, content: dict):
+    """Invia il contenuto salvato con il metodo del bot adatto al tipo."""
+    message_type = content['message_type']
+    if message_type not in SEND_METHODS:
+        raise ValueError(f"Il contenuto di tipo {message_type.value} è inviabile solo come copia")
+
+    method, field = SEND_METHODS[message_type]
+    kwargs = {field: content['text'] if message_type == MessageType.TEXT else content['media']}
+    if message_type not in CAPTIONLESS_TYPES:
+        kwargs['caption'] = content.get('caption')
+    return await getattr(bot, method)(chat_id=chat_id, **kwargs)
+
+
+async def send_content(bot: Bot, chat_id: int, content: dict,
+                       on_source_lost: Optional[Callable[[], None]] = None):
+    """Invia un contenuto: copia dell'originale se disponibile, altrimenti quello salvato.
+
+    Se la copia non riesce (originale eliminato o non copiabile) e c'è un
+    contenuto salvato, invia quello e chiama `on_source_lost`, così i
+    prossimi invii non riprovano la copia. Restituisce il messaggio inviato
+    (o il MessageId della copia): in entrambi i casi ha `message_id`.
+    """
+    if content.get('source_message_id') is None:
+        return await send_stored_content(bot, chat_id, content)
+
+    try:
+        return await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=content['source_chat_id'],
+            message_id=content['source_message_id']
+        )
+    except TelegramBadRequest as e:
+        if content['message_type'] not in SEND_METHODS:
+            raise
+        logger.warning(f"Copia del messaggio originale non riuscita ({e}), invio del contenuto salvato")
+
+    sent_message = await send_stored_content(bot, chat_id, content)
+    if on_source_lost is not None:
+        on_source_lost()
+    return sent_message
@@ -0,0 +1,274 @@
+"""Simulazione dello scheduler con orologio virtuale.
+
+Esegue lo scheduler vero (claim, coda a priorità, rate limit, ricorrenze)
+su un database temporaneo e con un bot finto che registra ogni invio invece
+di contattare Telegram. Il tempo è quello di un VirtualClock: le attese
+dello scheduler lo fanno avanzare all'istante, così mesi di programmazione
+scorrono senza attese reali e il tempo di esecuzione misura solo il lavoro
+dello scheduler e del database. Alla fine gli invii di ogni messaggio
+vengono confrontati con quelli attesi dalla sua ricorrenza.
+
+Uso (dalla cartella smsbot3):
+    python -m simulation --schedules 1000 --days 30
+    python -m simulation --schedules 50000 --days 7 --output invii.csv
+"""
+import argparse
+import asyncio
+import csv
+import logging
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, TextIO
+
+import pytz
+
+from clock import VirtualClock
+from instrumentation import PhaseStats, SchedulerInstrumentation
+from database.database import DatabaseManager
+from database.models import MessagePriority, MessageType, RecurrenceType, ScheduledMessage, WEEKDAY_CODES
+
+# Espressioni cron usate per le programmazioni generate
+CRON_PATTERNS = [
+    "{m} {h} * * 1-5",
+    "{m} {h} * * mon#1",
+    "{m} {h} L * *",
+    "{m} {h} 1,15 * *",
+    "*/30 {h}-{h2} * * *",
+]
+
+# Quota di ogni tipo di ricorrenza tra le programmazioni generate
+RECURRENCE_WEIGHTS = {
+    RecurrenceType.DAILY.value: 40,
+    RecurrenceType.WEEKLY.value: 25,
+    RecurrenceType.CRON.value: 15,
+    RecurrenceType.INTERVAL.value: 10,
+    RecurrenceType.ONCE.value: 10,
+}
+
+SIMULATED_CHATS = 100
+IMPORT_CHUNK_SIZE = 1000
+
+
+class SimulationBot:
+    """Bot finto: registra gli invii con l'ora virtuale e risponde subito."""
+
+    class SentMessage:
+        def __init__(self, message_id: int):
+            self.message_id = message_id
+
+    def __init__(self, clock: VirtualClock, output: Optional[TextIO] = None):
+        self.clock = clock
+        self.calls = Counter()
+        self.sent = 0
+        self._writer = csv.writer(output) if output is not None else None
+        if self._writer is not None:
+            self._writer.writerow(['time', 'method', 'chat_id', 'content'])
+
+    def __getattr__(self, name: str):
+        if not (name.startswith('send_') or name in ('copy_message', 'pin_chat_message')):
+            raise AttributeError(name)
+
+        async def call(chat_id: int, **kwargs):
+            self.calls[name] += 1
+            if name != 'pin_chat_message':
+                self.sent += 1
+            if self._writer is not None:
+                content = next((value for key, value in kwargs.items() if key != 'caption'), '')
+                self._writer.writerow([self.clock.now().isoformat(), name, chat_id, content])
+            return self.SentMessage(self.sent)
+        return call
+
+
+class SimulationReport:
+    """Esito della simulazione: invii, tempi e differenze rispetto all'atteso."""
+
+    def __init__(self, schedules: int, start: datetime, until: datetime):
+        self.schedules = schedules
+        self.start = start
+        self.until = until
+        self.sends = 0
+        self.calls = Counter()
+        self.expected = 0
+        self.mismatches: List[tuple] = []
+        self.max_delay = 0.0
+        self.elapsed = 0.0
+        self.phases: Optional[PhaseStats] = None
+
+    def lines(self) -> List[str]:
+        days = (self.until - self.start).total_seconds() / 86400
+        rate = self.sends / self.elapsed if self.elapsed else 0.0
+        lines = [
+            f"Programmazioni: {self.schedules}",
+            f"Periodo virtuale: {self.start:%Y-%m-%d %H:%M} - {self.until:%Y-%m-%d %H:%M} UTC ({days:.0f} giorni)",
+            f"Invii: {self.sends} (attesi {self.expected})",
+            "Chiamate al bot: " + ', '.join(f"{name} {count}" for name, count in sorted(self.calls.items())),
+            f"Ritardo massimo rispetto all'orario previsto: {self.max_delay:.0f}s",
+            f"Tempo reale: {self.elapsed:.2f}s ({rate:.0f} invii/s)",
+            f"Messaggi con invii diversi dall'atteso: {len(self.mismatches)}",
+        ]
+        lines.extend(
+            f"  ID {message_id}: {actual} invii, attesi {expected}"
+            for message_id, actual, expected in self.mismatches[:20]
+        )
+        if self.phases is not None:
+            lines.append("Tempo reale per fase dello scheduler:")
+            lines.extend(f"  {line}" for line in self.phases.summary_lines())
+        return lines
+
+
+def build_schedules(count: int, start: datetime, until: datetime, seed: int = 42) -> List[dict]:
+    """Genera `count` programmazioni di testo con ricorrenze miste (forma di message_data)."""
+    rnd = random.Random(seed)
+    kinds, weights = zip(*RECURRENCE_WEIGHTS.items())
+    rows = []
+    for index in range(count):
+        recurrence_type = rnd.choices(kinds, weights)[0]
+        hour, minute = rnd.randrange(0, 22), rnd.randrange(0, 60)
+        row = {
+            'chat_id': -1000 - rnd.randrange(SIMULATED_CHATS),
+            'message_type': MessageType.TEXT,
+            'text': f"Messaggio simulato {index + 1}",
+            'pin': rnd.random() < 0.1,
+            'active': True,
+            'recurrence_type': recurrence_type,
+            'recurrence_days': '',
+            'schedule_hour': hour,
+            'schedule_minute': minute,
+            'cron_expression': None,
+            'interval_seconds': None,
+            'anchor_time': None,
+            'priority': rnd.choice([priority.value for priority in MessagePriority]),
+        }
+        if recurrence_type == RecurrenceType.WEEKLY.value:
+            row['recurrence_days'] = ','.join(sorted(rnd.sample(WEEKDAY_CODES, rnd.randint(1, 3)),
+                                                     key=WEEKDAY_CODES.index))
+        elif recurrence_type == RecurrenceType.CRON.value:
+            row['cron_expression'] = rnd.choice(CRON_PATTERNS).format(m=minute, h=hour, h2=hour + 2)
+        elif recurrence_type == RecurrenceType.INTERVAL.value:
+            row['interval_seconds'] = rnd.choice([3600, 4 * 3600, 6 * 3600, 12 * 3600])
+            row['anchor_time'] = start + timedelta(seconds=rnd.randrange(3600))
+
+        if recurrence_type == RecurrenceType.ONCE.value:
+            offset = rnd.uniform(0, (until - start).total_seconds())
+            row['send_time'] = (start + timedelta(seconds=offset)).replace(microsecond=0)
+        else:
+            row['send_time'] = ScheduledMessage(
+                id=0, chat_id=row['chat_id'], message_type=row['message_type'].value, send_time=start,
+                **{key: row[key] for key in (
+                    'recurrence_type', 'recurrence_days', 'schedule_hour', 'schedule_minute',
+                    'cron_expression', 'interval_seconds', 'anchor_time'
+                )}
+            ).next_occurrence(start)
+        rows.append(row)
+    return rows
+
+
+def expected_sends(message: ScheduledMessage, until: datetime) -> int:
+    """Invii attesi prima di `until` (escluso): send_time e le occorrenze successive.
+
+    Allo scadere del tempo virtuale lo scheduler si ferma senza servire
+    le occorrenze che cadono esattamente in `until`.
+    """
+    if message.send_time >= until:
+        return 0
+    return 1 + sum(1 for fire_time in message.occurrences(message.send_time, until) if fire_time < until)
+
+
+async def run_simulation(schedules: List[dict], start: datetime, until: datetime,
+                         output: Optional[TextIO] = None) -> SimulationReport:
+    """Esegue lo scheduler sul database corrente da `start` a `until` (escluso) in tempo virtuale."""
+    import main
+    from delivery_log import DeliveryLogWriter
+
+    report = SimulationReport(len(schedules), start, until)
+    for offset in range(0, len(schedules), IMPORT_CHUNK_SIZE):
+        DatabaseManager.import_scheduled_messages(schedules[offset:offset + IMPORT_CHUNK_SIZE])
+    expected = {
+        message.id: expected_sends(message, until)
+        for message in DatabaseManager.iter_scheduled_messages()
+    }
+    report.expected = sum(expected.values())
+
+    clock = VirtualClock(start, until)
+    bot = SimulationBot(clock, output)
+    main.clock = clock
+    main.bot = bot
+    main.delivery_log = DeliveryLogWriter(batch_size=1000, clock=clock)
+    main.draining = asyncio.Event()
+    report.phases = PhaseStats()
+    main.instrumentation = SchedulerInstrumentation([report.phases])
+
+    started = time.perf_counter()
+    scheduler_task = asyncio.create_task(main.scheduler())
+    await clock.expired.wait()
+    main.draining.set()
+    await scheduler_task
+    main.delivery_log.flush()
+    report.elapsed = time.perf_counter() - started
+
+    report.sends = bot.sent
+    report.calls = bot.calls
+    delivered = DatabaseManager.get_delivery_summary()
+    for message_id, count in sorted(expected.items()):
+        actual, delay = delivered.get(message_id, (0, 0.0))
+        report.max_delay = max(report.max_delay, delay)
+        if actual != count:
+            report.mismatches.append((message_id, actual, count))
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m simulation',
+        description="Simula lo scheduler in tempo virtuale con un bot finto."
+    )
+    parser.add_argument('--schedules', type=int, default=1000,
+                        help="numero di programmazioni generate")
+    parser.add_argument('--days', type=float, default=30,
+                        help="durata simulata in giorni")
+    parser.add_argument('--start', type=datetime.fromisoformat,
+                        help="inizio della simulazione in ISO 8601 (predefinito: adesso, UTC)")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="seme per la generazione delle programmazioni")
+    parser.add_argument('--db', type=Path,
+                        help="database da usare (predefinito: un file temporaneo)")
+    parser.add_argument('--output', type=Path,
+                        help="file CSV con tutti gli invii simulati")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    start = args.start or datetime.now(pytz.UTC).replace(second=0, microsecond=0)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=pytz.UTC)
+    until = start + timedelta(days=args.days)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        DatabaseManager.DB_PATH = args.db or Path(tmp_dir) / 'simulation.db'
+        # Il database della simulazione è usa e getta: niente fsync a ogni commit
+        DatabaseManager.SYNCHRONOUS = 'OFF'
+        # Scheduler e simulazione girano nello stesso thread: basta una connessione
+        DatabaseManager.SHARED_CONNECTION = True
+        DatabaseManager.init_db()
+        # Il log del bot riporterebbe ogni giro dello scheduler
+        logging.getLogger().setLevel(logging.WARNING)
+
+        output = open(args.output, 'w', newline='', encoding='utf-8') if args.output else None
+        try:
+            schedules = build_schedules(args.schedules, start, until, args.seed)
+            report = asyncio.run(run_simulation(schedules, start, until, output))
+        finally:
+            DatabaseManager.close_shared_connection()
+            if output is not None:
+                output.close()
+
+    print('\n'.join(report.lines()))
+    return 0 if not report.mismatches else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
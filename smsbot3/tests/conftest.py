@@ -0,0 +1,47 @@
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+import pytz
+
+# I moduli del bot si importano dalla cartella smsbot3, come fa main.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database.database import DatabaseManager
+from database.models import MessageType
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """DatabaseManager su un database temporaneo appena inizializzato."""
+    monkeypatch.setattr(DatabaseManager, 'DB_PATH', tmp_path / 'messages.db')
+    DatabaseManager.init_db()
+    return DatabaseManager
+
+
+@pytest.fixture
+def now():
+    return datetime(2026, 3, 2, 12, 0, tzinfo=pytz.UTC)
+
+
+@pytest.fixture
+def add_message(db, now):
+    """Aggiunge un messaggio di testo; i parametri sovrascrivono i valori predefiniti."""
+    def add(**overrides) -> int:
+        send_time = overrides.get('send_time', now - timedelta(minutes=1))
+        data = {
+            'chat_id': -100,
+            'message_type': MessageType.TEXT,
+            'text': 'Messaggio di prova',
+            'send_time': send_time,
+            'pin': False,
+            'active': True,
+            'recurrence_type': 'once',
+            'recurrence_days': '',
+            'schedule_hour': send_time.hour,
+            'schedule_minute': send_time.minute,
+        }
+        data.update(overrides)
+        return db.add_scheduled_message(data)
+    return add
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.mark.parametrize('filters, where, params', [
+    ({}, "1", []),
+    ({'chat_id': -100}, "chat_id = ?", [-100]),
+    ({'recurrence_type': 'daily', 'active': False}, "recurrence_type = ? AND active = ?", ['daily', 0]),
+    ({'chat_id': -100, 'recurrence_type': 'once', 'active': True},
+     "chat_id = ? AND recurrence_type = ? AND active = ?", [-100, 'once', 1]),
+])
+def test_build_filters(db, filters, where, params):
+    assert db._build_filters(**filters) == (where, params)
+
+
+@pytest.fixture
+def messages(db, add_message, now):
+    """Due chat, messaggi singoli e giornalieri, uno già sospeso."""
+    later = now + timedelta(hours=1)
+    ids = {
+        'a_once': add_message(chat_id=-100, send_time=later),
+        'a_daily': add_message(chat_id=-100, recurrence_type='daily', send_time=later),
+        'a_daily_paused': add_message(chat_id=-100, recurrence_type='daily', send_time=later),
+        'b_once': add_message(chat_id=-200, send_time=later),
+        'b_daily': add_message(chat_id=-200, recurrence_type='daily', send_time=later),
+    }
+    db.toggle_message(ids['a_daily_paused'])
+    return ids
+
+
+def active_ids(db):
+    return {message.id for message in db.get_filtered_messages() if message.active}
+
+
+@pytest.mark.parametrize('filters, expected', [
+    ({}, 5),
+    ({'chat_id': -100}, 3),
+    ({'recurrence_type': 'daily'}, 3),
+    ({'active': False}, 1),
+    ({'chat_id': -100, 'recurrence_type': 'daily', 'active': True}, 1),
+    ({'chat_id': -300}, 0),
+])
+def test_count_messages(db, messages, filters, expected):
+    assert db.count_messages(**filters) == expected
+
+
+def test_bulk_pause_and_resume_touch_only_rows_to_change(db, messages):
+    # Il conteggio mostrato nella conferma corrisponde alle righe modificate
+    expected = db.count_messages(chat_id=-100, active=True)
+    assert db.bulk_set_active(False, chat_id=-100) == expected == 2
+    assert active_ids(db) == {messages['b_once'], messages['b_daily']}
+    assert db.bulk_set_active(False, chat_id=-100) == 0
+
+    expected = db.count_messages(recurrence_type='daily', active=False)
+    assert db.bulk_set_active(True, recurrence_type='daily') == expected == 2
+    assert active_ids(db) == {messages['a_daily'], messages['a_daily_paused'],
+                              messages['b_once'], messages['b_daily']}
+
+
+def test_bulk_delete(db, messages):
+    expected = db.count_messages(chat_id=-200, recurrence_type='once')
+    assert db.bulk_delete(chat_id=-200, recurrence_type='once') == expected == 1
+    assert db.get_message_by_id(messages['b_once']) is None
+
+    expected = db.count_messages(active=False)
+    assert db.bulk_delete(active=False) == expected == 1
+    assert db.get_message_by_id(messages['a_daily_paused']) is None
+
+    assert db.bulk_delete() == 3
+    assert db.count_messages() == 0
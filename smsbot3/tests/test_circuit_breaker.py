@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from circuit_breaker import ChatCircuitBreaker
+
+CHAT = -100
+WORKER = 'test-worker'
+LEASE = timedelta(minutes=5)
+
+
+def breaker(db):
+    circuits = ChatCircuitBreaker(failure_threshold=3, probe_base=300, probe_max=1200,
+                                  probe_hold=timedelta(minutes=2))
+    circuits.refresh()
+    return circuits
+
+
+def test_opens_after_consecutive_failures(db, now):
+    circuits = breaker(db)
+    assert not circuits.record_failure(CHAT, 'chat not found', now)
+    assert not circuits.record_failure(CHAT, 'chat not found', now)
+    assert circuits.allow(CHAT, now) == (True, None)
+
+    assert circuits.record_failure(CHAT, 'chat not found', now)
+    assert db.get_chat_circuits() == {CHAT: ('open', now + timedelta(seconds=300))}
+    assert circuits.allow(CHAT, now) == (False, now + timedelta(seconds=300))
+    # Le altre chat non sono toccate
+    assert circuits.allow(-200, now) == (True, None)
+
+
+def test_single_probe_doubles_backoff_and_success_closes(db, now):
+    circuits = breaker(db)
+    for _ in range(3):
+        circuits.record_failure(CHAT, 'chat not found', now)
+
+    # Al prossimo probe un solo worker lo prende; gli altri aspettano il lease del probe
+    probe_time = now + timedelta(seconds=300)
+    other = breaker(db)
+    assert circuits.allow(CHAT, probe_time) == (True, None)
+    assert other.allow(CHAT, probe_time) == (False, probe_time + timedelta(minutes=2))
+
+    # Probe fallito: attesa raddoppiata fino al massimo
+    assert not circuits.record_failure(CHAT, 'chat not found', probe_time)
+    assert db.get_chat_circuits()[CHAT] == ('open', probe_time + timedelta(seconds=600))
+    circuits.record_failure(CHAT, 'chat not found', probe_time)
+    circuits.record_failure(CHAT, 'chat not found', probe_time)
+    assert db.get_chat_circuits()[CHAT] == ('open', probe_time + timedelta(seconds=1200))
+
+    # Probe riuscito: il circuito si chiude e gli errori ripartono da zero
+    assert circuits.record_success(CHAT)
+    assert db.get_chat_circuits() == {}
+    other.refresh()
+    assert other.allow(CHAT, probe_time) == (True, None)
+    assert not other.record_failure(CHAT, 'chat not found', probe_time)
+
+
+def test_success_resets_failures_below_threshold(db, now):
+    circuits = breaker(db)
+    assert not circuits.record_success(CHAT)
+    circuits.record_failure(CHAT, 'chat not found', now)
+    assert not circuits.record_success(CHAT)
+    assert db.get_chat_circuits() == {}
+
+
+def test_claims_skip_chats_with_open_circuit_until_probe(db, add_message, now):
+    blocked = add_message(chat_id=CHAT)
+    healthy = add_message(chat_id=-200)
+    db.expand_occurrences(now, timedelta(days=1))
+    db.record_chat_failure(CHAT, 'chat not found', now, threshold=1, probe_base=300, probe_max=1200)
+
+    claimed = db.claim_due_occurrences(WORKER, now, LEASE)
+    assert [message.id for message, _ in claimed] == [healthy]
+
+    # All'ora del probe l'occorrenza della chat torna disponibile
+    claimed = db.claim_due_occurrences(WORKER, now + timedelta(seconds=300), LEASE)
+    assert [message.id for message, _ in claimed] == [blocked]
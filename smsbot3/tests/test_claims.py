@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from benchmarks import claim_workers
+
+LEASE = timedelta(minutes=5)
+
+
+def test_claims_are_exclusive_until_the_lease_expires(db, add_message, now):
+    for _ in range(3):
+        add_message()
+    db.expand_occurrences(now, timedelta(days=1))
+
+    first = db.claim_due_occurrences('worker-1', now, LEASE, limit=2)
+    second = db.claim_due_occurrences('worker-2', now, LEASE)
+    assert len(first) == 2 and len(second) == 1
+    assert not {m.id for m, _ in first} & {m.id for m, _ in second}
+    assert db.claim_due_occurrences('worker-3', now + LEASE - timedelta(seconds=1), LEASE) == []
+
+    # Lease scaduto (worker caduto): un altro worker riprende le occorrenze
+    taken_over = db.claim_due_occurrences('worker-3', now + LEASE + timedelta(seconds=1), LEASE)
+    assert len(taken_over) == 3
+    message, scheduled_time = first[0]
+    assert not db.renew_lease('worker-1', message.id, scheduled_time, now + 2 * LEASE)
+    assert not db.complete_occurrence(message.id, scheduled_time, 'worker-1')
+
+
+def test_worker_processes_never_send_twice(capsys):
+    assert claim_workers.main(['--workers', '3', '--messages', '300', '--lease', '1', '--crash']) == 0
+    assert "Invii doppi: 0, occorrenze non inviate: 0" in capsys.readouterr().out
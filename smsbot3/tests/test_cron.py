@@ -0,0 +1,85 @@
+import calendar
+import random
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from database.cron import CronError, CronExpression
+
+EXPRESSIONS = [
+    "0 9 * * *",
+    "30 8 * * 1-5",
+    "0 8,17 * * mon-fri",
+    "0 9 * * mon#1",
+    "15 18 * * friL",
+    "45 23 L * *",
+    "0 12 1,15 * *",
+    "*/15 9-11 * * *",
+    "0 10 * jan,apr,jul,oct sun#2",
+    "0 9 1,15 * mon",
+    "5 4 * * 0",
+    "5 4 * * 7",
+]
+
+
+def matches(cron: CronExpression, moment: datetime) -> bool:
+    days_in_month = calendar.monthrange(moment.year, moment.month)[1]
+    return (
+        bool(cron.minutes >> moment.minute & 1)
+        and bool(cron.hours >> moment.hour & 1)
+        and bool(cron.months >> moment.month & 1)
+        and cron._day_matches(moment.day, moment.weekday(), days_in_month)
+    )
+
+
+def brute_force_next(cron: CronExpression, after: datetime, limit: timedelta) -> datetime:
+    moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    while moment - after <= limit:
+        if matches(cron, moment):
+            return moment
+        moment += timedelta(minutes=1)
+    raise AssertionError(f"nessun invio per {cron.expression} entro {limit}")
+
+
+@pytest.mark.parametrize('expression, after, expected', [
+    ("0 9 * * mon#1", datetime(2026, 3, 2, 12, 0), datetime(2026, 4, 6, 9, 0)),
+    ("30 18 L * *", datetime(2026, 2, 10, 0, 0), datetime(2026, 2, 28, 18, 30)),
+    ("0 12 * * friL", datetime(2026, 3, 2, 12, 0), datetime(2026, 3, 27, 12, 0)),
+    ("0 0 29 2 *", datetime(2026, 3, 1, 0, 0), datetime(2028, 2, 29, 0, 0)),
+    ("*/15 9-10 * * *", datetime(2026, 3, 2, 10, 50), datetime(2026, 3, 3, 9, 0)),
+    # Giorno del mese e della settimana entrambi ristretti: basta uno dei due
+    ("0 9 1,15 * mon", datetime(2026, 3, 2, 12, 0), datetime(2026, 3, 9, 9, 0)),
+    # Strettamente successivo, anche con secondi
+    ("0 9 * * *", datetime(2026, 3, 2, 9, 0, 30), datetime(2026, 3, 3, 9, 0)),
+])
+def test_next_after_known_dates(expression, after, expected):
+    cron = CronExpression(expression)
+    assert cron.next_after(pytz.UTC.localize(after)) == pytz.UTC.localize(expected)
+
+
+@pytest.mark.parametrize('expression', EXPRESSIONS)
+def test_next_after_matches_minute_by_minute_search(expression):
+    cron = CronExpression(expression)
+    rnd = random.Random(expression)
+    start = datetime(2026, 1, 1, tzinfo=pytz.UTC)
+    for _ in range(10):
+        after = start + timedelta(minutes=rnd.randrange(366 * 24 * 60), seconds=rnd.randrange(60))
+        assert cron.next_after(after) == brute_force_next(cron, after, timedelta(days=120))
+
+
+def test_expression_that_never_fires():
+    assert CronExpression("0 0 30 2 *").next_after(datetime(2026, 1, 1, tzinfo=pytz.UTC)) is None
+
+
+@pytest.mark.parametrize('expression', [
+    "* * *",
+    "61 * * * *",
+    "*/0 * * * *",
+    "0 0 * * mon#6",
+    "0 0 5-1 * *",
+    "0 0 * foo *",
+])
+def test_invalid_expressions(expression):
+    with pytest.raises(CronError):
+        CronExpression(expression)
@@ -0,0 +1,64 @@
+import sqlite3
+from datetime import timedelta
+
+WORKER = 'test-worker'
+LEASE = timedelta(minutes=5)
+
+
+def statuses(db, message_id):
+    with sqlite3.connect(db.DB_PATH) as conn:
+        return dict(conn.execute(
+            "SELECT scheduled_time, status FROM message_occurrences WHERE message_id = ?", (message_id,)
+        ))
+
+
+def dead_letter_due(db, now):
+    (message, scheduled_time), = db.claim_due_occurrences(WORKER, now, LEASE)
+    db.dead_letter_occurrence(message.id, scheduled_time, message.chat_id, 'permanent', 'chat not found', now)
+    return message.id, scheduled_time
+
+
+def test_dead_letter_drops_other_past_due_occurrences(db, add_message, now):
+    # Tre occorrenze orarie arretrate e una futura
+    message_id = add_message(recurrence_type='interval', interval_seconds=3600,
+                             anchor_time=now - timedelta(hours=3), send_time=now - timedelta(hours=3))
+    db.expand_occurrences(now - timedelta(hours=3), timedelta(hours=4))
+    times = sorted(statuses(db, message_id))
+    assert len(times) == 5
+
+    _, scheduled_time = dead_letter_due(db, now)
+
+    assert scheduled_time == times[3]
+    assert statuses(db, message_id) == {
+        times[0]: 'missed', times[1]: 'missed', times[2]: 'missed', times[3]: 'dead', times[4]: 'pending'
+    }
+    assert db.claim_due_occurrences(WORKER, now, LEASE) == []
+
+
+def test_requeue_resets_the_occurrence(db, add_message, now):
+    message_id = add_message()
+    db.expand_occurrences(now, timedelta(days=1))
+    _, scheduled_time = dead_letter_due(db, now)
+    db.mark_as_sent(message_id)
+    (dead_letter_id, *_), = db.get_dead_letters()
+
+    assert db.requeue_dead_letter(dead_letter_id)
+
+    assert db.get_dead_letters() == []
+    assert db.get_message_by_id(message_id).active
+    assert statuses(db, message_id) == {scheduled_time: 'pending'}
+
+
+def test_requeue_keeps_dead_letter_without_occurrence(db, add_message, now):
+    message_id = add_message()
+    db.expand_occurrences(now, timedelta(days=1))
+    dead_letter_due(db, now)
+    db.mark_as_sent(message_id)
+    with sqlite3.connect(db.DB_PATH) as conn:
+        conn.execute("DELETE FROM message_occurrences WHERE message_id = ?", (message_id,))
+    (dead_letter_id, *_), = db.get_dead_letters()
+
+    assert not db.requeue_dead_letter(dead_letter_id)
+
+    assert len(db.get_dead_letters()) == 1
+    assert not db.get_message_by_id(message_id).active
@@ -0,0 +1,29 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from clock import VirtualClock
+from fsm_storage import EVICTED, EXPIRED, ExpiringMemoryStorage
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_reports_why_an_active_conversation_was_dropped(now):
+    clock = VirtualClock(now)
+    storage = ExpiringMemoryStorage(ttl=60, max_entries=2, clock=clock)
+
+    async def scenario():
+        await storage.set_state(key(1), 'Flow:step')
+        clock.advance(30)
+        await storage.set_state(key(2), 'Flow:step')
+        await storage.set_state(key(3), 'Flow:step')
+        assert storage.pop_expired() == [(key(1), 'Flow:step', EVICTED)]
+
+        clock.advance(61)
+        assert storage.expire() == 2
+        assert storage.pop_expired() == [(key(2), 'Flow:step', EXPIRED), (key(3), 'Flow:step', EXPIRED)]
+        assert len(storage) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,16 @@
+from instrumentation import PhaseStats, SchedulerInstrumentation
+
+
+def test_phase_stats_prometheus():
+    stats = PhaseStats()
+    instrumentation = SchedulerInstrumentation([stats])
+    with instrumentation.tick():
+        with instrumentation.phase('expand'):
+            pass
+        with instrumentation.phase('expand'):
+            pass
+
+    text = stats.prometheus()
+    assert "smsbot_scheduler_tick_seconds_count 1" in text
+    assert 'smsbot_scheduler_phase_seconds_count{phase="expand"} 2' in text
+
@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+from database.database import DatabaseManager
+from database.migrations import MIGRATIONS, MigrationRunner
+
+# Schema di scheduled_messages prima delle migrazioni versionate
+BASELINE_SCHEMA = """
+    CREATE TABLE scheduled_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        message_type TEXT NOT NULL,
+        send_time TIMESTAMP NOT NULL,
+        text TEXT,
+        media TEXT,
+        caption TEXT,
+        pin BOOLEAN NOT NULL DEFAULT 0,
+        active BOOLEAN NOT NULL DEFAULT 1,
+        recurrence_type TEXT NOT NULL DEFAULT 'once',
+        recurrence_days TEXT DEFAULT '',
+        schedule_hour INTEGER DEFAULT 0,
+        schedule_minute INTEGER DEFAULT 0
+    )
+"""
+
+# send_time salvati dalle versioni precedenti -> valore normalizzato in UTC
+LEGACY_SEND_TIMES = [
+    ('2026-03-01T09:00:00', '2026-03-01T09:00:00+00:00'),
+    ('2026-03-01T09:00:00+01:00', '2026-03-01T08:00:00+00:00'),
+    ('2026-07-01 18:30:00-04:00', '2026-07-01T22:30:00+00:00'),
+    ('2026-03-01T09:00:00+00:00', '2026-03-01T09:00:00+00:00'),
+]
+
+
+@pytest.fixture
+def baseline_db(tmp_path, monkeypatch):
+    path = tmp_path / 'messages.db'
+    with sqlite3.connect(path) as conn:
+        conn.execute(BASELINE_SCHEMA)
+        conn.executemany("""
+            INSERT INTO scheduled_messages (chat_id, message_type, send_time, text, active)
+            VALUES (-100, 'text', ?, 'Messaggio', ?)
+        """, [(send_time, i % 2) for i, (send_time, _) in enumerate(LEGACY_SEND_TIMES)])
+    monkeypatch.setattr(DatabaseManager, 'DB_PATH', path)
+    return path
+
+
+def read_schema(path):
+    with sqlite3.connect(path) as conn:
+        return (
+            conn.execute("PRAGMA user_version").fetchone()[0],
+            [row[0] for row in conn.execute("SELECT send_time FROM scheduled_messages ORDER BY id")],
+            {row[1] for row in conn.execute("PRAGMA table_info(scheduled_messages)")},
+            {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")},
+            {row[0] for row in conn.execute("SELECT message_id FROM occurrence_horizon")},
+        )
+
+
+def test_upgrades_baseline_database_to_latest_version(baseline_db):
+    runner = MigrationRunner(baseline_db, batch_size=2, pause=0)
+    assert runner.current_version() == 0
+    assert [migration.version for migration in runner.pending()] == [1, 2, 3, 4, 5, 6]
+
+    DatabaseManager.init_db(runner)
+
+    version, send_times, columns, indexes, horizons = read_schema(baseline_db)
+    assert version == MIGRATIONS[-1].version == 6
+    assert send_times == [normalized for _, normalized in LEGACY_SEND_TIMES]
+    assert {'content_id', 'priority', 'source_chat_id', 'source_message_id'} <= columns
+    assert {'idx_scheduled_messages_chat_time', 'idx_message_occurrences_leased',
+            'idx_occurrence_horizon_until'} <= indexes
+    # Orizzonte '' (da espandere) per i soli messaggi attivi
+    assert horizons == {2, 4}
+    assert runner.pending() == []
+
+
+def test_rerunning_migrations_is_a_no_op(baseline_db):
+    DatabaseManager.init_db(MigrationRunner(baseline_db, pause=0))
+    before = read_schema(baseline_db)
+
+    runner = MigrationRunner(baseline_db, pause=0)
+    assert runner.pending() == []
+    assert runner.run() == 6
+    DatabaseManager.init_db(runner)
+    assert read_schema(baseline_db) == before
+
+
+def test_rewrite_in_batches_is_idempotent(baseline_db):
+    from database.migrations import _normalize_timestamp
+
+    runner = MigrationRunner(baseline_db, batch_size=3, pause=0)
+    with sqlite3.connect(baseline_db) as conn:
+        rewrite = lambda: runner.rewrite_in_batches(
+            conn, 'scheduled_messages', ('send_time',),
+            lambda values: tuple(_normalize_timestamp(value) for value in values)
+        )
+        assert rewrite() == 3
+        # Una migrazione interrotta riparte da capo senza riscrivere le righe già fatte
+        assert rewrite() == 0
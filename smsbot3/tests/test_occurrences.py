@@ -0,0 +1,88 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+WORKER = 'test-worker'
+LEASE = timedelta(minutes=5)
+HORIZON = timedelta(days=1)
+
+
+def reference_next_fire_time(db):
+    """La prossima esecuzione calcolata su tutte le occorrenze, senza indici."""
+    with sqlite3.connect(db.DB_PATH) as conn:
+        row = conn.execute("""
+            SELECT MIN(MAX(o.fire_time, COALESCE(o.lease_expires, ''), COALESCE(cc.next_probe_at, '')))
+            FROM message_occurrences o
+            JOIN scheduled_messages m ON m.id = o.message_id
+            LEFT JOIN chat_circuits cc ON cc.chat_id = m.chat_id AND cc.state = 'open'
+            WHERE o.status = 'pending' AND m.active = 1
+        """).fetchone()
+    return datetime.fromisoformat(row[0]) if row[0] else None
+
+
+def horizons(db):
+    with sqlite3.connect(db.DB_PATH) as conn:
+        return dict(conn.execute("SELECT message_id, expanded_until FROM occurrence_horizon"))
+
+
+def test_next_fire_time_matches_full_scan(db, add_message, now):
+    assert db.get_next_fire_time() is None
+
+    # In invio con lease, rimandata oltre il lease, in una chat con circuito aperto
+    leased = add_message(send_time=now - timedelta(minutes=3))
+    deferred = add_message(send_time=now - timedelta(minutes=2))
+    blocked = add_message(chat_id=-200, send_time=now - timedelta(minutes=1))
+    db.expand_occurrences(now, HORIZON)
+    claimed = {message.id: scheduled_time
+               for message, scheduled_time in db.claim_due_occurrences(WORKER, now, LEASE)}
+    db.defer_occurrence(WORKER, deferred, claimed[deferred], now + timedelta(minutes=30))
+    db.record_chat_failure(-200, 'chat not found', now, threshold=1, probe_base=3600, probe_max=3600)
+    assert db.get_next_fire_time() == reference_next_fire_time(db) == now + LEASE
+
+    later = add_message(send_time=now + timedelta(minutes=10))
+    db.expand_occurrences(now, HORIZON)
+    db.complete_occurrence(leased, claimed[leased], WORKER)
+    db.mark_as_sent(leased)
+    assert db.get_next_fire_time() == reference_next_fire_time(db) == now + timedelta(minutes=10)
+
+    db.toggle_message(later)
+    assert db.get_next_fire_time() == reference_next_fire_time(db) == now + timedelta(minutes=30)
+    db.toggle_message(deferred)
+    assert db.get_next_fire_time() == reference_next_fire_time(db) == now + timedelta(hours=1)
+
+
+def test_expands_only_new_changed_and_expiring_messages(db, add_message, now):
+    daily = add_message(recurrence_type='daily', send_time=now + timedelta(hours=1))
+    assert horizons(db) == {daily: ''}
+    assert db.get_next_expansion_time() < now
+
+    assert db.expand_occurrences(now, HORIZON) == 1
+    assert horizons(db) == {daily: (now + HORIZON).isoformat()}
+    assert db.get_next_expansion_time() == now + HORIZON
+    # Orizzonte ancora valido: nessun messaggio da rileggere
+    assert db.expand_occurrences(now, HORIZON, min_ahead=timedelta(hours=1)) == 0
+
+    paused = add_message(recurrence_type='daily', send_time=now + timedelta(hours=2))
+    db.toggle_message(paused)
+    assert paused not in horizons(db)
+    db.toggle_message(paused)
+    assert horizons(db)[paused] == ''
+    assert db.expand_occurrences(now, HORIZON, min_ahead=timedelta(hours=1)) == 1
+    assert horizons(db)[paused] == (now + HORIZON).isoformat()
+
+    # Un cambio di ricorrenza invalida l'orizzonte del solo messaggio modificato
+    with sqlite3.connect(db.DB_PATH) as conn:
+        conn.execute("UPDATE scheduled_messages SET schedule_hour = 18 WHERE id = ?", (daily,))
+    assert horizons(db) == {daily: '', paused: (now + HORIZON).isoformat()}
+    db.expand_occurrences(now, HORIZON, min_ahead=timedelta(hours=1))
+    assert horizons(db) == {daily: (now + HORIZON).isoformat(), paused: (now + HORIZON).isoformat()}
+
+
+def test_next_fire_time_index_is_recreated_by_init_db(db, add_message, now):
+    # Database rimasto a una versione precedente alla migrazione 6
+    with sqlite3.connect(db.DB_PATH) as conn:
+        conn.execute("DROP INDEX idx_message_occurrences_leased")
+    db.init_db()
+
+    add_message(send_time=now + timedelta(minutes=5))
+    db.expand_occurrences(now, HORIZON)
+    assert db.get_next_fire_time() == now + timedelta(minutes=5)
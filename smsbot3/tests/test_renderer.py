@@ -0,0 +1,33 @@
+from renderer import pack_entries, pack_keyed_entries
+
+
+def test_overflowing_entries_start_new_pages():
+    entries = [str(i) * 2500 for i in range(4)]
+
+    pages = pack_entries(entries, limit=4096)
+
+    assert pages == entries
+    assert not any('…' in page for page in pages)
+
+
+def test_header_and_footer_frame_the_pages():
+    pages = pack_entries(['a' * 30, 'b' * 30, 'c' * 30], header='H\n', footer='\nF', limit=70)
+
+    assert pages == ['H\n' + 'a' * 30 + 'b' * 30, 'c' * 30 + '\nF']
+    assert all(len(page) <= 70 for page in pages)
+
+
+def test_only_entries_longer_than_limit_are_cut():
+    pages = pack_entries(['line\n' * 20, 'short'], limit=50)
+
+    # La voce lunga è accorciata a fine riga, la successiva entra nello stesso messaggio
+    assert pages == ['line\n' * 8 + 'line…' + 'short']
+    assert len(pages[0]) <= 50
+
+
+def test_keys_follow_their_entries():
+    entries = [(i, f"{i}" * 40) for i in range(5)]
+
+    pages = pack_keyed_entries(entries, limit=100, max_entries=2)
+
+    assert [keys for _, keys in pages] == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,121 @@
+from datetime import timedelta
+
+WORKER = 'test-worker'
+LEASE = timedelta(minutes=5)
+
+
+def send_due(db, now):
+    """Invia come farebbe lo scheduler tutte le occorrenze scadute."""
+    db.expand_occurrences(now, timedelta(days=1))
+    for message, scheduled_time in db.claim_due_occurrences(WORKER, now, LEASE):
+        db.complete_occurrence(message.id, scheduled_time, WORKER)
+        db.mark_as_sent(message.id)
+
+
+def archived_ids(db):
+    import sqlite3
+    with sqlite3.connect(db.DB_PATH) as conn:
+        return {row[0] for row in conn.execute("SELECT id FROM scheduled_messages_archive")}
+
+
+def test_archives_only_sent_once_messages(db, add_message, now):
+    sent = add_message()
+    send_due(db, now)
+    # Sospeso prima dell'invio, con l'orario previsto ancora dentro la retention
+    paused_once = add_message(send_time=now + timedelta(days=90))
+    db.toggle_message(paused_once)
+    paused_daily = add_message(recurrence_type='daily', send_time=now + timedelta(hours=2))
+    db.toggle_message(paused_daily)
+
+    archived = db.archive_inactive_messages(now + timedelta(days=60), pause=0)
+
+    assert archived == 1
+    assert archived_ids(db) == {sent}
+    assert db.get_message_by_id(sent) is None
+    assert db.get_message_by_id(paused_once) is not None
+    assert db.get_message_by_id(paused_daily) is not None
+
+
+def test_archives_legacy_sent_message_without_occurrences(db, now):
+    import sqlite3
+    # Inviato prima delle occorrenze materializzate: disattivato, senza occorrenze
+    with sqlite3.connect(db.DB_PATH) as conn:
+        legacy, dead = (conn.execute("""
+            INSERT INTO scheduled_messages (chat_id, message_type, send_time, text, active)
+            VALUES (-100, 'text', ?, 'Vecchio avviso', 0)
+        """, ((now - timedelta(days=400)).isoformat(),)).lastrowid for _ in range(2))
+        conn.execute("""
+            INSERT INTO dead_letters (message_id, scheduled_time, chat_id, error_kind, attempts, created_at)
+            VALUES (?, ?, -100, 'permanent', 1, ?)
+        """, (dead, (now - timedelta(days=400)).isoformat(), now.isoformat()))
+
+    assert db.archive_inactive_messages(now - timedelta(days=30), pause=0) == 1
+    assert archived_ids(db) == {legacy}
+    assert db.get_message_by_id(dead) is not None
+
+
+def test_keeps_dead_lettered_message_until_handled(db, add_message, now):
+    message_id = add_message()
+    db.expand_occurrences(now, timedelta(days=1))
+    (message, scheduled_time), = db.claim_due_occurrences(WORKER, now, LEASE)
+    db.dead_letter_occurrence(message_id, scheduled_time, message.chat_id, 'permanent', 'chat not found')
+    db.mark_as_sent(message_id)
+
+    assert db.archive_inactive_messages(now + timedelta(days=60), pause=0) == 0
+
+    db.delete_dead_letters()
+    assert db.archive_inactive_messages(now + timedelta(days=60), pause=0) == 1
+
+
+def test_incremental_vacuum_only_after_offline_conversion(db, tmp_path):
+    import sqlite3
+    from database import migrations
+
+    # Database nuovo: auto_vacuum incrementale senza VACUUM
+    with sqlite3.connect(db.DB_PATH) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert not migrations.enable_incremental_vacuum(db.DB_PATH)
+
+    # Database creato prima della conversione: le migrazioni non lo toccano
+    legacy = tmp_path / 'legacy.db'
+    with sqlite3.connect(legacy) as conn:
+        conn.execute("CREATE TABLE filler (data TEXT)")
+        conn.executemany("INSERT INTO filler VALUES (?)", [('x' * 1000,)] * 200)
+    db.DB_PATH = legacy
+    db.init_db()
+    with sqlite3.connect(legacy) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+        conn.execute("DELETE FROM filler")
+    assert db.incremental_vacuum() == 0
+
+    assert migrations.main(['--db', str(legacy), '--enable-incremental-vacuum']) == 0
+    with sqlite3.connect(legacy) as conn:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def test_prunes_finished_occurrences_but_keeps_dead_letters(db, add_message, now):
+    import sqlite3
+    message_id = add_message(recurrence_type='interval', interval_seconds=60,
+                             anchor_time=now - timedelta(days=40),
+                             send_time=now - timedelta(days=40))
+    with sqlite3.connect(db.DB_PATH) as conn:
+        conn.executemany("""
+            INSERT INTO message_occurrences (message_id, scheduled_time, fire_time, status)
+            VALUES (?, ?, ?, ?)
+        """, [
+            (message_id, t.isoformat(), t.isoformat(), status)
+            for i, status in enumerate(['sent', 'dead', 'missed', 'sent', 'pending'] * 3)
+            for t in [now - timedelta(days=40) + timedelta(minutes=i)]
+        ] + [(message_id, (now - timedelta(days=1)).isoformat(),
+              (now - timedelta(days=1)).isoformat(), 'sent')])
+        dead_time = (now - timedelta(days=40) + timedelta(minutes=1)).isoformat()
+        conn.execute("""
+            INSERT INTO dead_letters (message_id, scheduled_time, chat_id, error_kind, attempts, created_at)
+            VALUES (?, ?, -100, 'permanent', 1, ?)
+        """, (message_id, dead_time, now.isoformat()))
+
+    assert db.prune_occurrences(now - timedelta(days=30), batch_size=2, pause=0) == 11
+    with sqlite3.connect(db.DB_PATH) as conn:
+        left = conn.execute("SELECT status, scheduled_time FROM message_occurrences").fetchall()
+    assert sorted(status for status, _ in left) == ['dead', 'pending', 'pending', 'pending', 'sent']
+    assert ('dead', dead_time) in left
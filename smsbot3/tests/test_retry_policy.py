@@ -0,0 +1,46 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from retry_policy import ErrorKind, RetryPolicy, classify_error
+
+METHOD = SendMessage(chat_id=-100, text='x')
+
+
+@pytest.mark.parametrize('error, kind', [
+    (TelegramRetryAfter(METHOD, 'Too Many Requests', retry_after=30), ErrorKind.FLOOD_WAIT),
+    (asyncio.TimeoutError(), ErrorKind.TRANSIENT),
+    (TelegramForbiddenError(METHOD, 'bot was kicked'), ErrorKind.PERMANENT),
+    (TelegramBadRequest(METHOD, 'Bad Request: chat not found'), ErrorKind.PERMANENT),
+    (TelegramBadRequest(METHOD, 'Bad Request: something new'), ErrorKind.UNKNOWN),
+    (RuntimeError('boom'), ErrorKind.UNKNOWN),
+])
+def test_classify_error(error, kind):
+    assert classify_error(error)[0] == kind
+
+
+def test_flood_wait_carries_retry_after():
+    assert classify_error(TelegramRetryAfter(METHOD, 'Too Many Requests', retry_after=30)) == \
+        (ErrorKind.FLOOD_WAIT, 30.0)
+
+
+def test_attempt_limits_per_kind():
+    policy = RetryPolicy(max_attempts_transient=3, max_attempts_unknown=2)
+    assert [policy.should_retry(ErrorKind.TRANSIENT, n) for n in (1, 2, 3)] == [True, True, False]
+    assert [policy.should_retry(ErrorKind.UNKNOWN, n) for n in (1, 2)] == [True, False]
+    assert not policy.should_retry(ErrorKind.PERMANENT, 1)
+
+
+def test_backoff_has_equal_jitter_and_a_cap():
+    policy = RetryPolicy(base_delay=5, max_delay=60)
+    for attempts, backoff in [(1, 5), (2, 10), (3, 20), (4, 40), (5, 60), (10, 60)]:
+        delays = [policy.delay(ErrorKind.TRANSIENT, attempts) for _ in range(200)]
+        assert all(backoff / 2 <= delay <= backoff for delay in delays)
+
+
+def test_flood_wait_delay_respects_retry_after():
+    policy = RetryPolicy(max_delay=60)
+    delay = policy.delay(ErrorKind.FLOOD_WAIT, 1, retry_after=300)
+    assert 300 <= delay <= 301
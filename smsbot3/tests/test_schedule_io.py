@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from database.models import MessagePriority, MessageType
+from schedule_io import parse_record
+
+
+def test_once_text_record(now):
+    data = parse_record({
+        'chat_id': '-100', 'message_type': 'text', 'text': 'Ciao',
+        'send_time': '2026-03-03T09:30:00+01:00', 'pin': 'sì',
+    }, now)
+
+    assert data['chat_id'] == -100
+    assert data['message_type'] == MessageType.TEXT
+    assert data['send_time'] == datetime(2026, 3, 3, 8, 30, tzinfo=pytz.UTC)
+    assert data['pin'] is True and data['active'] is True
+    assert data['recurrence_type'] == 'once'
+    assert data['priority'] == MessagePriority.NORMAL.value
+
+
+def test_weekly_record_without_send_time_gets_first_occurrence(now):
+    data = parse_record({
+        'chat_id': -100, 'message_type': 'text', 'text': 'Riunione',
+        'recurrence_type': 'weekly', 'recurrence_days': 'fri, MON',
+        'schedule_hour': 9, 'schedule_minute': 0,
+    }, now)
+
+    # Giorni normalizzati nell'ordine della settimana; lunedì 2 marzo alle 12 è passato
+    assert data['recurrence_days'] == 'mon,fri'
+    assert data['send_time'] == datetime(2026, 3, 6, 9, 0, tzinfo=pytz.UTC)
+
+
+def test_cron_and_interval_records(now):
+    cron = parse_record({
+        'chat_id': -100, 'message_type': 'text', 'text': 'Fine mese',
+        'recurrence_type': 'cron', 'cron_expression': '0  18 L * *',
+    }, now)
+    assert cron['cron_expression'] == '0 18 L * *'
+    assert cron['send_time'] == datetime(2026, 3, 31, 18, 0, tzinfo=pytz.UTC)
+
+    interval = parse_record({
+        'chat_id': -100, 'message_type': 'photo', 'media': 'file-id', 'caption': 'Foto',
+        'recurrence_type': 'interval', 'interval_seconds': '3600',
+        'anchor_time': (now - timedelta(minutes=30)).isoformat(),
+    }, now)
+    assert interval['anchor_time'] == now - timedelta(minutes=30)
+    assert interval['send_time'] == now + timedelta(minutes=30)
+
+
+@pytest.mark.parametrize('record, error', [
+    ({'message_type': 'text', 'text': 'x'}, "chat_id mancante"),
+    ({'chat_id': 1, 'message_type': 'sms', 'text': 'x'}, "message_type non valido"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'media': 'id'}, "media e caption"),
+    ({'chat_id': 1, 'message_type': 'photo', 'text': 'x', 'media': 'id'}, "text non è ammesso"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'send_time': '2026-03-01T00:00'},
+     "send_time nel passato"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'recurrence_type': 'weekly',
+      'schedule_hour': 9, 'recurrence_days': 'lun'}, "recurrence_days non valido"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'recurrence_type': 'cron',
+      'cron_expression': '0 25 * * *'}, "cron_expression non valida"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'recurrence_type': 'interval',
+      'interval_seconds': 5, 'send_time': '2026-04-01T00:00'}, "interval_seconds"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'recurrence_type': 'cron',
+      'cron_expression': '0 0 30 2 *'}, "non ha invii futuri"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'recurrence_type': 'daily',
+      'schedule_hour': 24}, "fuori intervallo"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'priority': 7,
+      'send_time': '2026-04-01T00:00'}, "priority non valida"),
+    ({'chat_id': 1, 'message_type': 'copy', 'send_time': '2026-04-01T00:00'},
+     "mancanti per un messaggio di tipo copy"),
+    ({'chat_id': 1, 'message_type': 'copy', 'media': 'id', 'source_chat_id': 5,
+      'source_message_id': 7, 'send_time': '2026-04-01T00:00'}, "non sono ammessi"),
+    ({'chat_id': 1, 'message_type': 'text', 'text': 'x', 'source_chat_id': 5,
+      'send_time': '2026-04-01T00:00'}, "vanno indicati insieme"),
+])
+def test_invalid_records(record, error, now):
+    with pytest.raises(ValueError, match=error):
+        parse_record(record, now)
+
+
+def test_rejected_chunk_reports_only_failing_rows(db, now):
+    import io
+    import json
+    import sqlite3
+
+    from schedule_io import import_schedules
+
+    # Il database rifiuta le righe di una sola chat
+    with sqlite3.connect(db.DB_PATH) as conn:
+        conn.execute("""
+            CREATE TRIGGER reject_chat BEFORE INSERT ON scheduled_messages
+            WHEN new.chat_id = -666 BEGIN SELECT RAISE(ABORT, 'chat rifiutata'); END
+        """)
+    lines = [
+        json.dumps({'chat_id': -666 if i in (3, 17) else -100, 'message_type': 'text',
+                    'text': f'Messaggio {i}', 'send_time': '2026-04-01T09:00:00+00:00'})
+        for i in range(1, 26)
+    ]
+
+    report = import_schedules(io.StringIO('\n'.join(lines)), 'jsonl', chunk_size=10, now=now)
+
+    assert report.imported == 23 and report.failed == 2
+    assert [line for line, _ in report.errors] == [3, 17]
+    assert db.count_messages(chat_id=-100) == 23
+
+
+@pytest.mark.parametrize('fmt', ['csv', 'jsonl'])
+def test_export_import_round_trip(db, add_message, now, fmt):
+    import io
+
+    from schedule_io import export_schedules, import_schedules
+
+    later = now + timedelta(days=1)
+    add_message(send_time=later, pin=True, priority=MessagePriority.HIGH.value)
+    add_message(message_type=MessageType.PHOTO, text=None, media='photo-id', caption='Foto',
+                send_time=later, source_chat_id=-500, source_message_id=42)
+    add_message(message_type=MessageType.COPY, text=None, send_time=later,
+                source_chat_id=-500, source_message_id=43)
+    add_message(recurrence_type='weekly', recurrence_days='mon,fri', send_time=later, active=False)
+    add_message(recurrence_type='cron', cron_expression='0 18 L * *', send_time=later)
+    add_message(recurrence_type='interval', interval_seconds=3600, anchor_time=now, send_time=later)
+
+    exported = io.StringIO()
+    assert export_schedules(exported, fmt) == 6
+    db.bulk_delete()
+
+    report = import_schedules(io.StringIO(exported.getvalue()), fmt, now=now)
+    assert (report.imported, report.failed) == (6, 0)
+
+    reexported = io.StringIO()
+    export_schedules(reexported, fmt)
+    assert reexported.getvalue() == exported.getvalue()
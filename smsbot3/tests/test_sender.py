@@ -0,0 +1,78 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import CopyMessage
+
+from database.models import MessageType
+from sender import send_content
+
+
+class FakeBot:
+    """Bot che registra le chiamate; copy_message fallisce se `copy_error` è impostato."""
+
+    def __init__(self, copy_error=None):
+        self.copy_error = copy_error
+        self.calls = []
+
+    async def copy_message(self, **kwargs):
+        self.calls.append(('copy_message', kwargs))
+        if self.copy_error:
+            raise self.copy_error
+        return SimpleNamespace(message_id=10)
+
+    def __getattr__(self, method):
+        async def send(**kwargs):
+            self.calls.append((method, kwargs))
+            return SimpleNamespace(message_id=20)
+        return send
+
+
+def content(message_type=MessageType.PHOTO, **overrides):
+    data = {'message_type': message_type, 'text': None, 'media': 'photo-id', 'caption': 'Foto',
+            'source_chat_id': -500, 'source_message_id': 42}
+    data.update(overrides)
+    return data
+
+
+def bad_request():
+    method = CopyMessage(chat_id=-100, from_chat_id=-500, message_id=42)
+    return TelegramBadRequest(method, 'Bad Request: message to copy not found')
+
+
+def test_copies_the_original_when_available():
+    bot = FakeBot()
+    sent = asyncio.run(send_content(bot, -100, content()))
+    assert sent.message_id == 10
+    assert bot.calls == [('copy_message', {'chat_id': -100, 'from_chat_id': -500, 'message_id': 42})]
+
+
+def test_falls_back_to_stored_content_when_copy_fails():
+    bot = FakeBot(copy_error=bad_request())
+    lost = []
+
+    sent = asyncio.run(send_content(bot, -100, content(), on_source_lost=lambda: lost.append(True)))
+
+    assert sent.message_id == 20
+    assert [name for name, _ in bot.calls] == ['copy_message', 'send_photo']
+    assert bot.calls[1][1] == {'chat_id': -100, 'photo': 'photo-id', 'caption': 'Foto'}
+    assert lost == [True]
+
+
+def test_copy_only_content_has_no_fallback():
+    bot = FakeBot(copy_error=bad_request())
+    lost = []
+
+    with pytest.raises(TelegramBadRequest):
+        asyncio.run(send_content(bot, -100, content(MessageType.COPY, media=None, caption=None),
+                                 on_source_lost=lambda: lost.append(True)))
+    assert lost == []
+
+
+def test_without_source_sends_stored_content():
+    bot = FakeBot()
+    asyncio.run(send_content(bot, -100, content(MessageType.TEXT, text='Ciao', media=None,
+                                                caption=None, source_chat_id=None,
+                                                source_message_id=None)))
+    assert bot.calls == [('send_message', {'chat_id': -100, 'text': 'Ciao'})]
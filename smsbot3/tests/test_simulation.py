@@ -0,0 +1,23 @@
+import asyncio
+from datetime import timedelta
+
+from simulation import build_schedules, run_simulation
+
+
+def test_virtual_months_run_in_one_tick_per_fire_time(db, now, monkeypatch):
+    monkeypatch.setattr(db, 'SHARED_CONNECTION', True)
+    until = now + timedelta(days=60)
+    schedules = build_schedules(20, now, until, seed=1)
+
+    try:
+        report = asyncio.run(run_simulation(schedules, now, until))
+    finally:
+        db.close_shared_connection()
+
+    assert report.sends == report.expected > 0
+    assert report.mismatches == []
+    assert report.max_delay <= 1
+    # Lo scheduler salta da un invio al successivo invece di svegliarsi ogni minuto
+    ticks = report.phases.ticks[0]
+    assert ticks <= report.sends + 60
+    assert ticks < (until - now).total_seconds() / 60 / 4